@@ -0,0 +1,33 @@
+# accumulators - keep the distinct values found across every chunk of the csv file
+import lazy_modules as lm  # for importing pandas when first used
+import logging
+
+pd = lm.lazy_import("pandas")
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+
+# noinspection SpellCheckingInspection
+class uniqueAccumulator(object):
+    def __init__(self, columns):
+        # Keep each distinct row of columns (list of column names) the first time it is added. Rows are stored as
+        # tuples in an insertion ordered dictionary, so memory depends on the number of distinct rows instead of the
+        # size of the file, and the rows come back in the order they were first found (the same order as
+        # concatenating every chunk and dropping duplicates). Rows with missing values are not kept.
+        self.columns = columns
+        self.rows = {}
+
+    def add(self, df):
+        # add the distinct rows of a chunk data frame (df) that has the accumulator columns
+        chunk_df = df.loc[:, self.columns].dropna().drop_duplicates()
+        self.rows.update(dict.fromkeys(zip(*(chunk_df[col].tolist() for col in self.columns))))
+
+    def add_values(self, values):
+        # add a list of values to an accumulator with a single column
+        self.rows.update(dict.fromkeys((val,) for val in values if not pd.isna(val)))
+
+    def to_df(self):
+        # return the distinct rows as a data frame
+        return pd.DataFrame(list(self.rows), columns=self.columns)
@@ -1,5 +1,6 @@
 # for handling CLI arguments
 import argparse
+import csv_handler  # for csv engine choices
 from datetime import date
 import logging
 import sys
@@ -15,14 +16,19 @@ def show_merge_warning(sib_prod_id, master_prod_id, json_file_name):
     master_prod_id = str(master_prod_id)
     if sib_prod_id != "":
         msg = "Product " + sib_prod_id + " is a sibling table in a merged product (Master: " + master_prod_id + \
-              ") and cannot be inserted alone nor can it be updated automatically in a date range. See " + \
-              json_file_name + " for details.\n"
+              ") and cannot be inserted alone. See " + json_file_name + " for details.\n"
     else:
-        msg = "Product " + master_prod_id + " is the master table in a merged product and cannot be inserted alone " \
-              "nor can it be updated automatically in a date range. See " + json_file_name + " for details.\n"
+        msg = "Product " + master_prod_id + " is the master table in a merged product and cannot be inserted " \
+              "alone. See " + json_file_name + " for details.\n"
     return msg
 
 
+# options of the etl_service.etlService that runs a load (set when the daemon starts, not for each job)
+SERVICE_OPTIONS = ["minrefyear", "engine", "memory_budget", "workers", "sharded_read", "cache_dir", "product_workers",
+                   "sibling_workers", "append_periods", "result_tables", "query_views", "metrics_port",
+                   "metrics_file"]
+
+
 class argParser(object):
     def __init__(self):
         self.parser = argparse.ArgumentParser()
@@ -42,6 +48,70 @@ class argParser(object):
                                  help="Earliest reference date to process from data file. Example: --minrefyear 2017 "
                                       "will only add data with a reference date >= 2017-01-01. Note: this argument will"
                                       " be ignored for justice tables (subject code 35) that have mixed geographies.")
+        self.parser.add_argument("--engine", choices=csv_handler.CSV_ENGINES, default="pandas",
+                                 help="CSV parser used to read the product data file. \"pandas\" (default) uses the "
+                                      "pandas C parser, \"arrow\" uses the multithreaded pyarrow parser and keeps "
+                                      "repeated columns as categories.")
+        self.parser.add_argument("--memory-budget", dest="memory_budget", type=int, metavar="MB",
+                                 help="Resident memory (MB) the process should stay under while loading product data. "
+                                      "The number of rows read from the file at a time is adjusted between chunks to "
+                                      "stay within the budget. If absent, chunks are a fixed size.")
+        self.parser.add_argument("--workers", type=int, default=0, metavar="N",
+                                 help="Number of worker processes that transform chunks of the product data file while "
+                                      "the main process reads the file and writes to the database. 0 (default) does "
+                                      "all of the work in the main process.")
+        self.parser.add_argument("--sharded-read", dest="sharded_read", action="store_true",
+                                 help="Extract the product csv file and split it into byte range shards that the "
+                                      "worker processes parse as well as transform, instead of parsing the whole file "
+                                      "in the main process. Needs --workers. Rows are still written in file order.")
+        self.parser.add_argument("--cache-dir", dest="cache_dir", metavar="PATH",
+                                 help="Folder for a parquet cache of the formatted product data. The first load of a "
+                                      "product release is cached, and later loads of the same release (ex. a rebuild "
+                                      "after a database restore) read the cache instead of downloading and parsing "
+                                      "the csv file. Requires pyarrow.")
+        self.parser.add_argument("--product-workers", dest="product_workers", type=int, default=1, metavar="N",
+                                 help="Number of products to update at the same time (default 1). A merged product "
+                                      "(master and siblings) always runs as a single unit, master first.")
+        self.parser.add_argument("--sibling-workers", dest="sibling_workers", type=int, default=1, metavar="N",
+                                 help="Number of siblings of a merged product to update at the same time once the "
+                                      "master is loaded (default 1). The siblings share the master indicators, "
+                                      "geographic levels and dates, read from the database once.")
+        self.parser.add_argument("--append-periods", dest="append_periods", action="store_true",
+                                 help="Append mode: when a product has only gained new reference periods since it was "
+                                      "loaded (same dimension members, new periods after the loaded ones), load only "
+                                      "the new periods and leave the loaded data in place instead of deleting and "
+                                      "reloading the whole product. Revisions to loaded periods are not picked up. "
+                                      "Other products are reloaded as usual.")
+        self.parser.add_argument("--result-tables", dest="result_tables", action="store_true",
+                                 help="Fill gis.IndicatorResult with the formatted rows of each indicator (values, "
+                                      "names, units, levels and null reasons) after a product is loaded, and point "
+                                      "the PrimaryQuery of its indicators at it instead of the join over the gis "
+                                      "tables. The table must exist (sql_scripts/create_indicator_result_table.sql).")
+        self.parser.add_argument("--query-views", dest="query_views", action="store_true",
+                                 help="Create a gis view for each chart query and value format, and store only a "
+                                      "select from the view with the indicator ids in the PrimaryQuery of "
+                                      "gis.IndicatorMetaData and the Query of gis.RelatedCharts, instead of the whole "
+                                      "query for every indicator. The queries return the same columns. The "
+                                      "PrimaryQuery of --result-tables is kept as it is.")
+        self.parser.add_argument("--metrics-port", dest="metrics_port", type=int, metavar="PORT",
+                                 help="Serve live load metrics (rows, chunk and database/WDS latency, product ETA) in "
+                                      "the Prometheus text format on http://127.0.0.1:PORT/metrics.")
+        self.parser.add_argument("--metrics-file", dest="metrics_file", metavar="PATH",
+                                 help="Write live load metrics in the Prometheus text format to this file every 15 "
+                                      "seconds (ex. a .prom file in the node exporter textfile collector folder).")
+        self.parser.add_argument("--plan-only", dest="plan_only", action="store_true",
+                                 help="Print the products that would be updated (a date range is deduplicated and "
+                                      "changed merged products are expanded to the master and all siblings) with "
+                                      "their estimated size, then exit without loading any data.")
+        self.parser.add_argument("--daemon", metavar="QUEUE_DIR",
+                                 help="Run as a long lived worker: wait for jobs in this job queue folder and run them "
+                                      "one at a time, keeping the database connection, WDS code sets and reference "
+                                      "table lookups between jobs. Only one daemon can serve a queue. Stop with "
+                                      "Ctrl+C.")
+        self.parser.add_argument("--submit", metavar="QUEUE_DIR",
+                                 help="Add the insert/update given by the other arguments to this job queue folder "
+                                      "for a daemon to run, instead of running it now. The daemon loads it with its "
+                                      "own options (ex. --workers).")
 
         self.args = self.parser.parse_args()
 
@@ -52,11 +122,42 @@ class argParser(object):
         if self.args.minrefyear:
             if len(str(self.args.minrefyear)) != 4:
                 ret_msg = "Minimum reference year must be a 4 digit number."
+        if self.args.memory_budget is not None and self.args.memory_budget <= 0:
+            ret_msg = "Memory budget must be a positive number of MB."
+        if self.args.workers < 0:
+            ret_msg = "Number of workers cannot be negative."
+        if self.args.sharded_read and self.args.workers == 0:
+            ret_msg = "Sharded reads need worker processes to parse the shards (--workers N)."
+        if self.args.product_workers < 1:
+            ret_msg = "Number of product workers must be at least 1."
+        if self.args.sibling_workers < 1:
+            ret_msg = "Number of sibling workers must be at least 1."
+        if self.args.metrics_port is not None and not 0 < self.args.metrics_port < 65536:
+            ret_msg = "Metrics port must be between 1 and 65535."
+        if self.args.engine == "arrow" and not csv_handler.arrow_available():
+            ret_msg = "The arrow engine requires the pyarrow package. Install pyarrow or use --engine pandas."
+        if self.args.cache_dir and not csv_handler.arrow_available():
+            ret_msg = "The parquet cache requires the pyarrow package. Install pyarrow or remove --cache-dir."
+
+        if self.args.submit:
+            # a job only has the products to load, the daemon loads them with the options it was started with
+            load_options = ["--" + name.replace("_", "-") for name in SERVICE_OPTIONS
+                            if getattr(self.args, name) != self.parser.get_default(name)]
+            if load_options:
+                ret_msg = "Jobs are loaded with the options of the daemon. Give " + ", ".join(load_options) + \
+                          " when starting the daemon instead of with --submit."
 
-        if self.args.insert_new_table:
+        if self.args.daemon:
+            # the daemon gets its products from the job queue
+            if self.args.insert_new_table or self.args.prodid or self.args.start or self.args.end or \
+                    self.args.plan_only or self.args.submit:
+                ret_msg = "The daemon gets its products from the job queue. Use --submit to add jobs."
+        elif self.args.insert_new_table:
             # arguments for inserting a new product
             if not self.args.prodid:
                 ret_msg = "Product ID is required for new products created with the -i flag."
+            elif self.args.plan_only:
+                ret_msg = "The -i flag cannot be combined with --plan-only."
         else:
             # arguments for append
             if self.args.start and self.args.end and not self.args.prodid:
@@ -0,0 +1,314 @@
+# benchmarks for the data frame handling functions
+# Usage: python benchmark.py [--suite keys csv builders startup] [--scales small medium large]
+import argparse
+import csv_handler  # for reading the product csv file
+import datetime
+import dfhandler as dfh  # for altering pandas data frames
+import importlib.util  # for finding installed modules
+import indexes as idx  # for indicator and geography lookups
+import itertools as it  # for iterators
+import json_handler as jh  # for product defaults
+import memory_governor as mg  # for the default chunk size
+import multiprocessing as mp
+import os
+import pandas as pd
+import re  # regular expressions
+import subprocess
+import synthetic_cube as sc  # for sample products
+import sys
+import tempfile
+import time
+import timeit
+
+try:
+    import psutil  # optional, needed for peak memory on windows
+except ImportError:
+    psutil = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# results of every run, to compare against (benchmark_output is in .gitignore so results are not committed)
+RESULTS_FILE = os.path.join(BENCH_DIR, "benchmark_output", "benchmark_results.csv")
+RESULT_COLUMNS = ["run_time", "commit", "scale", "function", "rows", "seconds"]
+REGRESSION_SHARE = 0.2  # flag functions that are this much slower than the previous run
+HEAVY_MODULES = ["numpy", "pandas", "pyarrow", "pyodbc", "requests", "sqlalchemy"]  # not imported until used
+
+# sample product sizes for the builder benchmarks: members in each dimension (other than geography), number of
+# geographies and annual reference periods. Indicators = member combinations x periods, rows = indicators x geos.
+BUILDER_SCALES = {
+    "small": {"members": [5, 10], "geos": 20, "periods": 5},  # 250 indicators, 5,000 rows
+    "medium": {"members": [10, 20], "geos": 100, "periods": 10},  # 2,000 indicators, 200,000 rows
+    "large": {"members": [10, 20, 4], "geos": 125, "periods": 10}  # 8,000 indicators, 1,000,000 rows
+}
+
+
+def build_dimension_unique_keys_iterrows(dmf):
+    # Original row by row version of dfh.build_dimension_unique_keys, kept as a baseline for timing and to confirm
+    # that the vectorized version returns the same output.
+    dim_mem_names = {}
+    dim_mem_ids = {}
+    for index, row in dmf.iterrows():
+        dim_id = row["DimensionId"]
+        mem_id = row["DimensionValueId"]
+        patt = r"^(?:(?:0){0,3}[0-9]|(?:0){0,2}[1-9][0-9]|(?:0){0,1}[1-9][0-9][0-9])\."  # regex match for 0. to 1000.
+        mem_name = re.sub(patt, "", row["Display_EN"]).lstrip()  # "02. Resident owners only" -->removes "02. "
+        dim_mem_names.setdefault(dim_id, []).append(mem_name)
+        dim_mem_ids.setdefault(dim_id, []).append(mem_id)
+
+    mem_names = ["-".join(map(str, tup)) for tup in it.product(*dim_mem_names.values())]
+    mem_ids = ["-".join(map(str, tup)) for tup in it.product(*dim_mem_ids.values())]
+    return pd.DataFrame({"IndicatorFmt": mem_names, "DimensionUniqueKey": mem_ids})
+
+
+def build_dimension_member_frame(members_per_dim):
+    # build a dataframe shaped like scdb.get_dimensions_and_members_by_product with the number of members in each
+    # dimension given by members_per_dim (ex. [1, 20, 30, 40] --> "Date" + 3 dimensions, 24,000 combinations)
+    rows = []
+    next_id = 1
+    for dim_pos, mem_count in enumerate(members_per_dim, start=1):
+        for mem_pos in range(1, mem_count + 1):
+            rows.append({"DimensionValueId": next_id, "DimensionId": dim_pos,
+                         "Display_EN": str(mem_pos).zfill(2) + ". Member " + str(dim_pos) + "-" + str(mem_pos),
+                         "ValueDisplayOrder": mem_pos, "ValueDisplayParent": None, "IndicatorThemeId": 99999999,
+                         "Dimension_EN": "Dimension " + str(dim_pos), "DisplayOrder": dim_pos})
+            next_id += 1
+    return pd.DataFrame(rows)
+
+
+def time_startup(code):
+    # return the wall time (seconds) to start a new interpreter in the benchmark folder and run code
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=BENCH_DIR, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start_time
+
+
+def time_function(func, args, repeat):
+    # return the best run time (seconds) of func(*args) over repeat runs
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=repeat))
+
+
+def bench_dimension_unique_keys(scales, repeat):
+    # compare the vectorized and iterrows versions of build_dimension_unique_keys for each list of member counts
+    print("build_dimension_unique_keys")
+    for members_per_dim in scales:
+        dmf = build_dimension_member_frame(members_per_dim)
+        old_df = build_dimension_unique_keys_iterrows(dmf)
+        new_df = dfh.build_dimension_unique_keys(dmf)
+        if not old_df.astype(str).equals(new_df.astype(str)):
+            raise AssertionError("Vectorized output does not match for " + str(members_per_dim))
+
+        old_time = time_function(build_dimension_unique_keys_iterrows, [dmf], repeat)
+        new_time = time_function(dfh.build_dimension_unique_keys, [dmf], repeat)
+        print("  members " + "x".join(map(str, members_per_dim)) + " (" + f"{new_df.shape[0]:,}" + " keys): iterrows " +
+              f"{old_time:.3f}" + "s, vectorized " + f"{new_time:.3f}" + "s, speedup " +
+              f"{old_time / new_time:.1f}" + "x")
+
+
+def get_peak_rss():
+    # return the peak resident memory (bytes) of the current process
+    if psutil is not None and hasattr(psutil.Process().memory_info(), "peak_wset"):
+        retval = psutil.Process().memory_info().peak_wset  # windows
+    else:
+        import resource  # unix only
+        retval = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # linux reports KB
+    return retval
+
+
+def measure_csv_engine(zip_path, csv_name, col_dict, chunk_size, engine):
+    # read the whole zipped csv with the specified engine, return (seconds, peak memory growth in bytes, rows)
+    if engine == "arrow":
+        csv_handler.pa.total_allocated_bytes()  # load arrow before taking the baseline
+    start_rss = get_peak_rss()
+    start_time = time.perf_counter()
+    rows = 0
+    for chunk in csv_handler.read_csv_chunks(zip_path, csv_name, col_dict, chunk_size, engine):
+        rows += chunk.shape[0]
+    elapsed = time.perf_counter() - start_time
+    return elapsed, get_peak_rss() - start_rss, rows
+
+
+def bench_csv_engines(zip_path, csv_name, dim_names, chunk_size, engines):
+    # compare parse time and peak memory for each csv engine. Each engine runs in a fresh process so that memory
+    # held by one engine does not count against the next.
+    print("read_csv_chunks (" + zip_path + ")")
+    col_dict = dfh.build_column_and_type_dict(dim_names)
+    for engine in engines:
+        with mp.Pool(1) as pool:
+            elapsed, peak, rows = pool.apply(measure_csv_engine, (zip_path, csv_name, col_dict, chunk_size, engine))
+        print("  " + engine + ": " + f"{rows:,}" + " rows in " + f"{elapsed:.2f}" + "s (" +
+              f"{rows / elapsed:,.0f}" + " rows/s), peak memory " + f"{peak / 1048576:,.1f}" + " MB")
+
+
+def time_chunk_builders(zip_path, csv_name, pid_meta, ind_index, geo_index, df_null, chunk_size):
+    # Run the chunk stage of pipeline.transform_chunk over the whole zipped csv. Returns the total seconds spent in
+    # each builder and the number of csv rows. Reading the csv and the lookups are not timed.
+    pid_str = str(sc.SYNTHETIC_PID)
+    col_dict = dfh.build_column_and_type_dict(pid_meta["dimension_names"]["en"])
+    totals = {"setup_chunk_columns": 0.0, "build_indicator_values_df": 0.0,
+              "build_geography_reference_for_indicator_df": 0.0}
+    rows = 0
+    interner = idx.codeInterner()  # shared by the chunks like pipeline.build_chunk_context
+    for chunk in csv_handler.read_csv_chunks(zip_path, csv_name, col_dict, chunk_size, "pandas"):
+        rows += chunk.shape[0]
+        start_time = time.perf_counter()
+        chunk_df = dfh.setup_chunk_columns(chunk, pid_str, pid_meta["release_date"], False, [], interner)
+        totals["setup_chunk_columns"] += time.perf_counter() - start_time
+
+        chunk_df["IndicatorId"] = ind_index.get_indicator_ids(chunk_df["IndicatorCode"])
+        chunk_df["HasGeographyReference"] = geo_index.lookup(chunk_df["DGUID"])[0]
+
+        start_time = time.perf_counter()
+        dfh.build_indicator_values_df(chunk_df, df_null, 0)
+        totals["build_indicator_values_df"] += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        dfh.build_geography_reference_for_indicator_df(chunk_df)
+        totals["build_geography_reference_for_indicator_df"] += time.perf_counter() - start_time
+    return totals, rows
+
+
+def bench_builders(scale_names, repeat, chunk_size):
+    # Time the data frame builders used to load a product on a synthetic product for each scale (see BUILDER_SCALES).
+    # Product level builders are timed on the whole product and chunk level builders on every chunk of the csv.
+    # Returns a list of results (dictionaries with scale, function, rows and seconds).
+    print("dataframe builders")
+    results = []
+    pid = sc.SYNTHETIC_PID
+    prod_defaults = jh.get_product_defaults(str(pid), os.path.join(BENCH_DIR, "product_defaults.json"))
+    existing_md_df = pd.DataFrame(columns=["IndicatorThemeId", "IndicatorCode", "DefaultBreaksAlgorithmId",
+                                           "DefaultBreaks", "PrimaryChartTypeId", "ColorTo", "ColorFrom",
+                                           "ChartTypeId", "ChartTitle_EN", "ChartTitle_FR", "FieldAlias_EN",
+                                           "FieldAlias_FR"])  # no existing chart info (new product)
+    df_null = pd.DataFrame({"NullReasonId": [1, 2, 3, 4], "Symbol": ["..", "...", "x", "F"]})
+
+    for scale in scale_names:
+        size = BUILDER_SCALES[scale]
+        cube_meta = sc.build_cube_metadata(pid, size["members"], size["geos"], size["periods"])
+        pid_meta = sc.build_product_metadata(cube_meta)
+        ref_dates = dfh.build_reference_dates(pid_meta["start_date"], pid_meta["end_date"], pid_meta["freq"])
+        ind_args = [pid, pid_meta["release_date"], pid_meta["dimensions_and_members"], sc.UOM_CODES, ref_dates, 1,
+                    False, []]
+        df_ind = dfh.build_indicator_df(*ind_args)
+        df_dim_keys = dfh.build_dimension_unique_keys(sc.build_dimension_member_df(pid_meta, pid))
+        ind_rows = df_ind.shape[0]
+
+        timings = [("build_indicator_df", ind_rows, time_function(dfh.build_indicator_df, ind_args, repeat)),
+                   ("build_indicator_metadata_df", ind_rows,
+                    min(timeit.repeat(lambda: dfh.build_indicator_metadata_df(df_ind.copy(), prod_defaults,
+                                                                              df_dim_keys.copy(), existing_md_df),
+                                      number=1, repeat=repeat))),
+                   ("build_related_charts_df", ind_rows,
+                    time_function(dfh.build_related_charts_df, [df_ind, prod_defaults, existing_md_df], repeat))]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, str(pid) + "-en.zip")
+            sc.write_cube_csv_zip(cube_meta, zip_path)
+            ind_index = idx.indicatorIndex(df_ind)
+            geo_index = idx.geographyIndex(sc.build_geography_reference_df(cube_meta))
+            best = {}
+            for run in range(repeat):
+                run_totals, csv_rows = time_chunk_builders(zip_path, str(pid) + ".csv", pid_meta, ind_index,
+                                                           geo_index, df_null, chunk_size)
+                best = {func: min(secs, best.get(func, secs)) for func, secs in run_totals.items()}
+            timings += [(func, csv_rows, secs) for func, secs in best.items()]
+
+        print("  " + scale + " (" + f"{ind_rows:,}" + " indicators, " + f"{csv_rows:,}" + " csv rows)")
+        for func, rows, secs in timings:
+            print("    " + func + ": " + f"{secs:.3f}" + "s (" + f"{rows / secs:,.0f}" + " rows/s)")
+            results.append({"scale": scale, "function": func, "rows": rows, "seconds": secs})
+    return results
+
+
+def bench_startup(repeat):
+    # Time starting a new interpreter and importing main.py, which every scheduled run pays before it knows whether
+    # there is any work, then the same with the heavy modules imported as well (the cost deferred until a product is
+    # loaded). Lists any heavy module that main.py imports right away. Returns a list of results like bench_builders.
+    print("startup")
+    installed = [module for module in HEAVY_MODULES if importlib.util.find_spec(module) is not None]
+    cases = [("python", "pass"),
+             ("import main", "import main"),
+             ("import main and heavy modules", "import main, " + ", ".join(installed))]
+    results = []
+    try:
+        eager = subprocess.run([sys.executable, "-c", "import main, sys; print(' '.join(m for m in " +
+                                repr(installed) + " if m in sys.modules))"],
+                               cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        for func, code in cases:
+            secs = min(time_startup(code) for run in range(repeat))
+            print("  " + func + ": " + f"{secs:.3f}" + "s")
+            results.append({"scale": "startup", "function": func, "rows": 0, "seconds": secs})
+    except subprocess.CalledProcessError as err:
+        print("  main.py could not be imported (is config.py set up?): " + err.stderr.strip().splitlines()[-1])
+    else:
+        print("  heavy modules imported by main.py: " + (eager if eager else "none"))
+    return results
+
+
+def get_git_commit():
+    # return the short hash of the current commit, empty if it is not available
+    try:
+        retval = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        retval = ""
+    return retval
+
+
+def save_results(results, results_path):
+    # Append the results of this run to the csv file (results_path) and compare each one to the last saved result
+    # for the same scale, function and rows. Functions that got more than REGRESSION_SHARE slower are listed.
+    prev_df = pd.read_csv(results_path) if os.path.exists(results_path) else pd.DataFrame(columns=RESULT_COLUMNS)
+    run_df = pd.DataFrame(results)
+    run_df["run_time"] = datetime.datetime.now().isoformat(timespec="seconds")
+    run_df["commit"] = get_git_commit()
+    run_df = run_df.loc[:, RESULT_COLUMNS]
+
+    last_df = prev_df.drop_duplicates(subset=["scale", "function", "rows"], keep="last")
+    compare_df = pd.merge(run_df, last_df.loc[:, ["scale", "function", "rows", "seconds", "commit"]],
+                          on=["scale", "function", "rows"], how="inner", suffixes=("", "_prev"))
+    compare_df["change"] = compare_df["seconds"] / compare_df["seconds_prev"] - 1
+    if compare_df.shape[0] > 0:
+        print("Compared to the previous run:")
+        for row in compare_df.itertuples():
+            flag = "  <-- slower" if row.change > REGRESSION_SHARE else ""
+            print("  " + row.scale + " " + row.function + ": " + f"{row.change:+.0%}" + " (was " +
+                  f"{row.seconds_prev:.3f}" + "s at " + str(row.commit_prev) + ")" + flag)
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    run_df.to_csv(results_path, mode="a", header=not os.path.exists(results_path), index=False)
+    print("Results saved to " + results_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs for each case (best is kept).")
+    parser.add_argument("--csv-rows", type=int, default=500000, help="Approximate number of rows in the sample csv "
+                                                                     "used to compare csv engines.")
+    parser.add_argument("--suite", nargs="+", choices=["keys", "csv", "builders", "startup"],
+                        default=["keys", "csv", "builders", "startup"], help="Benchmarks to run.")
+    parser.add_argument("--scales", nargs="+", choices=list(BUILDER_SCALES), default=["small", "medium"],
+                        help="Sample product sizes for the builder benchmarks.")
+    parser.add_argument("--results", default=RESULTS_FILE, help="Csv file the builder and startup results are added "
+                                                                 "to (default benchmark_output/benchmark_results.csv).")
+    parser.add_argument("--no-save", dest="no_save", action="store_true", help="Do not save the builder and startup "
+                                                                                "results.")
+    bench_args = parser.parse_args()
+    if "keys" in bench_args.suite:
+        bench_dimension_unique_keys([[1, 10, 10], [1, 20, 30, 40], [1, 10, 20, 25, 40]], bench_args.repeat)
+
+    if "csv" in bench_args.suite:
+        bench_engines = ["pandas", "arrow"] if csv_handler.arrow_available() else ["pandas"]
+        sample_years = 20
+        sample_geos = max(1, bench_args.csv_rows // (sample_years * 20 * 25))
+        sample_meta = sc.build_cube_metadata(sc.SYNTHETIC_PID, [20, 25], sample_geos, sample_years)
+        sample_dims = sc.build_product_metadata(sample_meta)["dimension_names"]["en"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sample_zip = os.path.join(tmp_dir, str(sc.SYNTHETIC_PID) + ".zip")
+            sc.write_cube_csv_zip(sample_meta, sample_zip)
+            bench_csv_engines(sample_zip, str(sc.SYNTHETIC_PID) + ".csv", sample_dims, 20000, bench_engines)
+
+    saved_results = []
+    if "builders" in bench_args.suite:
+        saved_results += bench_builders(bench_args.scales, bench_args.repeat, mg.DEFAULT_CHUNK_SIZE)
+    if "startup" in bench_args.suite:
+        saved_results += bench_startup(bench_args.repeat)
+    if saved_results and not bench_args.no_save:
+        save_results(saved_results, bench_args.results)
@@ -1,6 +1,9 @@
 # rename as config.py to use
 
+# backend is "mssql" (default) or "sqlite". For sqlite, only database is used: a file path, or ":memory:" for a
+# database that only lasts for the run. The gis tables are created automatically.
 sql_conn = {
+    "backend": "mssql",
     "driver": "ODBC Driver 17 for SQL Server",
     "server": "your-server-name",
     "database": "your-database-name"
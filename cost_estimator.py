@@ -0,0 +1,98 @@
+# cost estimator - estimates the size of a product load from its cube metadata before anything is downloaded
+import dfhandler as dfh  # for reference dates
+import logging
+import memory_governor as mg  # for chunk size limits
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+# Approximate memory use, measured on sample WDS files with pandas. These only need to be close enough to compare
+# products and to keep a load inside the memory budget.
+BASE_BYTES = 150 * 1048576  # python, pandas, database drivers, code sets and the geography index
+INDICATOR_ROW_BYTES = 2000  # gis.Indicator data frame (names, codes, display html) per indicator
+CHUNK_ROW_BYTES = 1500  # raw csv chunk, formatted chunk and IndicatorValues/GeographyReference frames per row
+DIMENSION_ROW_BYTES = 60  # extra bytes per chunk row for each dimension column
+CHUNK_SHARE = 0.5  # share of the memory budget left over for chunks after the fixed cost
+
+
+def count_members(pid_meta, geography):
+    # return the number of members in the geography dimension (geography=True) or the number of member combinations
+    # of the other dimensions (geography=False) from the product metadata (pid_meta)
+    retval = 1
+    for dim in pid_meta["dimensions_and_members"]:
+        is_geo = dim.get("dimensionNameEn", "").upper() == "GEOGRAPHY"
+        if is_geo == geography:
+            retval *= max(len(dim.get("member", [])), 1)
+    return retval
+
+
+def count_reference_periods(pid_meta, prod_id, min_ref_year, mixed_geo_justice_pids):
+    # return the number of reference periods that will be loaded for the product (prod_id) based on the cube
+    # start/end dates and frequency in pid_meta. Periods before min_ref_year are not counted (except for justice
+    # tables with mixed geographies, which load every period).
+    ref_dates = dfh.build_reference_dates(pid_meta["start_date"], pid_meta["end_date"], pid_meta["freq"])
+    if min_ref_year and int(prod_id) not in mixed_geo_justice_pids:
+        ref_dates = ref_dates[ref_dates.year >= min_ref_year]
+    return max(len(ref_dates), 1)
+
+
+def estimate_product_cost(prod_id, functional_pid, pid_meta, min_ref_year, mixed_geo_justice_pids, memory_budget,
+                          workers):
+    # Estimate the rows and peak memory of loading a product (prod_id) from its metadata (pid_meta), and pick the chunk
+    # size for the load. functional_pid is the product id the data is saved under (the master id for siblings),
+    # memory_budget is in MB (False for no budget) and workers is the number of chunk transform processes.
+    # status is "ok", "warn" (close to the budget) or "refuse" (cannot fit in the budget).
+    periods = count_reference_periods(pid_meta, functional_pid, min_ref_year, mixed_geo_justice_pids)
+    indicators = count_members(pid_meta, False) * periods
+    geographies = count_members(pid_meta, True)
+    rows = indicators * geographies
+
+    row_bytes = CHUNK_ROW_BYTES + DIMENSION_ROW_BYTES * len(pid_meta["dimension_names"]["en"])
+    in_flight = 1 if workers == 0 else workers * 3 + 1  # queued, being transformed and being written
+    fixed_bytes = BASE_BYTES + indicators * INDICATOR_ROW_BYTES
+    chunk_size = mg.DEFAULT_CHUNK_SIZE
+    status = "ok"
+    if memory_budget:
+        budget_bytes = memory_budget * 1048576
+        chunk_bytes = max(budget_bytes - fixed_bytes, 0) * CHUNK_SHARE
+        chunk_size = max(mg.MIN_CHUNK_SIZE, min(mg.MAX_CHUNK_SIZE, int(chunk_bytes / (row_bytes * in_flight))))
+        if fixed_bytes + mg.MIN_CHUNK_SIZE * row_bytes * in_flight > budget_bytes:
+            status = "refuse"
+        elif fixed_bytes > budget_bytes * CHUNK_SHARE:
+            status = "warn"
+    chunk_size = max(mg.MIN_CHUNK_SIZE, min(chunk_size, rows))  # no point reading more rows than the file has
+
+    cost = {
+        "pid": prod_id,
+        "indicators": indicators,
+        "geographies": geographies,
+        "periods": periods,
+        "rows": rows,
+        "chunk_size": chunk_size,
+        "memory_mb": (fixed_bytes + chunk_size * row_bytes * in_flight) / 1048576,
+        "status": status
+    }
+    return cost
+
+
+def log_product_costs(costs, memory_budget, notes=None):
+    # log the estimate for each product (costs is a list of dictionaries from estimate_product_cost) and the total.
+    # notes is an optional dictionary of pid --> why the product is being updated (ex. from planner.describe_change).
+    notes = notes or {}
+    costs = list(costs)  # may be a dictionary view
+    log.info("Estimated product sizes:")
+    for cost in costs:
+        note = " - " + notes[cost["pid"]] if cost["pid"] in notes else ""
+        log.info("  " + str(cost["pid"]) + ": " + f"{cost['rows']:,}" + " rows (" + f"{cost['indicators']:,}" +
+                 " indicators x " + f"{cost['geographies']:,}" + " geographies), ~" + f"{cost['memory_mb']:,.0f}" +
+                 " MB with chunks of " + f"{cost['chunk_size']:,}" + " rows" + note)
+        if cost["status"] == "refuse":
+            log.error("Product " + str(cost["pid"]) + " is not expected to fit in the memory budget (" +
+                      str(memory_budget) + " MB) and will not be loaded.")
+        elif cost["status"] == "warn":
+            log.warning("Product " + str(cost["pid"]) + " is expected to use most of the memory budget (" +
+                        str(memory_budget) + " MB) before any data is read.")
+    loaded = [cost for cost in costs if cost["status"] != "refuse"]
+    log.info("Total: " + str(len(loaded)) + " of " + str(len(costs)) + " product(s) to load, " +
+             f"{sum(cost['rows'] for cost in loaded):,}" + " rows")
@@ -0,0 +1,177 @@
+# csv file reading - streams a product csv from the zipped full table download as pandas dataframe chunks, or splits
+# the extracted csv into byte range shards that worker processes parse on their own (sharded reads)
+import io
+import lazy_modules as lm  # for importing pandas and pyarrow when first used
+import logging
+import os
+import zipfile
+
+pd = lm.lazy_import("pandas")
+try:
+    pa = lm.lazy_import("pyarrow")
+    pa_csv = lm.lazy_import("pyarrow.csv")
+except ImportError:  # pyarrow is only needed for the arrow engine
+    pa = None
+    pa_csv = None
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+CSV_ENGINES = ["pandas", "arrow"]
+
+# Columns that are always in the WDS csv file. Any other column in the column/type dictionary is a product dimension.
+WDS_CSV_COLS = ["REF_DATE", "DGUID", "UOM", "UOM_ID", "VECTOR", "COORDINATE", "STATUS", "SYMBOL", "VALUE"]
+# Repeated columns that stay dictionary encoded with the arrow engine (they arrive in pandas as categories). Product
+# dimension columns are dictionary encoded as well. COORDINATE, VECTOR and SYMBOL are close to unique per row.
+ARROW_DICTIONARY_COLS = ["REF_DATE", "DGUID", "UOM", "STATUS"]
+ARROW_BLOCK_SIZE = 4 * 1024 * 1024  # bytes of csv parsed per arrow block (each block is split across threads)
+SHARD_SAMPLE_LINES = 1000  # lines read from the start of the file to estimate the bytes per row for sharded reads
+
+
+def arrow_available():
+    # return True if pyarrow could be imported
+    return pa is not None
+
+
+def build_arrow_options(col_dict, use_threads=True):
+    # return the arrow csv read and convert options for the columns/types in col_dict
+    read_opts = pa_csv.ReadOptions(use_threads=use_threads, block_size=ARROW_BLOCK_SIZE)
+    convert_opts = pa_csv.ConvertOptions(column_types=build_arrow_column_types(col_dict),
+                                         include_columns=list(col_dict.keys()),
+                                         strings_can_be_null=True)  # empty strings are NA, same as pandas
+    return read_opts, convert_opts
+
+
+def build_arrow_column_types(col_dict):
+    # convert the pandas column/data type dictionary (col_dict) from dfh.build_column_and_type_dict to arrow types.
+    # Repeated string columns, dimensions and categories are read as dictionaries, which become pandas categories.
+    type_map = {"int16": pa.int16(), "int32": pa.int32(), "float64": pa.float64()}
+    arrow_types = {}
+    for col, col_type in col_dict.items():
+        if col_type == "category" or col in ARROW_DICTIONARY_COLS or col not in WDS_CSV_COLS:
+            arrow_types[col] = pa.dictionary(pa.int32(), pa.string())
+        elif col_type == "string":
+            arrow_types[col] = pa.string()
+        else:
+            arrow_types[col] = type_map[col_type]
+    return arrow_types
+
+
+def extract_csv(zip_path, csv_name, folder):
+    # extract csv_name from the zip file (zip_path) to folder (for sharded reads) and return the path of the csv file
+    with zipfile.ZipFile(zip_path) as zf:
+        return zf.extract(csv_name, folder)
+
+
+def get_next_chunk_size(chunk_size):
+    # chunk_size is either a number of rows or a function that returns the number of rows for the next chunk
+    return chunk_size() if callable(chunk_size) else chunk_size
+
+
+def read_csv_chunks(zip_path, csv_name, col_dict, chunk_size, engine="pandas"):
+    # Read csv_name from the zip file (zip_path) without extracting it and yield dataframes of chunk_size rows with
+    # the columns/types in col_dict. chunk_size can also be a function (ex. memoryGovernor.get_chunk_size) that is
+    # called before each chunk is read. engine is "pandas" (single threaded C parser) or "arrow" (multithreaded
+    # arrow parser with repeated columns kept as categories).
+    if engine == "arrow":
+        chunks = read_csv_chunks_arrow(zip_path, csv_name, col_dict, chunk_size)
+    else:
+        chunks = read_csv_chunks_pandas(zip_path, csv_name, col_dict, chunk_size)
+    return chunks
+
+
+def read_csv_chunks_arrow(zip_path, csv_name, col_dict, chunk_size):
+    # stream record batches from the zipped csv with the arrow reader and regroup them into chunks
+    read_opts, convert_opts = build_arrow_options(col_dict)
+    with zipfile.ZipFile(zip_path) as zf:
+        with zf.open(csv_name) as csv_file:
+            reader = pa_csv.open_csv(csv_file, read_options=read_opts, convert_options=convert_opts)
+            yield from rebatch_to_chunks(reader, chunk_size)
+
+
+def read_csv_chunks_pandas(zip_path, csv_name, col_dict, chunk_size):
+    # read the zipped csv with the pandas C parser in chunks
+    with zipfile.ZipFile(zip_path) as zf:  # reads in zipped csv as chunks w/o full extraction
+        with pd.read_csv(zf.open(csv_name), iterator=True, sep=",", usecols=list(col_dict.keys()),
+                         dtype=col_dict) as csv_reader:  # NO compression flag
+            while True:
+                try:
+                    csv_chunk = csv_reader.get_chunk(get_next_chunk_size(chunk_size))
+                except StopIteration:
+                    break
+                yield csv_chunk
+
+
+def read_csv_shards(csv_path, col_dict, chunk_size, engine="pandas"):
+    # Split the extracted csv file (csv_path) into csvShards of about chunk_size rows (a number or a function that is
+    # called before each shard) and yield them in file order. Only the header and a sample of rows are read here: each
+    # shard ends at the first line break after its estimated size and is parsed later by a worker process. WDS csv
+    # files have no line breaks inside quoted values, so every line is a row.
+    file_size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as csv_file:
+        header = csv_file.readline()
+        sample = [line for line in (csv_file.readline() for _ in range(SHARD_SAMPLE_LINES)) if line]
+        row_bytes = sum(len(line) for line in sample) / len(sample) if sample else 1
+        start = len(header)
+        while start < file_size:
+            end = start + max(int(get_next_chunk_size(chunk_size) * row_bytes), 1)
+            if end < file_size:
+                csv_file.seek(end - 1)
+                csv_file.readline()  # to the end of the row (stays at end if end - 1 is a line break)
+                end = csv_file.tell()
+            end = min(end, file_size)
+            yield csvShard(csv_path, header, start, end, col_dict, engine)
+            start = end
+
+
+def rebatch_to_chunks(batches, chunk_size):
+    # regroup arrow record batches (any size) into pandas dataframes of chunk_size rows (a number or a function)
+    pending = []  # batches waiting to be combined into a chunk
+    pending_rows = 0
+    next_size = get_next_chunk_size(chunk_size)
+    for batch in batches:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= next_size:
+            table = pa.Table.from_batches(pending)
+            yield record_table_to_df(table.slice(0, next_size))
+            remainder = table.slice(next_size)
+            pending = remainder.to_batches()
+            pending_rows = remainder.num_rows
+            next_size = get_next_chunk_size(chunk_size)
+    if pending_rows > 0:
+        yield record_table_to_df(pa.Table.from_batches(pending))
+
+
+def record_table_to_df(table):
+    # convert an arrow table to pandas. Dictionary columns become categories and plain strings use the pandas
+    # "string" dtype to match the pandas engine.
+    df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype()}.get, split_blocks=True)
+    return df
+
+
+# noinspection SpellCheckingInspection
+class csvShard(object):
+    def __init__(self, csv_path, header, start, end, col_dict, engine):
+        # Rows from byte start up to byte end (line boundaries) of an extracted csv file (csv_path), parsed with the
+        # file header line (header) and the columns/types in col_dict by the engine ("pandas" or "arrow"). Only the
+        # location is kept, so a shard is cheap to send to a worker process.
+        self.csv_path = csv_path
+        self.header = header
+        self.start = start
+        self.end = end
+        self.col_dict = col_dict
+        self.engine = engine
+
+    def read(self):
+        # parse the rows of the shard as a dataframe (same columns and types as read_csv_chunks)
+        with open(self.csv_path, "rb") as csv_file:
+            csv_file.seek(self.start)
+            csv_bytes = io.BytesIO(self.header + csv_file.read(self.end - self.start))
+        if self.engine == "arrow":
+            read_opts, convert_opts = build_arrow_options(self.col_dict, False)  # the shards already run in parallel
+            df = record_table_to_df(pa_csv.read_csv(csv_bytes, read_options=read_opts, convert_options=convert_opts))
+        else:
+            df = pd.read_csv(csv_bytes, sep=",", usecols=list(self.col_dict.keys()), dtype=self.col_dict)
+        return df
@@ -0,0 +1,152 @@
+# database dialects - connection, bulk insert engine and schema setup for each database backend used by scdb.sqlDb
+# "mssql" is the production SQL Server database. "sqlite" is an in-process database with the gis schema created
+# automatically, for running and profiling the ETL without SQL Server.
+import lazy_modules as lm  # for importing sqlalchemy and pyodbc when first used
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+import urllib.parse
+
+sqlalchemy = lm.lazy_import("sqlalchemy")
+try:
+    pyodbc = lm.lazy_import("pyodbc")  # only needed for SQL Server
+except ImportError:
+    pyodbc = None
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+DB_BACKENDS = ["mssql", "sqlite"]
+SQLITE_SCHEMA_SCRIPT = str(pathlib.Path(__file__).parent.absolute() / "sql_scripts" / "create_gis_schema_sqlite.sql")
+SQLITE_MEMORY_URI = "file:geo_explorer_gis?mode=memory&cache=shared"  # shared by every connection in the process
+SQLITE_TIMEOUT = 60  # seconds to wait for another connection to finish writing
+SQLITE_NUMBER_SEPARATORS = {"en-US": ("','", "'.'"), "fr-CA": ("char(160)", "','")}  # group, decimal (sql literals)
+
+
+def get_dialect(backend, driver, server, database):
+    # return the dialect for a database backend (one of DB_BACKENDS). driver and server are only used by mssql.
+    if backend == "sqlite":
+        retval = sqliteDialect(database)
+    elif backend == "mssql":
+        retval = mssqlDialect(driver, server, database)
+    else:
+        raise ValueError("Unknown database backend: " + str(backend) + ". Use one of " + str(DB_BACKENDS))
+    return retval
+
+
+# noinspection SpellCheckingInspection
+class mssqlDialect(object):
+    def __init__(self, driver, server, database):
+        # SQL Server through pyodbc with a trusted connection
+        if pyodbc is None:
+            raise ImportError("The mssql database backend requires the pyodbc package.")
+        self.name = "mssql"
+        self.conn_string = "Driver={" + driver + "};Server=" + server + ";Trusted_Connection=yes;Database=" + \
+                           database + ";"
+
+    def connect(self):
+        # open a connection for queries and deletes
+        log.info("Connecting to DB: " + self.conn_string)
+        return pyodbc.connect(self.conn_string, autocommit=False)
+
+    def create_engine(self):
+        # sql alchemy engine for bulk inserts
+        sa_params = urllib.parse.quote(self.conn_string)
+        return sqlalchemy.create_engine("mssql+pyodbc:///?odbc_connect=%s" % sa_params, fast_executemany=True)
+
+    def create_view_query(self, schema_name, view_name, select_query):
+        # return the statement that creates schema_name.view_name for select_query if the view does not exist (CREATE
+        # VIEW has to be the only statement in its batch, so it runs through EXEC)
+        return "IF OBJECT_ID('" + schema_name + "." + view_name + "', 'V') IS NULL EXEC('CREATE VIEW " + schema_name + \
+            "." + view_name + " AS " + select_query.replace("'", "''") + "')"
+
+    @property
+    def errors(self):
+        # database errors raised by the connection. Only read when an error is caught, so pyodbc is not imported
+        # before a connection is opened.
+        return (pyodbc.Error,)
+
+    def format_number(self, value_sql, format_code, loc_code):
+        # return the sql that formats the number value_sql with a .NET format_code (ex. "N") for locale loc_code
+        return "Format(" + value_sql + ", '" + format_code + "', '" + loc_code + "')"
+
+    def optional_table_query(self, schema_name, table_name, query):
+        # return query so that it only runs if schema_name.table_name exists (optional tables are created by scripts)
+        return "IF OBJECT_ID('" + schema_name + "." + table_name + "', 'U') IS NOT NULL " + query
+
+    def read_columns(self, cursor, schema_name):
+        # return (table, column, data type, max length, nullable) for every column of the tables in schema_name.
+        # Max length is -1 for (n)varchar(max) and None for types without a length.
+        cursor.execute("SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, IS_NULLABLE "
+                       "FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = ?", (schema_name,))
+        return [(row[0], row[1], row[2].lower(), row[3], row[4] == "YES") for row in cursor.fetchall()]
+
+    def setup_schema(self, connection):
+        # the gis schema is managed on the server
+        return
+
+
+# noinspection SpellCheckingInspection
+class sqliteDialect(object):
+    def __init__(self, database):
+        # SQLite with the gis tables in an attached database named gis, so queries keep their gis.Table names.
+        # database is a file path, or ":memory:" for a database that lasts as long as the process.
+        self.name = "sqlite"
+        self.errors = (sqlite3.Error,)
+        self.gis_path = SQLITE_MEMORY_URI if database == ":memory:" else \
+            pathlib.Path(os.path.abspath(database)).as_uri()
+
+    def connect(self):
+        # open a connection with the gis database attached (also used by the engine for each pooled connection)
+        connection = sqlite3.connect(":memory:", timeout=SQLITE_TIMEOUT, check_same_thread=False, uri=True)
+        connection.execute("ATTACH DATABASE ? AS gis", (self.gis_path,))
+        return connection
+
+    def create_engine(self):
+        # sql alchemy engine for bulk inserts, sharing the attach setup with connect
+        return sqlalchemy.create_engine("sqlite://", creator=self.connect)
+
+    def create_view_query(self, schema_name, view_name, select_query):
+        # return the statement that creates schema_name.view_name for select_query if the view does not exist
+        return "CREATE VIEW IF NOT EXISTS " + schema_name + "." + view_name + " AS " + select_query
+
+    def format_number(self, value_sql, format_code, loc_code):
+        # Return the sql that formats the number value_sql like Format(value_sql, format_code, loc_code) on mssql, for
+        # the "N" number format (digits grouped by thousands, 2 decimals or the number after N) in en-US or fr-CA.
+        # printf only groups the digits of integers, so the decimals are added to the grouped integer part.
+        if not re.fullmatch(r"N\d?", format_code) or loc_code not in SQLITE_NUMBER_SEPARATORS:
+            raise ValueError("Number format " + format_code + " (" + loc_code + ") is not supported on sqlite")
+        group_sep, decimal_sep = SQLITE_NUMBER_SEPARATORS[loc_code]
+        decimals = int(format_code[1:]) if len(format_code) > 1 else 2
+        digits = "printf('%." + str(decimals) + "f', abs(" + value_sql + "))"  # rounded, without the sign
+        retval = "CASE WHEN " + value_sql + " < 0 AND " + digits + " GLOB '*[1-9]*' THEN '-' ELSE '' END || " \
+                 "replace(printf('%,d', CAST(" + digits + " AS INTEGER)), ',', " + group_sep + ")"
+        if decimals > 0:
+            retval += " || " + decimal_sep + " || substr(" + digits + ", -" + str(decimals) + ")"
+        return retval
+
+    def optional_table_query(self, schema_name, table_name, query):
+        # return query for a table that may not exist on other backends (every gis table is created by setup_schema)
+        return query
+
+    def read_columns(self, cursor, schema_name):
+        # return (table, column, data type, max length, nullable) for every column of the tables in the attached
+        # database schema_name. Types are the declared types (ex. text, integer), which have no length in sqlite.
+        cursor.execute("SELECT name FROM " + schema_name + ".sqlite_master WHERE type = 'table'")
+        retval = []
+        for (table_name,) in cursor.fetchall():
+            cursor.execute("SELECT name, type, \"notnull\" FROM pragma_table_info(?, ?)", (table_name, schema_name))
+            retval += [(table_name, row[0], row[1].lower(), None, not row[2]) for row in cursor.fetchall()]
+        return retval
+
+    def setup_schema(self, connection):
+        # create any gis tables that do not exist yet
+        log.info("Setting up gis schema in SQLite DB: " + self.gis_path)
+        with open(SQLITE_SCHEMA_SCRIPT, encoding="utf-8") as script:
+            connection.executescript(script.read())
+        connection.commit()
+        if connection.execute("SELECT COUNT(*) FROM gis.GeographyReference").fetchone()[0] == 0:
+            log.warning("gis.GeographyReference is empty. Rows are only loaded for DGUIDs found in this table.")
@@ -1,16 +1,46 @@
 # data frame handling
 from datetime import datetime
 import helpers as h  # helper functions
+import indexes as idx  # for interning repeated strings
 import itertools as it  # for iterators
+import lazy_modules as lm  # for importing numpy and pandas when first used
 import logging
-import numpy as np
-import pandas as pd
 import re  # regular expressions
+import zlib  # for query view names
+
+np = lm.lazy_import("numpy")
+pd = lm.lazy_import("pandas")
 
 # set up logger if available
 log = logging.getLogger("etl_log")
 log.addHandler(logging.NullHandler())
 
+# handles cases where a sorting prefix has been added to a dimension/member (match for 0. to 1000.)
+# ex. "02. Resident owners only" --> "Resident owners only"
+MEMBER_PREFIX_PATTERN = re.compile(r"^(?:(?:0){0,3}[0-9]|(?:0){0,2}[1-9][0-9]|(?:0){0,1}[1-9][0-9][0-9])\.")
+
+# PrimaryQuery for gis.IndicatorResult (--result-tables), followed by the IndicatorId. Returns the same columns as the
+# original PrimaryQuery join, with only the geography names and Shape read from gis.GeographyReference.
+RESULT_PRIMARY_QUERY = "SELECT r.Value, r.FormattedValue_EN, r.FormattedValue_FR, r.GeographyReferenceId, " \
+                       "g.DisplayNameShort_EN, g.DisplayNameShort_FR, g.DisplayNameLong_EN, g.DisplayNameLong_FR, " \
+                       "g.ProvTerrName_EN, g.ProvTerrName_FR, g.Shape, r.IndicatorName_EN, r.IndicatorName_FR, " \
+                       "r.IndicatorId, r.IndicatorDisplay_EN, r.IndicatorDisplay_FR, r.UOM_EN, r.UOM_FR, " \
+                       "r.GeographicLevelId, r.LevelName_EN, r.LevelName_FR, r.LevelDescription_EN, " \
+                       "r.LevelDescription_FR, g.EntityName_EN, g.EntityName_FR, r.Symbol, r.NullDescription_EN, " \
+                       "r.NullDescription_FR FROM gis.IndicatorResult AS r INNER JOIN gis.GeographyReference AS g " \
+                       "ON g.GeographyReferenceId = r.GeographyReferenceId WHERE r.IndicatorId = "
+
+# columns the gis.RelatedCharts Query returns (also read from the RelatedChartQuery views, see build_query_view_sql)
+RELATED_CHART_COLUMNS = "Value, FormattedValue_EN, FormattedValue_FR, IndicatorName_EN, IndicatorName_FR, " \
+                        "NullDescription_EN, NullDescription_FR"
+
+
+def build_categorical_column(codes, values, index):
+    # Return a categorical column (with index) for rows holding integer codes (-1 is NA) into values (object array of
+    # formatted distinct values). Values that format the same are merged, so each category is distinct.
+    value_codes, categories = pd.factorize(values)
+    return pd.Series(pd.Categorical.from_codes(idx.take_codes(codes, value_codes), categories), index=index)
+
 
 def build_column_and_type_dict(dimensions):
     # set up the dicionary of columns and data types for pandas df, then add columns listed in dimensions as str types
@@ -45,30 +75,28 @@ def build_dimension_unique_keys(dmf):
     # and gis.DimensionValues (dmf). The unique keys are the ordered and concatenated index values of each member in
     # gis.DimensionValues. There are no IndicatorIds, vectors, or coordinates in these tables, so we are figuring out
     # the link to Indicator backward through reference periods and indicator names.
-    dim_mem_names = {}
-    dim_mem_ids = {}
-
-    # build dictionaries of member ids and member names
-    for index, row in dmf.iterrows():
-        dim_id = row["DimensionId"]
-        mem_id = row["DimensionValueId"]
-        # regex below handles cases where a sorting prefix has been added to a dimension/member
-        patt = r"^(?:(?:0){0,3}[0-9]|(?:0){0,2}[1-9][0-9]|(?:0){0,1}[1-9][0-9][0-9])\."  # regex match for 0. to 1000.
-        mem_name = re.sub(patt, "", row["Display_EN"]).lstrip()  # "02. Resident owners only" -->removes "02. "
-
-        if dim_id not in dim_mem_names:
-            dim_mem_names[dim_id] = []
-        dim_mem_names[dim_id].append(mem_name)
-        if dim_id not in dim_mem_ids:
-            dim_mem_ids[dim_id] = []
-        dim_mem_ids[dim_id].append(mem_id)
-
-    mem_names = build_dimension_member_combos(dim_mem_names, "-")
-    mem_ids = build_dimension_member_combos(dim_mem_ids, "-")
-    keys_df = False
-    if len(mem_names) == len(mem_ids):
-        # can combine the two lists b/c they are in the same order by dimension
-        keys_df = pd.DataFrame({"IndicatorFmt": mem_names, "DimensionUniqueKey": mem_ids})
+    # Members are combined in the same order as build_dimension_member_combos (dimensions in order of appearance,
+    # last dimension varies fastest), but the combinations are built from integer positions one dimension at a time,
+    # so each key string is only joined once per dimension instead of rebuilt from a tuple of every member.
+    mem_names = dmf["Display_EN"].astype("string").str.replace(MEMBER_PREFIX_PATTERN, "", regex=True).str.lstrip()
+    name_arr = mem_names.to_numpy(dtype=object)
+    id_arr = dmf["DimensionValueId"].astype("string").to_numpy(dtype=object)
+    dim_groups = dmf.groupby("DimensionId", sort=False).indices  # row positions of members for each dimension
+
+    key_names = np.array([""], dtype=object)  # single empty combination when there are no dimensions
+    key_ids = np.array([""], dtype=object)
+    for dim_num, dim_rows in enumerate(dim_groups.values()):
+        # integer cartesian product: repeat each existing combination once per member, cycle members underneath
+        prev_pos = np.repeat(np.arange(len(key_names)), len(dim_rows))
+        mem_pos = np.tile(np.arange(len(dim_rows)), len(key_names))
+        if dim_num == 0:
+            key_names = name_arr[dim_rows]
+            key_ids = id_arr[dim_rows]
+        else:
+            key_names = key_names[prev_pos] + ("-" + name_arr[dim_rows])[mem_pos]
+            key_ids = key_ids[prev_pos] + ("-" + id_arr[dim_rows])[mem_pos]
+
+    keys_df = pd.DataFrame({"IndicatorFmt": key_names, "DimensionUniqueKey": key_ids})
     return keys_df
 
 
@@ -140,30 +168,44 @@ def build_dimension_values_df_subset(dvdf):
     return df
 
 
+def build_fixed_dguids(dguids, year_codes, ref_years, prod_id, interner):
+    # Return the DGUIDs (dguids) cleaned up and corrected by fix_dguid for the reference year of each row (year_codes
+    # into ref_years, from factorize_column) as a categorical column. Each distinct DGUID/year pair is fixed once per
+    # product (interner, indexes.codeInterner) instead of once per row.
+    dguid_codes, raw_dguids = factorize_column(dguids)
+    if (dguid_codes < 0).any():  # missing DGUIDs are fixed like any other value (ex. "<NA>")
+        raw_dguids = np.append(raw_dguids, np.array([getattr(dguids.dtype, "na_value", np.nan)], dtype=object))
+        dguid_codes = np.where(dguid_codes < 0, len(raw_dguids) - 1, dguid_codes)
+    pair_codes, pairs = pd.factorize(dguid_codes * len(ref_years) + year_codes)
+    keys = [(raw_dguids[pair // len(ref_years)], ref_years[pair % len(ref_years)]) for pair in pairs]
+    fixed = interner.get("DGUID", keys, lambda new_keys: [
+        fix_dguid(ref_year, dguid.replace(".", "").replace("201A", "2015A") if isinstance(dguid, str) else dguid,
+                  prod_id) for dguid, ref_year in new_keys])  # clean up from powerBI process, then fix crime
+    return build_categorical_column(pair_codes, fixed, dguids.index)
+
+
 def build_geographic_level_chunk_df(cdf, prod_id, mixed_geo_justice_pids):
     # build df of geographic levels for the data chunk currently being processed (cdf).
-    geo_chunk = cdf.loc[:, ["RefYear", "GeographicLevelId", "IndicatorCode"]]
+    geo_chunk = cdf.loc[:, ["RefYear", "GeographicLevelId", "IndicatorId"]]
     if int(prod_id) in mixed_geo_justice_pids:
         # Justice products with mixed geos: remove rows < 2017 if geolevel is not in national, prov, regional level
         geo_chunk.drop(geo_chunk[(geo_chunk["RefYear"].astype("int16") < 2017) &
                                  (~geo_chunk["GeographicLevelId"].isin(["A0000", "A0001", "A0002"]))].index,
                        inplace=True)
     geo_chunk.drop(["RefYear"], axis=1, inplace=True)
+    geo_chunk.drop_duplicates(inplace=True)  # only distinct levels are kept across chunks
     return geo_chunk
 
 
-def build_geographic_level_for_indicator_df(gldf, idf, existing_gli_df, is_sibling):
-    # build the data frame for GeographicLevelForIndicator based on dataframe geographic levels abnd indicator codes
-    # (gldf) and df of Indicator codes and Ids that were just inserted to the db (idf). Exclude any rows that
-    # already exist in existing_gli_df (this can happen with merged tables).
+def build_geographic_level_for_indicator_df(gldf, existing_gli_df, is_sibling):
+    # build the data frame for GeographicLevelForIndicator based on dataframe geographic levels and indicator ids
+    # (gldf, ids resolved from the indicatorIndex for each chunk). Exclude any rows that already exist in
+    # existing_gli_df (this can happen with merged tables).
     df_gli = gldf
     pattern = "|".join(["S0504", "S0505", "S0506"])  # S0504(CA),S0505(CMAP),S0506(CAP)->S0503(CMA) (from orig PowerBI)
     df_gli["GeographicLevelId"] = df_gli["GeographicLevelId"].str.replace(pattern, "S0503")
     df_gli.drop_duplicates(inplace=True)  # remove any dupe rows
-
-    df_gli = pd.merge(df_gli, idf, on="IndicatorCode", how="left")  # join datasets
-    df_gli.drop(["IndicatorCode"], axis=1, inplace=True)  # no longer need col
-    df_gli.dropna(inplace=True)  # remove any row w/ na
+    df_gli.dropna(inplace=True)  # remove any row w/ na (includes indicator codes not found in the product)
     df_gli = df_gli.loc[(df_gli.GeographicLevelId != "")]  # remove any row w/ empty geolevel
 
     if existing_gli_df.shape[0] > 0:  # remove anything from the df that already exists in the db
@@ -177,41 +219,42 @@ def build_geographic_level_for_indicator_df(gldf, idf, existing_gli_df, is_sibli
         df_web_inds = df_gli.loc[:, ["IndicatorId"]].drop_duplicates(inplace=False)
         df_web_inds["GeographicLevelId"] = "SSSS"
         df_gli = df_gli.append(df_web_inds)
-        h.delete_var_and_release_mem([df_web_inds])
+        del df_web_inds
     df_gli = df_gli.loc[:, ["IndicatorId", "GeographicLevelId"]]  # column order needeed for db insert
     return df_gli
 
 
-def build_geography_reference_for_indicator_df(edf, idf, gdf, ivdf):
-    # Build the data frame for GeographicReferenceForIndicator based on dataframe of english csv file (edf),
-    # GeographyReference ids (gdf), Indicator # codes and Ids that were just inserted to the db (idf), and
-    # Indicator Values that were just added to the db (ivdf).
-    df_gri = edf.loc[:, ["DGUID", "IndicatorCode", "ReferencePeriod"]]  # subset of full en dataset
-    df_gri = pd.merge(df_gri, idf, on="IndicatorCode", how="left")  # join datasets
-    df_gri["IndicatorValueCode"] = df_gri["DGUID"] + "." + df_gri["IndicatorCode"]  # combine DGUID, IndicatorCode
-
-    df_gri = pd.merge(df_gri, gdf, left_on="DGUID", right_on="GeographyReferenceId", how="left")  # join geoRef for id
-    df_null_geo_rf = check_null_geography_reference(df_gri)  # notify user of any DGUIDs w/o matching geoRef
-    df_gri.dropna(subset=["GeographyReferenceId", "DGUID"], inplace=True)  # drop rows with empty ids
-    df_gri.drop(["GeographyReferenceId"], axis=1, inplace=True)  # drop ref column used for merge
+def build_geography_reference_for_indicator_df(edf):
+    # Build the data frame for GeographicReferenceForIndicator based on dataframe of english csv file (edf). The
+    # IndicatorId (from the indicatorIndex), IndicatorValueId (assigned by build_indicator_values_df) and
+    # HasGeographyReference (from the geographyIndex) are already on each row of edf, so no joins are needed.
+    df_gri = edf.loc[edf["HasGeographyReference"], ["DGUID", "IndicatorId", "IndicatorValueId", "ReferencePeriod"]]
     df_gri.rename(columns={"DGUID": "GeographyReferenceId"}, inplace=True)  # rename to match db
-
-    df_gri = pd.merge(df_gri, ivdf, on="IndicatorValueCode", how="left")  # join to IndicatorValues for id
-    df_gri.drop(["IndicatorCode", "IndicatorValueCode"], axis=1, inplace=True)
-    df_gri.dropna(inplace=True)  # remove any rows w/ empty values
+    df_gri.dropna(inplace=True)  # remove any rows w/ empty values (includes indicator codes not found in product)
 
     # Ensure columns are in order needed for insert, convert types as required
     df_gri = df_gri.loc[:, ["GeographyReferenceId", "IndicatorId", "IndicatorValueId", "ReferencePeriod"]]
-    df_gri["GeographyReferenceId"] = df_gri["GeographyReferenceId"].astype("string").str[:25]
+    df_gri["GeographyReferenceId"] = cut_strings(df_gri["GeographyReferenceId"], 25)
     df_gri["ReferencePeriod"] = df_gri["ReferencePeriod"].astype("datetime64[ns]")
-    return df_gri, df_null_geo_rf
-
-
-def build_indicator_code(coordinate, reference_date, pid_str):
-    # builds custom indicator code that strips geography from the coordinate and adds a reference date
-    temp_coordinate = coordinate.str.replace(r"^([^.]+\.)", "", regex=True)  # strips 1st dimension (geography)
-    indicator_code = pid_str + "." + temp_coordinate + "." + reference_date + "-01-01"  # ex. 13100778.1.23.1.2018-01-01
-    return indicator_code
+    return df_gri
+
+
+def build_indicator_code(coordinates, date_codes, ref_dates, pid_str, interner):
+    # Builds custom indicator code that strips geography from the coordinate and adds a reference date (date_codes
+    # into ref_dates, from factorize_column), ex. 13100778.1.23.1.2018-01-01. Returns a categorical column: each
+    # distinct coordinate is stripped once per chunk and each distinct code is built once per product (interner).
+    coord_codes, raw_coordinates = factorize_column(coordinates)
+    stripped = [coord[coord.find(".") + 1:] if coord.find(".") > 0 else coord  # strips 1st dimension (geography)
+                for coord in raw_coordinates]
+    member_codes, members = pd.factorize(np.array(stripped, dtype=object))
+    member_codes = idx.take_codes(coord_codes, member_codes)
+    pair_codes = np.full(len(coordinates), -1, dtype="int64")
+    has_pair = (member_codes >= 0) & (date_codes >= 0)
+    pair_codes[has_pair], pairs = pd.factorize(member_codes[has_pair] * len(ref_dates) + date_codes[has_pair])
+    keys = [(members[pair // len(ref_dates)], ref_dates[pair % len(ref_dates)]) for pair in pairs]
+    indicator_codes = interner.get("IndicatorCode", keys, lambda new_keys: [
+        pid_str + "." + member + "." + ref_date + "-01-01" for member, ref_date in new_keys])
+    return build_categorical_column(pair_codes, indicator_codes, coordinates.index)
 
 
 def build_indicator_df(product_id, release_dt, dim_members, uom_codeset, ref_date_list, next_id, min_ref_year,
@@ -308,10 +351,13 @@ def build_indicator_df_subset(idf):
     return df
 
 
-def build_indicator_metadata_df(idf, prod_defaults, dkdf, existing_md_df):
+def build_indicator_metadata_df(idf, prod_defaults, dkdf, existing_md_df, use_result_table=False,
+                                use_query_views=False):
     # Build the data frame for IndicatorMetadata using the indicator dataset (idf), product defaults (prod_defaults)
     # and unique dimension keys (dkdf). If the metadata for an indicator already exists (existing_meta_data) use it,
-    # otherwise use the product default (prod_defaults).
+    # otherwise use the product default (prod_defaults). With use_result_table the PrimaryQuery reads the rows
+    # materialized in gis.IndicatorResult (see build_indicator_result_query) instead of joining the gis tables, and
+    # with use_query_views it reads the PrimaryQuery view for its formats (see build_query_views).
 
     # formatted indicator names in idf can merged with unique dimension keys data frame
     idf["IndicatorFmt_Lower"] = idf["IndicatorFmt"].str.lower()  # prevents case sensitivity issues during merge
@@ -361,6 +407,13 @@ def build_indicator_metadata_df(idf, prod_defaults, dkdf, existing_md_df):
                             "INNER JOIN gis.indicatorvalues AS iv  ON iv.indicatorvalueid = grfi.indicatorvalueid  " \
                             "INNER JOIN gis.indicatortheme AS it ON i.indicatorthemeid = it.indicatorthemeid  " \
                             "LEFT OUTER JOIN gis.indicatornullreason AS nr ON iv.nullreasonid = nr.nullreasonid"
+    if use_result_table:  # same columns, read from the materialized rows
+        df_im["PrimaryQuery"] = RESULT_PRIMARY_QUERY + df_im["IndicatorId"].astype(str)
+    elif use_query_views:  # same columns, read from the shared view
+        view_names = [build_query_view_name("PrimaryQuery", en_format, fr_format)
+                      for en_format, fr_format in zip(df_im["en_format"], df_im["fr_format"])]
+        df_im["PrimaryQuery"] = "SELECT * FROM gis." + pd.Series(view_names, index=df_im.index) + \
+                                " WHERE IndicatorId = " + df_im["IndicatorId"].astype(str)
 
     # set datatypes/lengths for db
     df_im["FieldAlias_EN"] = df_im["FieldAlias_EN"].astype("string").str[:600]
@@ -377,6 +430,40 @@ def build_indicator_metadata_df(idf, prod_defaults, dkdf, existing_md_df):
     return df_im
 
 
+def build_indicator_result_query(format_df, new_rows_only, format_number=None):
+    # Build the query that fills gis.IndicatorResult for a product (IndicatorThemeId parameter) with the rows of the
+    # original PrimaryQuery join for every indicator, values already formatted for the indicator's format (format_df,
+    # distinct DataFormatId/PrimaryChartTypeId of the product's gis.IndicatorMetaData) by the database dialect's
+    # format_number (see set_uom_format). With new_rows_only, rows that are already in the table (same
+    # IndicatorValueId) are skipped.
+    query = "INSERT INTO gis.IndicatorResult (IndicatorThemeId, IndicatorId, IndicatorValueId, GeographyReferenceId, " \
+            "Value, FormattedValue_EN, FormattedValue_FR, IndicatorName_EN, IndicatorName_FR, IndicatorDisplay_EN, " \
+            "IndicatorDisplay_FR, UOM_EN, UOM_FR, GeographicLevelId, LevelName_EN, LevelName_FR, " \
+            "LevelDescription_EN, LevelDescription_FR, Symbol, NullDescription_EN, NullDescription_FR) " \
+            "SELECT i.IndicatorThemeID, i.IndicatorId, iv.IndicatorValueId, grfi.GeographyReferenceId, iv.value, " \
+            "CASE WHEN iv.value IS NULL THEN nr.symbol ELSE " + \
+            build_value_format_sql(format_df, "en", format_number) + " END, " \
+            "CASE WHEN iv.value IS NULL THEN nr.symbol ELSE " + \
+            build_value_format_sql(format_df, "fr", format_number) + " END, " \
+            "i.IndicatorName_EN, i.IndicatorName_FR, i.IndicatorDisplay_EN, i.IndicatorDisplay_FR, i.UOM_EN, " \
+            "i.UOM_FR, g.GeographicLevelId, gl.LevelName_EN, gl.LevelName_FR, gl.LevelDescription_EN, " \
+            "gl.LevelDescription_FR, nr.Symbol, nr.Description_EN, nr.Description_FR " \
+            "FROM gis.geographyreference AS g INNER JOIN gis.geographyreferenceforindicator AS grfi ON " \
+            "g.geographyreferenceid = grfi.geographyreferenceid INNER JOIN gis.indicator AS i ON " \
+            "grfi.indicatorid = i.indicatorid INNER JOIN gis.geographiclevel AS gl ON " \
+            "g.geographiclevelid = gl.geographiclevelid INNER JOIN gis.geographiclevelforindicator AS glfi ON " \
+            "i.indicatorid = glfi.indicatorid AND gl.geographiclevelid = glfi.geographiclevelid " \
+            "INNER JOIN gis.indicatorvalues AS iv ON iv.indicatorvalueid = grfi.indicatorvalueid " \
+            "INNER JOIN gis.indicatortheme AS it ON i.indicatorthemeid = it.indicatorthemeid " \
+            "LEFT OUTER JOIN gis.indicatornullreason AS nr ON iv.nullreasonid = nr.nullreasonid " \
+            "LEFT OUTER JOIN gis.indicatormetadata AS md ON i.indicatorid = md.indicatorid " \
+            "WHERE i.IndicatorThemeID = ?"
+    if new_rows_only:
+        query += " AND NOT EXISTS (SELECT 1 FROM gis.IndicatorResult AS r WHERE " \
+                 "r.IndicatorValueId = iv.IndicatorValueId)"
+    return query
+
+
 def build_indicator_theme_df(prod_md, indicator_theme_id, sc_row_count, scs_row_count, sc_dummy_row_count,
                              scs_dummy_row_count, subj_codes):
     # build the dataframe for IndicatorTheme using the product metadata (prod_md), indicator theme id.
@@ -427,41 +514,85 @@ def build_indicator_theme_df(prod_md, indicator_theme_id, sc_row_count, scs_row_
     return itdf
 
 
-def build_indicator_values_df(edf, gdf, ndf, next_id, prod_id, mixed_geo_justice_pids, is_sibling):
-    # build the data frame for IndicatorValues based on dataframe of english csv file (edf),
-    # GeographyReference ids (gdf), and NullReason ids (ndf). Populate indicator value ids starting from next_id.
-    # mixed_geo_justice_pids/is_sibling indicate justice tables that have special date handling.
-    # also collect and return unique GeographicLevelIDs
-
-    # Justice products with mixed geos
-    if int(prod_id) in mixed_geo_justice_pids:
-        # remove rows < 2017 if geolevel is not in national, provincial, regional level
-        edf.drop(edf[(edf["RefYear"].astype("int16") < 2017) &
-                     (~edf["GeographicLevelId"].isin(["A0000", "A0001", "A0002"]))].index, inplace=True)
-        # for sibling tables with mixed geos, remove these same geolevels b/c they already exist in the master
-        if is_sibling:
-            edf.drop(edf[edf["GeographicLevelId"].isin(["A0000", "A0001", "A0002"])].index, inplace=True)
-
-    df_iv = edf.loc[:, ["DGUID", "IndicatorCode", "STATUS", "VALUE"]]  # subset of full en dataset
-    df_iv["IndicatorValueId"] = h.create_id_series(edf, next_id)  # populate IDs
-    df_iv = pd.merge(df_iv, gdf, left_on="DGUID", right_on="GeographyReferenceId", how="left")  # join to geoRef for id
-
-    df_iv.dropna(subset=["GeographyReferenceId"], inplace=True)  # drop empty ids
-    df_iv.drop(["GeographyReferenceId"], axis=1, inplace=True)
-    df_iv["IndicatorValueCode"] = df_iv["DGUID"] + "." + df_iv["IndicatorCode"]  # combine DGUID and IndicatorCode
+def build_indicator_values_df(edf, ndf, next_id):
+    # build the data frame for IndicatorValues based on dataframe of english csv file (edf) and NullReason ids (ndf).
+    # Only rows with a DGUID in gis.GeographyReference (HasGeographyReference, from the geographyIndex) are kept.
+    # Populate indicator value ids starting from next_id for the kept rows only (no gaps, so the ids of a chunk only
+    # depend on its row count), these are also added to edf so each row keeps its IndicatorValueId (-1 if not kept).
+    has_geo_ref = edf["HasGeographyReference"].to_numpy(dtype=bool)
+    ind_val_ids = np.full(edf.shape[0], -1, dtype="int64")
+    ind_val_ids[has_geo_ref] = np.arange(next_id, next_id + has_geo_ref.sum())
+    edf["IndicatorValueId"] = ind_val_ids  # populate IDs, kept on edf for GRI
+    df_iv = edf.loc[edf["HasGeographyReference"], ["DGUID", "IndicatorCode", "STATUS", "VALUE", "IndicatorValueId"]]
+    code_length = max_text_length(df_iv["DGUID"]) + 1 + max_text_length(df_iv["IndicatorCode"])  # before joining
+    df_iv["IndicatorValueCode"] = df_iv["DGUID"].astype("object") + "." + df_iv["IndicatorCode"].astype("object")
     df_iv.drop(["DGUID", "IndicatorCode"], axis=1, inplace=True)
     df_iv = pd.merge(df_iv, ndf, left_on="STATUS", right_on="Symbol", how="left")  # join to NullReasonId for Symbol
     df_iv.drop(["STATUS", "Symbol"], axis=1, inplace=True)
 
     # set datatypes for db
     df_iv = df_iv.fillna(np.nan).replace([np.nan], [None])  # workaround to set nan/na=None (prevents sql error 22003)
-    df_iv["IndicatorValueCode"] = df_iv["IndicatorValueCode"].str[:100]
+    df_iv["IndicatorValueCode"] = df_iv["IndicatorValueCode"].astype("string")
+    if code_length > 100:
+        df_iv["IndicatorValueCode"] = df_iv["IndicatorValueCode"].str[:100]
 
     # Keep only the columns needed for insert
     df_iv = df_iv.loc[:, ["IndicatorValueId", "VALUE", "NullReasonId", "IndicatorValueCode"]]
     return df_iv
 
 
+def build_query_view_name(kind, en_format, fr_format):
+    # Return the name of the view for a chart query (kind, "PrimaryQuery" or "RelatedChartQuery") with the value
+    # formats en_format and fr_format (see set_uom_format). The name comes from a hash of the formats, so a view keeps
+    # its name (and definition) from one run to the next.
+    return kind + "_" + f"{zlib.crc32((en_format + '|' + fr_format).encode('utf-8')):08x}"
+
+
+def build_query_view_sql(kind, en_format, fr_format):
+    # Return the select statement of the view for a chart query (kind, see build_query_view_name), the query that was
+    # stored for each indicator without the indicator filter. The views return the same columns as the stored query,
+    # with IndicatorId to filter on (RelatedChartQuery views only return it for the filter).
+    formatted_values = "CASE WHEN iv.value IS NULL THEN nr.symbol ELSE " + en_format + " END AS FormattedValue_EN, " \
+                       "CASE WHEN iv.value IS NULL THEN nr.symbol ELSE " + fr_format + " END AS FormattedValue_FR"
+    if kind == "PrimaryQuery":
+        retval = "SELECT iv.value AS Value, " + formatted_values + ", grfi.GeographyReferenceId, " \
+                 "g.DisplayNameShort_EN, g.DisplayNameShort_FR, g.DisplayNameLong_EN, g.DisplayNameLong_FR, " \
+                 "g.ProvTerrName_EN, g.ProvTerrName_FR, g.Shape, i.IndicatorName_EN, i.IndicatorName_FR, " \
+                 "i.IndicatorId, i.IndicatorDisplay_EN, i.IndicatorDisplay_FR, i.UOM_EN, i.UOM_FR, " \
+                 "g.GeographicLevelId, gl.LevelName_EN, gl.LevelName_FR, gl.LevelDescription_EN, " \
+                 "gl.LevelDescription_FR, g.EntityName_EN, g.EntityName_FR, nr.Symbol, " \
+                 "nr.Description_EN AS NullDescription_EN, nr.Description_FR AS NullDescription_FR " \
+                 "FROM gis.geographyreference AS g INNER JOIN gis.geographyreferenceforindicator AS grfi ON " \
+                 "g.geographyreferenceid = grfi.geographyreferenceid INNER JOIN gis.indicator AS i ON " \
+                 "grfi.indicatorid = i.indicatorid INNER JOIN gis.geographiclevel AS gl ON " \
+                 "g.geographiclevelid = gl.geographiclevelid INNER JOIN gis.geographiclevelforindicator AS glfi ON " \
+                 "i.indicatorid = glfi.indicatorid AND gl.geographiclevelid = glfi.geographiclevelid " \
+                 "INNER JOIN gis.indicatorvalues AS iv ON iv.indicatorvalueid = grfi.indicatorvalueid " \
+                 "INNER JOIN gis.indicatortheme AS it ON i.indicatorthemeid = it.indicatorthemeid " \
+                 "LEFT OUTER JOIN gis.indicatornullreason AS nr ON iv.nullreasonid = nr.nullreasonid"
+    else:
+        retval = "SELECT gfri.IndicatorId, iv.value AS Value, " + formatted_values + ", i.IndicatorName_EN, " \
+                 "i.IndicatorName_FR, nr.Description_EN AS NullDescription_EN, nr.Description_FR AS " \
+                 "NullDescription_FR FROM gis.IndicatorValues AS iv LEFT OUTER JOIN gis.IndicatorNullReason AS nr " \
+                 "ON iv.NullReasonId = nr.NullReasonId INNER JOIN gis.GeographyReferenceForIndicator AS gfri ON " \
+                 "iv.indicatorvalueid = gfri.indicatorvalueid INNER JOIN gis.indicator AS i ON " \
+                 "i.indicatorid = gfri.indicatorid"
+    return retval
+
+
+def build_query_views(format_df, chart_type_column, kind, format_number=None):
+    # Return the views (view name --> select statement) for a chart query (kind, see build_query_view_name) that the
+    # rows of format_df use, from their DataFormatId and chart type (chart_type_column). The views format values with
+    # the database dialect's format_number (see set_uom_format), and are named from the formats of the stored queries.
+    views = {}
+    for uom_id, chart_type_id in set(zip(format_df["DataFormatId"], format_df[chart_type_column])):
+        view_name = build_query_view_name(kind, set_uom_format(uom_id, "en", chart_type_id),
+                                          set_uom_format(uom_id, "fr", chart_type_id))
+        views[view_name] = build_query_view_sql(kind, set_uom_format(uom_id, "en", chart_type_id, format_number),
+                                                set_uom_format(uom_id, "fr", chart_type_id, format_number))
+    return views
+
+
 def build_ref_date_dimensions(ref_date_df, min_ref_year, prod_id, mixed_geo_justice_pids):
     # build a dataframe of dates to add to gis.DimensionValues. If a minimum reference year is specified,
     # only include rows with a newer date (unless it is a justice product with mixed geos - handled separately)
@@ -478,6 +609,13 @@ def build_ref_date_dimensions(ref_date_df, min_ref_year, prod_id, mixed_geo_just
     return dim_df
 
 
+def build_ref_years(ref_dates):
+    # return the 4 digit reference year (string) for each REF_DATE in ref_dates. h.fix_ref_year runs once for each
+    # distinct date instead of once per row.
+    year_dict = {ref_date: h.fix_ref_year(ref_date) for ref_date in ref_dates.unique()}
+    return ref_dates.map(year_dict).astype("string")
+
+
 def build_reference_dates(start_str, end_str, freq_code):
     # build list of dates from start_str to end_str (assume YYYY-MM-DD format) based on freq_code
     # (code from WDS indicating how often the data is published). Returns dates as pandas series (datetime64[ns])
@@ -489,9 +627,10 @@ def build_reference_dates(start_str, end_str, freq_code):
     return retval
 
 
-def build_related_charts_df(idf, prod_defaults, existing_md_df):
+def build_related_charts_df(idf, prod_defaults, existing_md_df, use_query_views=False):
     # Build the data frame for RelatedCharts using the indicator dataset (idf). If the metadata for an indicator
-    # already exists (existing_meta_data) use it, otherwise use the product default (prod_defaults).
+    # already exists (existing_meta_data) use it, otherwise use the product default (prod_defaults). With
+    # use_query_views the Query reads the RelatedChartQuery view for its formats (see build_query_views).
 
     ind_subset_df = idf.loc[:, ["IndicatorId", "IndicatorCode", "UOM_ID", "LastIndicatorMember_EN",
                                 "LastIndicatorMember_FR", "UOM_EN", "UOM_FR"]]
@@ -527,6 +666,11 @@ def build_related_charts_df(idf, prod_defaults, existing_md_df):
                      "nr.NullReasonId INNER JOIN gis.GeographyReferenceForIndicator AS gfri ON iv.indicatorvalueid = " \
                      "gfri.indicatorvalueid INNER JOIN gis.indicator AS i ON i.indicatorid = gfri.indicatorid WHERE " \
                      "gfri.indicatorid IN (" + df_rc["RelatedIndicatorIDs"] + ")"
+    if use_query_views:  # same columns, read from the shared view
+        view_names = [build_query_view_name("RelatedChartQuery", en_format, fr_format)
+                      for en_format, fr_format in zip(df_rc["en_format"], df_rc["fr_format"])]
+        df_rc["Query"] = "SELECT " + RELATED_CHART_COLUMNS + " FROM gis." + pd.Series(view_names, index=df_rc.index) \
+                         + " WHERE IndicatorId IN (" + df_rc["RelatedIndicatorIDs"] + ")"
 
     # set datatypes/lengths for db
     df_rc["ChartTitle_EN"] = df_rc["ChartTitle_EN"].astype("string").str[:150]
@@ -541,24 +685,35 @@ def build_related_charts_df(idf, prod_defaults, existing_md_df):
     return df_rc
 
 
+def build_value_format_sql(format_df, lang, format_number=None):
+    # Return the sql expression that formats iv.value in language lang for indicators with the formats in format_df
+    # (DataFormatId/PrimaryChartTypeId, see set_uom_format, with the dialect's format_number). When the formats
+    # differ it is a CASE on the indicator metadata (md).
+    formats = {}  # format string --> sql conditions for the indicators that use it
+    for uom_id, chart_type_id in zip(format_df["DataFormatId"], format_df["PrimaryChartTypeId"]):
+        uom_id, chart_type_id = [None if pd.isna(value) else int(value) for value in (uom_id, chart_type_id)]
+        conditions = " AND ".join(column + (" IS NULL" if value is None else " = " + str(value))
+                                  for column, value in [("md.DataFormatId", uom_id),
+                                                        ("md.PrimaryChartTypeId", chart_type_id)])
+        formats.setdefault(set_uom_format(uom_id, lang, chart_type_id, format_number), []).append(conditions)
+    if len(formats) <= 1:
+        retval = next(iter(formats), set_uom_format(None, lang, None, format_number))
+    else:
+        retval = "CASE " + " ".join("WHEN " + " OR ".join("(" + cond + ")" for cond in conditions) + " THEN " +
+                                    format_str for format_str, conditions in formats.items()) + " END"
+    return retval
+
+
 def check_null_dimension_unique_keys(df, show_warnings):
     # notify user if there are any missing DimensionUniqueKeys in the df and show_warnings is true
     missing_keys_df = df[df["DimensionUniqueKey"].isnull()]
     if show_warnings and missing_keys_df.shape[0] > 0:
         log.warning("\n***WARNING***\nDimensionUniqueKey could not be matched for the following indicators:")
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None):
-            missing_keys_df = missing_keys_df.loc[:, ["IndicatorId", "IndicatorCode"]]
-            log.warning(missing_keys_df)
+        log.warning(h.lazyMessage(h.format_full_df, missing_keys_df.loc[:, ["IndicatorId", "IndicatorCode"]]))
         log.warning("*************\n")
     return
 
 
-def check_null_geography_reference(df):
-    # alert user w/ DGUID if any "GeographyReferenceId" in df has nulls
-    df_null_gr = df[df["GeographyReferenceId"].isna()].loc[:, ["DGUID"]].drop_duplicates(inplace=False)
-    return df_null_gr
-
-
 def copy_data_frames_for_date_range(df_to_copy, ref_date_list, min_ref_year, product_id, mixed_geo_justice_pids):
     # When passed a dataframe (df_to_copy) and a list of reference dates (ref_date_list), build a copy of the dataframe
     # for each reference and add it to a list. The list is then combined into one big dataframe and returned in ref_df.
@@ -594,6 +749,49 @@ def create_dimension_member_df(dim_members):
     return dm_df
 
 
+def cut_strings(values, max_length):
+    # return a column of text values cut to max_length characters ("string" dtype). Categorical columns are cut once
+    # for each category.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        cut_values = np.array([val[:max_length] for val in values.cat.categories.to_numpy(dtype=object)], dtype=object)
+        values = build_categorical_column(values.cat.codes.to_numpy(), cut_values, values.index)
+        return values.astype("string")
+    return values.astype("string").str[:max_length]
+
+
+def drop_mixed_geo_justice_rows(edf, prod_id, mixed_geo_justice_pids, is_sibling):
+    # Justice products with mixed geos (mixed_geo_justice_pids) have special date handling. Drop the rows of edf that
+    # are not loaded for these products (edf is changed in place).
+    if int(prod_id) in mixed_geo_justice_pids:
+        # remove rows < 2017 if geolevel is not in national, provincial, regional level
+        edf.drop(edf[(edf["RefYear"].astype("int16") < 2017) &
+                     (~edf["GeographicLevelId"].isin(["A0000", "A0001", "A0002"]))].index, inplace=True)
+        # for sibling tables with mixed geos, remove these same geolevels b/c they already exist in the master
+        if is_sibling:
+            edf.drop(edf[edf["GeographicLevelId"].isin(["A0000", "A0001", "A0002"])].index, inplace=True)
+    return edf
+
+
+def factorize_column(values):
+    # Return integer codes (-1 is NA) and the distinct values (object array) of a column. Categorical columns (arrow
+    # csv engine, parquet cache, interned columns) already have both.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype("int64"), values.cat.categories.to_numpy(dtype=object)
+    codes, uniques = pd.factorize(values)
+    return codes.astype("int64"), np.asarray(uniques, dtype=object)
+
+
+def filter_min_ref_year(chunk_df, min_ref_year, prod_id_str, mixed_geo_justice_pids):
+    # If min_ref_year is included and this is not a mixed geo justice table, drop any rows of a chunk with formatted
+    # columns (chunk_df) that have older dates (chunk_df is changed in place).
+    if min_ref_year and (int(prod_id_str) not in mixed_geo_justice_pids):
+        chunk_df["IntYear"] = chunk_df["RefYear"].astype("int16")  # temp column for comparison
+        ind_rows = chunk_df[chunk_df["IntYear"] < min_ref_year].index  # row index nums to delete
+        chunk_df.drop(ind_rows, inplace=True)
+        chunk_df.drop(["IntYear"], inplace=True, axis=1)
+    return chunk_df
+
+
 def fix_dguid(vintage, orig_dguid, prod_id):
     # Make any necessary corrections to the DGUID.
     # Format: VVVVTSSSSGGGGGGGGGGGG (V-vintage(4), T-type(1), S-schema(4), G-GUID(1-12) - 10-21 characters total
@@ -632,6 +830,15 @@ def get_related_indicator_list(generic_ind_code, idf, related_chart_id):
     return indicator_id_str
 
 
+def max_text_length(values):
+    # return the length of the longest text value in a column (0 if there are none). Categorical columns only measure
+    # their categories.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.categories.to_series()
+    lengths = values.astype("string").str.len()
+    return int(lengths.max()) if lengths.notna().any() else 0
+
+
 def set_generic_indicator_code(ind_code):
     # Take the indicator code (ind_code), and return a more generic version with the second to last element in
     # the coordinate replaced by a wildcard character
@@ -644,15 +851,20 @@ def set_generic_indicator_code(ind_code):
     return generic_ind_code
 
 
-def set_uom_format(uom_id, lang, chart_type_id):
+def set_uom_format(uom_id, lang, chart_type_id, format_number=None):
     # Returns format string for specified uom_id, language (lang), chart_type_id (1-bar, 2-pie, 3-line)
     # These formats were selected based on what already existed in the database as built by the powerBI process.
+    # format_number is the format_number of a database dialect (see dbdialects) for sql that runs in the ETL database,
+    # otherwise it is the SQL Server Format() of the stored chart queries.
     loc_code = "en-US"
     if lang == "fr":
         loc_code = "fr-CA"
 
     # default
-    format_str = "Format(iv.value, 'N', '" + loc_code + "')"  # Simplified from original version to avoid rounding
+    if format_number is None:
+        format_str = "Format(iv.value, 'N', '" + loc_code + "')"  # Simplified from original version to avoid rounding
+    else:
+        format_str = format_number("iv.value", "N", loc_code)
     return format_str
 
     # Original version - requested to keep this in case we want to restore rounding.
@@ -666,33 +878,38 @@ def set_uom_format(uom_id, lang, chart_type_id):
     # return format_str
 
 
-def setup_chunk_columns(cdf, prod_id_str, rel_date, min_ref_year, mixed_geo_justice_pids):
-    # set up the columns in a dataframe chunk of data from the csv file (cdf) for the specified product (prod_id_str)
+def setup_chunk_columns(cdf, prod_id_str, rel_date, min_ref_year, mixed_geo_justice_pids, interner=None):
+    # Set up the columns in a dataframe chunk of data from the csv file (cdf) for the specified product (prod_id_str)
     # and release date (rel_date). If min_ref_year is included and this is not a mixed geo justice table,
-    # exclude any rows with older dates.
+    # exclude any rows with older dates. The year filter runs on the raw rows so that dropped rows are never formatted.
+    # Strings that repeat (IndicatorCode, DGUID, GeographicLevelId) are interned as categorical columns, formatted
+    # once for each distinct value. interner (indexes.codeInterner) keeps them for every chunk of the product.
     chunk_df = cdf
-    chunk_df["IndicatorCode"] = build_indicator_code(chunk_df["COORDINATE"], chunk_df["REF_DATE"], prod_id_str)
+    interner = interner if interner is not None else idx.codeInterner()  # this chunk only
+    chunk_df["RefYear"] = build_ref_years(chunk_df["REF_DATE"])  # need 4 digit year
+    filter_min_ref_year(chunk_df, min_ref_year, prod_id_str, mixed_geo_justice_pids)  # before building other columns
+    date_codes, ref_dates = factorize_column(chunk_df["REF_DATE"])
+    chunk_df["IndicatorCode"] = build_indicator_code(chunk_df["COORDINATE"], date_codes, ref_dates, prod_id_str,
+                                                     interner)
     chunk_df.drop(["COORDINATE"], axis=1, inplace=True)  # not nec. after IndicatorCode
     chunk_df.rename(columns={"VECTOR": "Vector", "UOM": "UOM_EN"}, inplace=True)  # match db
-    chunk_df["RefYear"] = chunk_df["REF_DATE"].map(h.fix_ref_year).astype("string")  # need 4 digit year
-    chunk_df["DGUID"] = chunk_df["DGUID"].str.replace(".", "").str.replace("201A", "2015A")  # from powerBI process
-    chunk_df["DGUID"] = chunk_df.apply(lambda x: fix_dguid(x["RefYear"], x["DGUID"], prod_id_str), axis=1)  # fix crime
+    year_codes, ref_years = factorize_column(chunk_df["RefYear"])
+    chunk_df["DGUID"] = build_fixed_dguids(chunk_df["DGUID"], year_codes, ref_years, prod_id_str, interner)
     chunk_df["IndicatorThemeID"] = prod_id_str
     chunk_df["ReleaseIndicatorDate"] = rel_date
-    chunk_df["ReferencePeriod"] = chunk_df["RefYear"] + "-01-01"  # becomes Jan 1
-    chunk_df["ReferencePeriod"] = chunk_df["ReferencePeriod"].astype("datetime64[ns]")
+    periods = (pd.Series(ref_years, dtype="string") + "-01-01").astype("datetime64[ns]")  # becomes Jan 1
+    chunk_df["ReferencePeriod"] = build_categorical_column(year_codes, periods.to_numpy(), chunk_df.index).astype(
+        "datetime64[ns]")
     chunk_df["Vector"] = chunk_df["Vector"].str.replace("v", "").astype("int32")
-    chunk_df["GeographicLevelId"] = chunk_df["DGUID"].str[4:9]  # extract geo level id
-    if min_ref_year and (int(prod_id_str) not in mixed_geo_justice_pids):
-        chunk_df["IntYear"] = chunk_df["RefYear"].astype("int16")  # temp column for comparison
-        ind_rows = chunk_df[chunk_df["IntYear"] < min_ref_year].index  # row index nums to delete
-        chunk_df.drop(ind_rows, inplace=True)
-        chunk_df.drop(["IntYear"], inplace=True, axis=1)
+    geo_level_ids = np.array([dguid[4:9] for dguid in chunk_df["DGUID"].cat.categories.to_numpy(dtype=object)],
+                             dtype=object)  # extract geo level id
+    chunk_df["GeographicLevelId"] = build_categorical_column(chunk_df["DGUID"].cat.codes.to_numpy(), geo_level_ids,
+                                                             chunk_df.index)
     return chunk_df
 
 
 def write_dguid_warning(dguid_df):
-    # turn a dataframe of dguids (dguid_df) into a warning that can be written to a log file or console.
+    # turn a dataframe of dguids (dguid_df, DGUID column) into a warning that can be written to a log file or console.
     dguid_df.dropna(inplace=True)
     dguid_df.drop_duplicates(inplace=True)
     msg = "All expected DGUIDs were found in gis.GeographyReference."  # default
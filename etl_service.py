@@ -0,0 +1,439 @@
+# ETL service - the ETL as an importable API. An etlService keeps the WDS code sets, the database connection for each
+# thread and the reference table lookups between calls, so a long running process (ex. the job queue daemon) only pays
+# the startup and warm-up costs once:
+#   service = etl_service.etlService(min_ref_year=2015)
+#   service.run_products(service.discover_changes(date(2024, 1, 2), date(2024, 1, 5)))
+import arguments  # for merged product warnings
+import config as cfg  # configuration
+import cost_estimator  # for estimating product sizes
+import csv_handler  # for reading the product csv file
+import dfhandler as dfh  # for altering pandas data frames
+import helpers as h  # helper functions
+import indexes as idx  # lookup indexes for each product
+import json_handler as jh
+import logging
+import master_cache as mc  # for master product state shared by siblings
+import memory_governor as mg  # for adjusting chunk sizes to a memory budget
+import os
+import parquet_cache  # for caching formatted product data
+import pathlib
+import pipeline  # chunk pipeline for the product data file
+import planner  # for date range change sets
+import scdb  # database class
+import scheduler  # for running several products at once
+import scwds  # wds class
+import threading
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+WORK_DIR = str(pathlib.Path(__file__).parent.absolute())  # current script path
+DEFAULT_CHART_JSON = os.path.join(WORK_DIR, "product_defaults.json")  # default chart info for specific products
+# products to be merged to a single IndicatorThemeID
+PRODUCTS_TO_MERGE_JSON = os.path.join(WORK_DIR, "products_to_merge.json")
+
+# Products w/ mixed geographies need special handling of reference periods (can/prov/region - all data, others 2017+)
+# Note only the master product id is included here when it is a merged product. TODO --> find a cleaner way to do this
+MIXED_GEO_JUSTICE_PIDS = [35100177, 35100002, 35100026, 35100068]
+
+thread_data = threading.local()  # database connection for each product worker thread
+
+
+def get_thread_db():
+    # return the database connection for the current thread, connecting the first time (connections are not shared
+    # between threads, and are kept for the next call on the same thread)
+    if not hasattr(thread_data, "db"):
+        thread_data.db = scdb.sqlDb(cfg.sql_conn.get("driver", ""), cfg.sql_conn.get("server", ""),
+                                    cfg.sql_conn["database"], cfg.sql_conn.get("backend", "mssql"))
+    return thread_data.db
+
+
+# noinspection SpellCheckingInspection
+class etlService(object):
+    def __init__(self, min_ref_year=False, csv_engine="pandas", memory_budget=False, workers=0, cache_dir=False,
+                 product_workers=1, sibling_workers=1, append_periods=False, sharded_read=False,
+                 result_tables=False, query_views=False):
+        # Load options (same as the CLI arguments). The WDS code sets are downloaded once here.
+        self.min_ref_year = min_ref_year
+        self.csv_engine = csv_engine
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.product_workers = product_workers
+        self.sibling_workers = sibling_workers
+        self.append_periods = append_periods  # only load the new reference periods when that is all that changed
+        self.sharded_read = sharded_read  # extract the csv and let the workers parse it in byte range shards
+        self.result_tables = result_tables  # fill gis.IndicatorResult, read by the PrimaryQuery of every indicator
+        self.result_lock = threading.Lock()  # one gis.IndicatorResult refresh at a time
+        self.query_views = query_views  # chart queries read shared views instead of holding the whole query
+        self.wds = scwds.serviceWds(cfg.sc_conn["wds_url"], cfg.sc_conn["delta_url"])  # set up web services
+        self.merged_prod_dict = jh.get_merged_tables_from_json(PRODUCTS_TO_MERGE_JSON)
+        self.reference_lookups = None  # (geography index, null reasons), read once from the reference tables
+        self.reference_lock = threading.Lock()
+        self.master_caches = {}  # master pid (str) --> master_cache.masterCache for the siblings in a run
+        self.period_appends = {}  # master pid (str) --> new indicators (IndicatorId, IndicatorCode) in append mode
+        self.master_cache_lock = threading.Lock()
+
+    def check_product_ids(self, prod_ids, insert_new_table):
+        # check whether the products can be inserted (insert_new_table) or appended. Returns status message if
+        # issues, otherwise "".
+        ret_msg = ""
+        existing_prod_ids = get_thread_db().get_matching_product_list(prod_ids)  # check whether product exists in db
+        if len(existing_prod_ids) > 0 and insert_new_table:
+            ret_msg = "Cannot insert product because one or more Product IDs already exist in " \
+                      "gis.IndicatorTheme/gis.Dimensions. Run without -i to append data. " + str(existing_prod_ids)
+        elif len(existing_prod_ids) == 0 and prod_ids and not insert_new_table:
+            ret_msg = "Cannot append Product ID because it does not exist in gis.IndicatorTheme. Run with -i to add " \
+                      "a new product. " + str(prod_ids)
+        return ret_msg
+
+    def discover_changes(self, start_date, end_date):
+        # Return the products to update for the products released from start_date to end_date, as a change set from
+        # planner.build_change_set (each product once, merged products expanded to the master and all siblings).
+        self.merged_prod_dict = jh.get_merged_tables_from_json(PRODUCTS_TO_MERGE_JSON)
+        changed_by_date = planner.find_changed_products(self.wds, get_thread_db(), start_date, end_date,
+                                                        self.merged_prod_dict)
+        return planner.build_change_set(changed_by_date, self.merged_prod_dict)
+
+    def get_master_cache(self, db, master_pid_str):
+        # return the master product state for the siblings of master_pid_str, read by the first sibling that needs it
+        # (the others wait for it instead of reading it again)
+        with self.master_cache_lock:
+            if master_pid_str not in self.master_caches:
+                self.master_caches[master_pid_str] = mc.masterCache(db, master_pid_str)
+        return self.master_caches[master_pid_str]
+
+    def find_period_append_dates(self, db, pid, pid_meta, ref_dates):
+        # Append mode: return the reference dates of a product (pid) that are not loaded yet, if only new reference
+        # periods were added since it was loaded (see planner.check_period_append), otherwise None to reload it all.
+        existing_periods_df = db.get_indicator_reference_periods(pid)
+        new_ref_dates = planner.find_new_reference_dates(ref_dates, existing_periods_df, self.min_ref_year, pid,
+                                                         MIXED_GEO_JUSTICE_PIDS)
+        append_msg = planner.check_period_append(new_ref_dates, existing_periods_df,
+                                                 cost_estimator.count_members(pid_meta, False))
+        if append_msg:
+            log.info("Reloading all reference periods: " + append_msg)
+            return None
+        log.info("Appending " + str(len(new_ref_dates)) + " new reference period(s): " +
+                 ", ".join(new_ref_dates.strftime("%Y-%m-%d")) + ". Loaded periods are left in place.")
+        return new_ref_dates
+
+    def get_reference_lookups(self, db):
+        # return the geography index (DGUIDs from gis.GeographyReference) and null reasons (gis.IndicatorNullReason),
+        # read the first time they are needed. The ETL never changes these tables; restart a long running service
+        # after loading them.
+        with self.reference_lock:
+            if self.reference_lookups is None:
+                self.reference_lookups = (idx.geographyIndex(db.get_geo_reference_ids()),
+                                          db.get_indicator_null_reason())
+        return self.reference_lookups
+
+    def insert_product(self, prod_ids):
+        # Insert a new product (the first of prod_ids) to gis.IndicatorTheme, gis.Dimensions and gis.DimensionValues.
+        # More than one product id creates a merged product (the first is the master) in products_to_merge.json.
+        # The data is loaded afterwards with run_products. Returns status message if issues, otherwise "".
+        ret_msg = ""
+        db = get_thread_db()
+        ind_theme_id = prod_ids[0] if prod_ids[0] else ""  # 1st product id given will be inserted as main product
+        if len(prod_ids) > 1:  # if it is a table to be merged, update the json file for merged tables
+            jh.update_merge_products_json(ind_theme_id, prod_ids, PRODUCTS_TO_MERGE_JSON)
+
+        new_merged_prods = jh.get_merged_tables_from_json(PRODUCTS_TO_MERGE_JSON)
+        self.merged_prod_dict = new_merged_prods
+        if len(prod_ids) == 1 and jh.is_master_in_merged_product(ind_theme_id, new_merged_prods):
+            # notify user if they tried to insert a table that has already been flagged as a master in json
+            ret_msg = arguments.show_merge_warning("", ind_theme_id, PRODUCTS_TO_MERGE_JSON)
+        elif len(prod_ids) == 1 and jh.is_sibling_in_merged_product(ind_theme_id, new_merged_prods):
+            # notify user if they tried to insert a table that has already been flagged as a sibling in json
+            ret_msg = arguments.show_merge_warning(ind_theme_id, jh.get_master_prod_id(ind_theme_id, new_merged_prods),
+                                                 PRODUCTS_TO_MERGE_JSON)
+        else:
+            pid_meta = scwds.build_metadata_dict(self.wds.get_cube_metadata(ind_theme_id), ind_theme_id)  # metadata
+            ex_subj = db.get_matching_product_list([pid_meta["subject_code"]])  # existing 2-5 digit subject code
+            ex_subj_short = db.get_matching_product_list([pid_meta["subject_code_short"]])  # existing subject code (2)
+            ex_subj_dummy = db.get_matching_product_list(
+                [str(pid_meta["subject_code"]) + h.create_dummy_subject_code_suffix(pid_meta["subject_code"])])
+            ex_subj_short_dummy = db.get_matching_product_list(
+                [str(pid_meta["subject_code_short"]) +
+                 h.create_dummy_subject_code_suffix(pid_meta["subject_code_short"])])
+
+            # insert to gis.IndicatorTheme
+            log.info("Adding product to IndicatorTheme table.")
+            df_ind_theme = dfh.build_indicator_theme_df(pid_meta, ind_theme_id, ex_subj, ex_subj_short, ex_subj_dummy,
+                                                        ex_subj_short_dummy, self.wds.subject_codes)
+            db.insert_dataframe_rows(df_ind_theme, "IndicatorTheme", "gis")
+            del df_ind_theme
+
+            # insert to gis.Dimensions
+            log.info("Adding product to Dimensions table.")
+            with db.id_lock:  # other products may be loading
+                next_dim_id = db.get_last_table_id("DimensionId", "Dimensions", "gis") + 1  # setup unique IDs
+                df_dims = dfh.build_dimension_df(pid_meta, ind_theme_id, next_dim_id)
+                db.insert_dataframe_rows(df_dims, "Dimensions", "gis")
+
+            # insert to gis.DimensionValues (Note: Geo is dropped and "Date" dimension will be added during append)
+            log.info("Adding product to DimensionValues table.\n")
+            with db.id_lock:
+                next_dim_val_id = db.get_last_table_id("DimensionValueId", "DimensionValues", "gis") + 1  # unique IDs
+                df_dim_vals = dfh.build_dimension_values_df(pid_meta, df_dims, next_dim_val_id)
+                db.insert_dataframe_rows(df_dim_vals, "DimensionValues", "gis")
+            del df_dims, df_dim_vals
+        return ret_msg
+
+    def run_products(self, prod_ids, plan_notes=None, plan_only=False):
+        # Append the data for each product in prod_ids (a master product id also brings in its siblings). The size of
+        # each product is estimated from its metadata so the largest products start first, the chunk size suits the
+        # memory budget, and products that would not fit in the budget are not loaded. The siblings of a merged product
+        # share the state of their master (read once) and up to sibling_workers siblings load at the same time.
+        # plan_notes (pid --> why the product is being updated) is shown with the estimates, and plan_only stops after
+        # them. Returns a list of timings for each product from scheduler.run_product_units (empty for plan_only).
+        self.merged_prod_dict = jh.get_merged_tables_from_json(PRODUCTS_TO_MERGE_JSON)  # find info about merged tables
+        self.master_caches = {}  # read again for each run, the masters may have changed
+        self.period_appends = {}
+        products_to_update = list(prod_ids)
+        # If > 1 prod_id: indicates a new merged table, all sibling product ids will already be included in prod_ids.
+        # If single specified product is a master table for append, find all siblings and add to products_to_update.
+        if len(prod_ids) == 1 and jh.is_master_in_merged_product(prod_ids[0], self.merged_prod_dict):
+            sibling_pids = (jh.get_sibling_prod_ids(prod_ids[0], self.merged_prod_dict))
+            products_to_update = h.combine_ordered_lists(products_to_update, sibling_pids)  # ensures master runs 1st
+        if not products_to_update:
+            log.info("No products to update.")
+            return []
+
+        product_metadata = {}
+        product_costs = {}
+        for pid in products_to_update:
+            product_metadata[pid] = scwds.build_metadata_dict(self.wds.get_cube_metadata(pid), str(pid))
+            functional_pid = jh.get_master_prod_id(pid, self.merged_prod_dict) or pid  # siblings load as the master
+            product_costs[pid] = cost_estimator.estimate_product_cost(pid, functional_pid, product_metadata[pid],
+                                                                      self.min_ref_year, MIXED_GEO_JUSTICE_PIDS,
+                                                                      self.memory_budget, self.workers)
+        cost_estimator.log_product_costs(product_costs.values(), self.memory_budget, plan_notes)
+        if plan_only:
+            log.info("Plan only (--plan-only): no products were updated.")
+            return []
+
+        # Merged products run as one unit (master first, then its siblings on up to sibling_workers threads) and
+        # independent units run at the same time on up to product_workers threads.
+        product_units = scheduler.build_product_units(products_to_update, self.merged_prod_dict)
+        return scheduler.run_product_units(product_units,
+                                           lambda pid: self.update_product(pid, product_metadata[pid],
+                                                                           product_costs[pid]),
+                                           self.product_workers, product_costs, self.memory_budget,
+                                           self.sibling_workers)
+
+    def update_product(self, pid, pid_meta, pid_cost):
+        # Append the data for a product (pid) to the database, with its metadata (pid_meta) and size estimate (pid_cost)
+        # from run_products. Runs on a product worker thread when several products are updated at once, so it uses the
+        # connection for the current thread.
+        db = get_thread_db()
+        pid_str = str(pid)  # for moments when str is required
+        pid_folder = os.path.join(WORK_DIR, pid_str + "-en")
+        pid_csv_path = os.path.join(pid_folder, pid_str + ".csv")
+
+        # Check if product is a master or sibling table (could be neither). Determines which db tables get updated.
+        is_master = jh.is_master_in_merged_product(pid, self.merged_prod_dict)
+        is_sibling = jh.is_sibling_in_merged_product(pid, self.merged_prod_dict)
+        master_pid_str = jh.get_master_prod_id(pid, self.merged_prod_dict) if is_sibling else ""
+        functional_pid_str = master_pid_str if is_sibling else pid_str  # pid that will be saved to db for this product
+
+        # Formatted data for this release may already be cached from an earlier run (no download needed)
+        cache_path = parquet_cache.get_cache_path(self.cache_dir, pid, pid_meta["release_date"]) if self.cache_dir \
+            else ""
+        from_cache = bool(cache_path) and parquet_cache.is_cache_complete(cache_path, functional_pid_str)
+
+        # Download the product
+        if from_cache or (self.wds.get_full_table_download(pid, "en", pid_folder + ".zip") and
+                          h.valid_zip_file(pid_folder + ".zip")):
+            if is_sibling:
+                log.info("Updating sibling Product ID: " + pid_str + " (Master ID: " + master_pid_str + ").")
+            elif is_master:
+                with self.master_cache_lock:
+                    self.master_caches.pop(pid_str, None)  # siblings read the master again after it is reloaded
+                    self.period_appends.pop(pid_str, None)
+                log.info("Updating master Product ID: " + pid_str + ". Sibling product updates will follow.")
+            else:
+                log.info("Updating Product ID: " + pid_str + "\n")
+
+            # keep any existing product chart info to preserve some of the manual chart diplay configuration if possible
+            existing_ind_chart_meta_data = db.get_indicator_chart_info(pid_str)
+
+            # build list of dates that should be found in the reference data based on the cube frequency
+            ref_dates = dfh.build_reference_dates(pid_meta["start_date"], pid_meta["end_date"], pid_meta["freq"])
+
+            # Append mode: a product that only gained reference periods keeps its data and only the new periods are
+            # loaded. Siblings follow their master (they load the periods the master appended).
+            is_period_append = False
+            if self.append_periods and not is_sibling:
+                new_ref_dates = self.find_period_append_dates(db, pid, pid_meta, ref_dates)
+                if new_ref_dates is not None:
+                    ref_dates = new_ref_dates
+                    is_period_append = True
+            elif self.append_periods:
+                is_period_append = master_pid_str in self.period_appends
+
+            # Indicator rows are built (ids from 0, offset when inserted) and checked against the gis column metadata
+            # before the product is deleted, so a product that cannot be inserted keeps its current data
+            if not is_sibling:
+                df_ind = dfh.build_indicator_df(pid, pid_meta["release_date"], pid_meta["dimensions_and_members"],
+                                                self.wds.uom_codes, ref_dates, 0, self.min_ref_year,
+                                                MIXED_GEO_JUSTICE_PIDS)
+                db.validate_dataframe(dfh.build_indicator_df_subset(df_ind), "Indicator", "gis")
+
+            # delete product in database (only if not a sibling product)
+            if is_period_append or db.delete_product(pid, is_sibling):
+                geo_index, df_ind_null = self.get_reference_lookups(db)
+
+                # Indicator
+                if is_sibling:
+                    # for sibling tables, the master indicator info is read from db once for all of the siblings
+                    sibling_master = self.get_master_cache(db, master_pid_str)
+                    ind_index = sibling_master.ind_index
+                    if is_period_append:
+                        ind_index = idx.indicatorIndex(self.period_appends[master_pid_str])  # new periods only
+                else:
+                    log.info("Updating Indicator table.")
+                    with db.id_lock:  # other products may be loading
+                        next_ind_id = db.get_last_table_id("IndicatorId", "Indicator", "gis") + 1  # setup unique IDs
+                        df_ind["IndicatorId"] += next_ind_id
+                        # subset for insert and keep only fields needed for next table inserts.
+                        db.insert_dataframe_rows(dfh.build_indicator_df_subset(df_ind), "Indicator", "gis")
+                    df_ind = df_ind.loc[:, ["IndicatorId", "IndicatorCode", "IndicatorFmt", "UOM_EN", "UOM_FR",
+                                            "UOM_ID", "LastIndicatorMember_EN", "LastIndicatorMember_FR"]]
+                    log.info("Processed " + f"{df_ind.shape[0]:,}" + " rows for gis.Indicator.\n")
+                    ind_index = idx.indicatorIndex(df_ind)  # IndicatorCode --> IndicatorId lookup for each chunk
+                    if is_master and is_period_append:
+                        with self.master_cache_lock:
+                            self.period_appends[pid_str] = df_ind.loc[:, ["IndicatorId", "IndicatorCode"]]
+
+                log.info("Updating IndicatorValues and GeographyReferenceForIndicator tables.")
+                governor = mg.memoryGovernor(self.memory_budget, pid_cost["chunk_size"])
+                shard_csv_path = ""  # extracted csv file for sharded reads
+                if from_cache:
+                    log.info("Reading cached product data as chunks: " + cache_path + "\n")
+                    chunks = parquet_cache.read_cache_chunks(cache_path, governor.get_chunk_size, self.min_ref_year,
+                                                             functional_pid_str, MIXED_GEO_JUSTICE_PIDS)
+                else:
+                    # reads in zipped csv as chunks w/o full extraction, chunk size is adjusted to the memory budget
+                    col_dict = dfh.build_column_and_type_dict(pid_meta["dimension_names"]["en"])  # column/data types
+                    if self.sharded_read:
+                        # extracted once, then each worker parses its own byte range shards of the csv
+                        shard_csv_path = csv_handler.extract_csv(pid_folder + ".zip", pid_str + ".csv", pid_folder)
+                        log.info("Reading extracted csv file as shards: " + shard_csv_path + "\n")
+                        chunks = csv_handler.read_csv_shards(shard_csv_path, col_dict, governor.get_chunk_size,
+                                                             self.csv_engine)
+                    else:
+                        log.info("Reading zip file as chunks: " + pid_csv_path + "\n")
+                        chunks = csv_handler.read_csv_chunks(pid_folder + ".zip", pid_str + ".csv", col_dict,
+                                                             governor.get_chunk_size, self.csv_engine)
+                    if cache_path:
+                        parquet_cache.start_cache(cache_path)
+                chunk_ctx = pipeline.build_chunk_context(functional_pid_str, pid_meta["release_date"],
+                                                         self.min_ref_year, MIXED_GEO_JUSTICE_PIDS, is_sibling,
+                                                         ind_index, geo_index, df_ind_null, from_cache,
+                                                         "" if from_cache else cache_path, pid_str, is_period_append)
+
+                # IndicatorValueIds for the estimated rows are reserved up front (unused ids are given back after)
+                id_range = pipeline.idRange(db, pid_cost["rows"])
+                governor.start()
+                try:
+                    chunk_totals = pipeline.run_chunk_pipeline(chunks, chunk_ctx, db, governor, self.workers,
+                                                               id_range)
+                finally:
+                    governor.stop()
+                    if shard_csv_path:
+                        os.remove(shard_csv_path)
+                if cache_path and not from_cache:
+                    parquet_cache.finish_cache(cache_path, functional_pid_str, chunk_totals["file_rows"])
+
+                # show final counts and any missing DGUIDs
+                if self.min_ref_year:
+                    year_dropped_rows = chunk_totals["year_dropped_rows"]
+                    if from_cache:  # the cache reader skipped these rows
+                        year_dropped_rows = parquet_cache.read_manifest(cache_path)["rows"] - chunk_totals["file_rows"]
+                    log.info("\nDropped " + f"{year_dropped_rows:,}" + " rows older than " + str(self.min_ref_year) +
+                                " before formatting.")
+                if is_period_append:
+                    log.info("\nSkipped " + f"{chunk_totals['period_dropped_rows']:,}" +
+                             " rows for reference periods already loaded.")
+                log.info("\nThere were " + f"{chunk_totals['rows']:,}" + " rows in the file.")
+                log.info("Processed " + f"{chunk_totals['iv_rows']:,}" + " rows for gis.IndicatorValues.")
+                log.info("Processed " + f"{chunk_totals['gri_rows']:,}" +
+                            " rows for gis.GeographyReferenceForIndicator.")
+                log.warning(h.lazyMessage(dfh.write_dguid_warning, chunk_totals["missing_dguids"].to_df()))
+
+                # GeographicLevelforIndicator - from what was built above feed next to df
+                log.info("\nUpdating GeographicLevelForIndicator table.")
+                geo_df = chunk_totals["geo_levels"].to_df()  # distinct geo levels from every chunk
+                if is_sibling:
+                    gli_rows = sibling_master.add_geo_levels(db, geo_df)  # skips levels the master already has
+                else:
+                    existing_geo_levels_df = db.get_geo_levels(functional_pid_str)
+                    df_gli = dfh.build_geographic_level_for_indicator_df(geo_df, existing_geo_levels_df, is_sibling)
+                    db.insert_dataframe_rows(df_gli, "GeographicLevelForIndicator", "gis")
+                    gli_rows = df_gli.shape[0]
+                    del df_gli
+                log.info("Processed " + f"{gli_rows:,}" + " rows for gis.GeographicLevelForIndicator.\n")
+
+                # DimensionValues - from ref_date list created above, add any missing values to false "Date" dimension
+                log.info("Adding new reference dates to DimensionValues table.")
+                file_ref_dates_df = chunk_totals["ref_dates"].to_df()  # distinct ref dates from every chunk
+                if is_sibling:
+                    dv_rows = sibling_master.add_ref_dates(db, file_ref_dates_df)  # siblings use the master "Date"
+                else:
+                    # find ref_dates already in db under the DimensionId for "Date"
+                    existing_ref_dates_df = db.get_date_dimension_values(functional_pid_str)
+                    date_dimension_id = db.get_date_dimension_id_for_product(functional_pid_str)
+                    with db.id_lock:
+                        next_dim_val_id = db.get_last_table_id("DimensionValueId", "DimensionValues", "gis") + 1  # ID
+                        next_dim_val_display_order = db.get_last_date_dimension_display_order(date_dimension_id) + 1
+                        df_dv = dfh.build_date_dimension_values_df(file_ref_dates_df, existing_ref_dates_df,
+                                                                   date_dimension_id, next_dim_val_id,
+                                                                   next_dim_val_display_order)
+                        if df_dv.shape[0] > 0:
+                            db.insert_dataframe_rows(df_dv, "DimensionValues", "gis")
+                    dv_rows = df_dv.shape[0]
+                    del df_dv
+                log.info("Added " + f"{dv_rows:,}" + " row(s) for gis.DimensionValues.\n")
+
+                if not is_sibling:  # (master or single tables only)
+                    # IndicatorMetadata
+                    log.info("Updating IndicatorMetadata table.")
+                    df_dm = db.get_dimensions_and_members_by_product(pid_str)
+                    df_dim_keys = dfh.build_dimension_unique_keys(df_dm)  # from dimensions/dimensionvalues ids
+                    df_im = dfh.build_indicator_metadata_df(df_ind,
+                                                            jh.get_product_defaults(pid_str, DEFAULT_CHART_JSON),
+                                                            df_dim_keys, existing_ind_chart_meta_data,
+                                                            self.result_tables, self.query_views)
+                    if self.query_views and not self.result_tables:
+                        db.create_query_views(dfh.build_query_views(df_im, "PrimaryChartTypeId", "PrimaryQuery",
+                                                                    db.dialect.format_number))
+                    db.insert_dataframe_rows(df_im, "IndicatorMetaData", "gis")
+                    log.info("Processed " + f"{df_im.shape[0]:,}" + " rows for gis.IndicatorMetadata.\n")
+                    del df_im
+
+                    # RelatedCharts
+                    log.info("Updating RelatedCharts table.")
+                    df_rc = dfh.build_related_charts_df(df_ind, jh.get_product_defaults(pid_str, DEFAULT_CHART_JSON),
+                                                        existing_ind_chart_meta_data, self.query_views)
+                    if self.query_views:
+                        db.create_query_views(dfh.build_query_views(df_rc, "ChartTypeId", "RelatedChartQuery",
+                                                                    db.dialect.format_number))
+                    db.insert_dataframe_rows(df_rc, "RelatedCharts", "gis")
+                    log.info("Processed " + f"{df_rc.shape[0]:,}" + " rows for gis.RelatedCharts.\n")
+                    del df_rc
+
+                # IndicatorResult - the rows of the PrimaryQuery join, refreshed after the other tables are loaded.
+                # Siblings and appended periods only add their new rows.
+                if self.result_tables:
+                    log.info("Updating IndicatorResult table.")
+                    with self.result_lock:
+                        result_query = dfh.build_indicator_result_query(
+                            db.get_indicator_value_formats(functional_pid_str), is_sibling or is_period_append,
+                            db.dialect.format_number)
+                        ir_rows = db.refresh_indicator_results(functional_pid_str, result_query,
+                                                               is_sibling or is_period_append)
+                    log.info("Processed " + f"{ir_rows:,}" + " rows for gis.IndicatorResult.\n")
+
+                log.info("Finished processing product: " + pid_str + "\n")
@@ -1,15 +1,29 @@
 # helper functions
+import atexit
 import datetime as dt
-import gc  # for garbage collection
+import lazy_modules as lm  # for importing pandas and psutil when first used
 import logging
-from logging.handlers import RotatingFileHandler
-import pandas as pd
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import multiprocessing as mp
+import os
+import queue
+import threading
 import zipfile as zf
 
+pd = lm.lazy_import("pandas")
+try:
+    psutil = lm.lazy_import("psutil")  # optional, used to measure memory
+except ImportError:
+    psutil = None
+
 # set up logger if available
 log = logging.getLogger("etl_log")
 log.addHandler(logging.NullHandler())
 
+log_listeners = {}  # QueueListener from setup_logger for each log name
+worker_log_listeners = {}  # QueueListener for the records logged in worker processes for each log name
+worker_log_lock = threading.Lock()
+
 
 def build_freq_code_to_pd_dict():
     # build a dictionary of pandas date formats based on WDS codes that indicate how often the data is published).
@@ -75,14 +89,6 @@ def daterange(date1, date2):
     return retval
 
 
-# noinspection PyUnusedLocal
-def delete_var_and_release_mem(var_names):
-    # delete each variable in list and recover memory
-    for var_name in var_names:
-        del var_name
-    gc.collect()
-
-
 def fix_ref_year(year_str):
     # handle abnormal year formats in reference periods
     year_str = str(year_str)
@@ -101,6 +107,12 @@ def fix_ref_year(year_str):
     return retval
 
 
+def format_full_df(df):
+    # return every row and column of a data frame (df) as text, for log messages (see lazyMessage)
+    with pd.option_context("display.max_rows", None, "display.max_columns", None):
+        return df.to_string()
+
+
 def get_nth_item_from_string_list(item_list, delim, n=None):
     # Convert string to list with delimiter and return the nth member of the list. If none given, return last item.
     # Example: "Property with multiple residential units _ Vacant land _ Number of owners" --> "Number of owners"
@@ -121,6 +133,43 @@ def get_partitioned_string(search_str, delim):
     return retval
 
 
+def get_child_process_rss():
+    # return the resident memory (bytes) of the child processes of the current process (ex. the transform workers),
+    # 0 if there are none or it cannot be measured
+    retval = 0
+    if psutil is not None:
+        for child in psutil.Process().children(recursive=True):
+            try:
+                retval += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):  # ended since it was listed
+                continue
+    elif os.path.exists("/proc/self/statm"):  # linux without psutil: direct children (ppid in /proc/<pid>/stat)
+        for pid in filter(str.isdigit, os.listdir("/proc")):
+            try:
+                with open("/proc/" + pid + "/stat") as stat:
+                    ppid = int(stat.read().rsplit(")", 1)[1].split()[1])  # after the command name
+                if ppid == os.getpid():
+                    with open("/proc/" + pid + "/statm") as statm:
+                        retval += int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except (OSError, IndexError, ValueError):  # ended since it was listed
+                continue
+    return retval
+
+
+def get_process_rss(include_children=False):
+    # return the resident memory (bytes) of the current process, or None if it cannot be measured. With
+    # include_children the memory of its child processes is added (see get_child_process_rss).
+    retval = None
+    if psutil is not None:
+        retval = psutil.Process().memory_info().rss
+    elif os.path.exists("/proc/self/statm"):  # linux without psutil
+        with open("/proc/self/statm") as statm:
+            retval = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    if retval is not None and include_children:
+        retval += get_child_process_rss()
+    return retval
+
+
 def get_subject_code_from_product_id(product_id):
     # return first 2 digits of product id as subject code (ex. "35100002" --> "35")
     return str(str(product_id)[:2])
@@ -167,17 +216,69 @@ def get_uom_desc_from_code_set(uom_code, uom_codeset, lang):
     return retval
 
 
+def get_worker_log_queue(log_name):
+    # Queue for the records that worker processes log to log_name (see setup_worker_logger). A second listener thread
+    # writes them with the handlers from setup_logger. Created on first use, None if setup_logger was not called.
+    with worker_log_lock:
+        if log_name not in worker_log_listeners and log_name in log_listeners:
+            listener = QueueListener(mp.Queue(), *log_listeners[log_name].handlers)
+            listener.start()
+            worker_log_listeners[log_name] = listener
+        listener = worker_log_listeners.get(log_name)
+    return listener.queue if listener is not None else None
+
+
 def setup_logger(work_dir, log_name):
+    # Set up logging to console and file. Logging calls only put the record on a queue, and a listener thread formats
+    # and writes it, so the loader never waits on log I/O or on rendering lazyMessage text. The listener writes
+    # anything still queued when the program exits.
     logger = logging.getLogger(log_name)
-    logging.getLogger("etl_log")
-    logging.basicConfig(format="%(message)s", level=logging.INFO)
-    fh = logging.handlers.RotatingFileHandler(work_dir + "\\" + log_name + ".log", maxBytes=2000000, backupCount=5)
+    logging.basicConfig(format="%(message)s", level=logging.INFO)  # console for other libraries
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter("%(message)s"))
+    fh = RotatingFileHandler(os.path.join(work_dir, log_name + ".log"), maxBytes=2000000, backupCount=5)
     log_fmt = logging.Formatter("%(levelname)s:%(message)s - %(asctime)s")
     fh.setFormatter(log_fmt)
-    logger.addHandler(fh)  # for writing to file
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, ch, fh)  # for writing to console and file
+    logger.addHandler(deferredQueueHandler(log_queue))
+    logger.propagate = False  # the listener writes to the console instead of the root logger
+    listener.start()
+    log_listeners[log_name] = listener
+    atexit.register(stop_logger, log_name)
     return logger
 
 
+def setup_worker_logger(log_queue, log_name):
+    # Log to log_queue (from get_worker_log_queue) in a worker process instead of the handlers it inherited. A forked
+    # worker has the queue of setup_logger but not the listener thread that empties it, and a spawned one has none.
+    # QueueHandler formats each message here, so the record can be sent to the main process.
+    logger = logging.getLogger(log_name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def stop_logger(log_name):
+    # stop the listener threads of log_name (writing anything still queued, worker records first) and close its files
+    with worker_log_lock:
+        worker_listener = worker_log_listeners.pop(log_name, None)
+    if worker_listener is not None:
+        worker_listener.stop()
+        worker_listener.queue.close()
+    listener = log_listeners.pop(log_name, None)
+    if listener is not None:
+        logger = logging.getLogger(log_name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, deferredQueueHandler):
+                logger.removeHandler(handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
 def valid_zip_file(source_file):
     log.info("Checking " + source_file)
     retval = True
@@ -185,3 +286,22 @@ def valid_zip_file(source_file):
         log.warning("\nERROR: Not a valid zip file: " + source_file)
         retval = False
     return retval
+
+
+# noinspection SpellCheckingInspection
+class deferredQueueHandler(QueueHandler):
+    # Queue handler that leaves the record as it is, so the message (ex. a lazyMessage) is only formatted by the
+    # listener thread. Message arguments must not be changed after they are logged.
+    def prepare(self, record):
+        return record
+
+
+# noinspection SpellCheckingInspection
+class lazyMessage(object):
+    def __init__(self, render, *args):
+        # log message that is only built (render(*args)) when it is written, ex. a warning listing a large data frame
+        self.render = render
+        self.args = args
+
+    def __str__(self):
+        return str(self.render(*self.args))
@@ -0,0 +1,84 @@
+# lookup indexes built once per product and used for every chunk of the csv file
+import lazy_modules as lm  # for importing numpy and pandas when first used
+import logging
+
+np = lm.lazy_import("numpy")
+pd = lm.lazy_import("pandas")
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+
+def take_codes(codes, value_codes):
+    # map integer codes (-1 is NA) to value_codes (one for each code value), NA stays -1
+    if len(value_codes) == 0:  # only NA codes
+        return np.full(len(codes), -1, dtype="int64")
+    return np.where(codes >= 0, np.asarray(value_codes)[np.maximum(codes, 0)], -1)
+
+
+# noinspection SpellCheckingInspection
+class indicatorIndex(object):
+    def __init__(self, idf):
+        # Build the index from the indicator dataframe (idf) with the IndicatorCode and IndicatorId of each indicator
+        # in the product. Each IndicatorCode gets an integer position and the ids are stored in position order, so
+        # resolving a code to an id is an array lookup instead of a merge.
+        ind_df = idf.drop_duplicates(subset="IndicatorCode", keep="first")
+        if ind_df.shape[0] < idf.shape[0]:
+            log.warning("Duplicate IndicatorCodes found for the product, the first IndicatorId is used for each.")
+        self.codes = pd.Index(ind_df["IndicatorCode"].astype("string").to_numpy(dtype=object))
+        self.ids = ind_df["IndicatorId"].to_numpy(dtype="int64")
+
+    def get_positions(self, codes):
+        # Return the integer position of each IndicatorCode in codes, -1 if the code is not in the product. For a
+        # categorical column (interned codes) only the distinct codes are looked up.
+        if isinstance(codes.dtype, pd.CategoricalDtype):
+            code_positions = self.codes.get_indexer(codes.cat.categories.to_numpy(dtype=object))
+            return take_codes(codes.cat.codes.to_numpy(), code_positions)
+        return self.codes.get_indexer(np.asarray(codes, dtype=object))
+
+    def get_indicator_ids(self, codes):
+        # return the IndicatorId for each IndicatorCode in codes as a nullable integer array (NA if not found)
+        positions = self.get_positions(codes)
+        missing = positions < 0
+        ids = self.ids[np.where(missing, 0, positions)] if len(self.ids) > 0 else np.zeros(len(positions), "int64")
+        return pd.arrays.IntegerArray(ids, missing)
+
+
+# noinspection SpellCheckingInspection
+class geographyIndex(object):
+    def __init__(self, gdf):
+        # Build the index from the GeographyReference ids (gdf). The DGUIDs are kept as a hash index so a chunk only
+        # needs one lookup for each distinct DGUID instead of a merge against the whole table.
+        self.dguids = pd.Index(gdf["GeographyReferenceId"].dropna().astype("string").unique().to_numpy(dtype=object))
+
+    def lookup(self, dguids):
+        # Check which of the DGUIDs in a chunk (dguids) exist in gis.GeographyReference. Returns a boolean mask for
+        # each row and a list of the distinct DGUIDs that were not found.
+        if isinstance(dguids.dtype, pd.CategoricalDtype):  # interned: integer codes, uniques in order of appearance
+            codes, uniques = pd.factorize(dguids)
+        else:
+            codes, uniques = pd.factorize(np.asarray(dguids, dtype=object))  # NA values get code -1
+        uniques = np.asarray(uniques, dtype=object)
+        found = self.dguids.get_indexer(uniques) >= 0
+        mask = np.where(codes >= 0, found[np.maximum(codes, 0)], False) if len(found) > 0 else codes >= 0
+        missing = [dguid for dguid, is_found in zip(uniques, found) if not is_found]
+        return mask, missing
+
+
+# noinspection SpellCheckingInspection
+class codeInterner(object):
+    def __init__(self):
+        # Formatted values of the strings that repeat across the chunks of a product (IndicatorCodes, fixed DGUIDs),
+        # by kind. Each distinct value is formatted once per product and every chunk shares the same string objects;
+        # chunk rows only hold integer codes into them (pandas categorical columns).
+        self.values = {}  # kind --> {key --> formatted value}
+
+    def get(self, kind, keys, build):
+        # Return the formatted value of each key (list of distinct keys) of a kind as an object array. build is called
+        # with the keys that were not seen before and returns their formatted values (same order).
+        known = self.values.setdefault(kind, {})
+        new_keys = [key for key in keys if key not in known]
+        if new_keys:
+            known.update(zip(new_keys, build(new_keys)))
+        return np.array([known[key] for key in keys], dtype=object)
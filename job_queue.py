@@ -0,0 +1,163 @@
+# job queue - a folder of json job files for the ETL daemon (main.py --daemon). Jobs are submitted to the pending
+# folder (main.py --submit, or submit_job from another program) and the daemon claims them oldest first, moving each
+# file to running, then done or failed with its result. Only one daemon can serve a queue (it holds a lock on the
+# queue folder), and only one should load a database: the ids of new rows are allocated in the daemon process.
+#   {"prodid": [35100003]}                             append a product (a master also updates its siblings)
+#   {"prodid": [35100003], "insert": true}             insert a new product, then append it
+#   {"start": "2024-01-02", "end": "2024-01-05"}       update the products released in a date range
+# Any job can add "plan_only": true to only log the products it would update.
+import json
+import logging
+import os
+import planner  # for describing date range change sets
+import time
+import uuid
+from datetime import date, datetime
+try:
+    import fcntl  # for the daemon lock (linux/mac)
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt  # for the daemon lock (windows)
+except ImportError:
+    msvcrt = None
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+JOB_FOLDERS = ["pending", "running", "done", "failed"]
+POLL_INTERVAL = 5  # seconds between checks for new jobs when the queue is empty
+LOCK_FILE = "daemon.lock"  # held by the daemon serving the queue
+
+
+def check_job(job):
+    # check a job before it is run. Returns status message if issues, otherwise "".
+    ret_msg = ""
+    if job.get("prodid") and (job.get("start") or job.get("end")):
+        ret_msg = "Product ID search cannot be combined with start/end dates."
+    elif job.get("insert") and not job.get("prodid"):
+        ret_msg = "Product ID is required for new products."
+    elif not job.get("insert") and len(job.get("prodid") or []) > 1:
+        ret_msg = "Multiple Product IDs can only be used when inserting a new merged product."
+    elif bool(job.get("start")) != bool(job.get("end")):
+        ret_msg = "Start and end date must both be present to look up products within a date range."
+    elif not job.get("prodid") and not job.get("start"):
+        ret_msg = "Job needs prodid OR start and end."
+    elif job.get("start") and date.fromisoformat(job["end"]) < date.fromisoformat(job["start"]):
+        ret_msg = "Start date must be before end date."
+    return ret_msg
+
+
+def claim_next_job(queue_dir):
+    # Move the oldest pending job to running and return (path in running, job), or (None, None) if there are no jobs.
+    pending_dir = os.path.join(queue_dir, "pending")
+    for file_name in sorted(f for f in os.listdir(pending_dir) if f.endswith(".json")):
+        running_path = os.path.join(queue_dir, "running", file_name)
+        try:
+            os.replace(os.path.join(pending_dir, file_name), running_path)
+        except FileNotFoundError:
+            continue  # removed from pending since it was listed
+        try:
+            with open(running_path, encoding="utf-8") as job_file:
+                return running_path, json.load(job_file)
+        except ValueError as err:
+            finish_job(queue_dir, running_path, {}, "failed", "Job file is not valid json: " + str(err))
+    return None, None
+
+
+def finish_job(queue_dir, running_path, job, status, message="", product_stats=None):
+    # write the result to the job and move it from running to the done or failed folder
+    job["result"] = {"status": status, "message": message, "finished": datetime.now().isoformat(timespec="seconds"),
+                     "products": product_stats or []}
+    with open(running_path, "w", encoding="utf-8") as job_file:
+        json.dump(job, job_file, indent=2)
+    os.replace(running_path, os.path.join(queue_dir, "done" if status == "done" else "failed",
+                                          os.path.basename(running_path)))
+
+
+def lock_queue(queue_dir):
+    # Take the daemon lock of a queue folder (queue_dir). Returns the open lock file, to keep open while serving, or
+    # None if another daemon holds the lock. The operating system releases the lock when the process ends.
+    lock_file = open(os.path.join(queue_dir, LOCK_FILE), "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt is not None:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        lock_file = None
+    return lock_file
+
+
+def run_job(service, job):
+    # Run a job with an etl_service.etlService. Returns (status, message, product timings).
+    ret_msg = check_job(job)
+    if ret_msg:
+        return "failed", ret_msg, []
+    prod_ids = [int(pid) for pid in job.get("prodid") or []]
+    plan_only = bool(job.get("plan_only"))
+    plan_notes = {}
+    if prod_ids:
+        ret_msg = service.check_product_ids(prod_ids, job.get("insert"))
+        if not ret_msg and job.get("insert") and not plan_only:
+            ret_msg = service.insert_product(prod_ids)
+        if ret_msg:
+            return "failed", ret_msg, []
+    else:
+        change_set = service.discover_changes(date.fromisoformat(job["start"]), date.fromisoformat(job["end"]))
+        prod_ids = [entry["pid"] for entry in change_set]
+        plan_notes = {entry["pid"]: planner.describe_change(entry) for entry in change_set}
+    product_stats = service.run_products(prod_ids, plan_notes, plan_only)
+    status = "done" if all(stat["status"] == "done" for stat in product_stats) else "failed"
+    return status, "", product_stats
+
+
+def serve(service, queue_dir, poll_interval=POLL_INTERVAL):
+    # Run jobs from the queue with an etl_service.etlService until interrupted (Ctrl+C). The service keeps its
+    # connections and caches warm between jobs. Returns right away if another daemon is serving the queue.
+    setup_queue(queue_dir)
+    lock_file = lock_queue(queue_dir)
+    if lock_file is None:
+        log.error("Another daemon is already serving " + queue_dir + ". Only one daemon can run for a queue.")
+        return
+    log.info("Waiting for jobs in " + os.path.join(queue_dir, "pending"))
+    try:
+        while True:
+            running_path, job = claim_next_job(queue_dir)
+            if running_path is None:
+                time.sleep(poll_interval)
+                continue
+            log.info("Starting job " + os.path.basename(running_path) + ": " + json.dumps(job))
+            try:
+                status, message, product_stats = run_job(service, job)
+            except Exception as err:  # keep serving the next jobs
+                log.exception("Job " + os.path.basename(running_path) + " failed: " + str(err))
+                status, message, product_stats = "failed", str(err), []
+            finish_job(queue_dir, running_path, job, status, message, product_stats)
+            log.info("Finished job " + os.path.basename(running_path) + ": " + status +
+                     (" - " + message if message else ""))
+    except KeyboardInterrupt:
+        log.info("Job queue daemon stopped.")
+    finally:
+        lock_file.close()
+
+
+def setup_queue(queue_dir):
+    # create the queue folders if they do not exist
+    for folder in JOB_FOLDERS:
+        os.makedirs(os.path.join(queue_dir, folder), exist_ok=True)
+
+
+def submit_job(queue_dir, job):
+    # add a job to the queue and return its path. File names sort in the order jobs were submitted.
+    setup_queue(queue_dir)
+    file_name = f"{time.time_ns():020d}" + "-" + uuid.uuid4().hex[:8] + ".json"
+    tmp_path = os.path.join(queue_dir, file_name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as job_file:
+        json.dump(job, job_file, indent=2)
+    job_path = os.path.join(queue_dir, "pending", file_name)
+    os.replace(tmp_path, job_path)  # the daemon never sees a partly written job
+    return job_path
@@ -0,0 +1,31 @@
+# lazy modules - heavy third party modules (pandas, numpy, sqlalchemy, pyarrow...) are only imported the first time
+# one of their attributes is used, so runs with nothing to do (ex. a scheduled date range with no changed products)
+# start without paying for them.
+import importlib
+import importlib.util
+
+
+# noinspection SpellCheckingInspection
+class lazyModule(object):
+    def __init__(self, module_name):
+        # stands in for module_name until the first attribute is used, then forwards to the imported module
+        self.module_name = module_name
+        self.module = None
+
+    def __getattr__(self, name):
+        # only called for names that are not set in __init__ (ex. pd.DataFrame)
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        return getattr(self.module, name)
+
+    def __repr__(self):
+        return "<lazy module " + self.module_name + (" (imported)>" if self.module is not None else ">")
+
+
+def lazy_import(module_name):
+    # Return module_name (ex. "pandas" or "pyarrow.csv") to be imported when first used. Raises ImportError right away
+    # if its package is not installed, so optional imports keep working: try: x = lazy_import("x") except ImportError:
+    # x = None. Only the top level package is checked, without importing it.
+    if importlib.util.find_spec(module_name.split(".")[0]) is None:
+        raise ImportError("No module named '" + module_name + "'")
+    return lazyModule(module_name)
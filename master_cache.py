@@ -0,0 +1,54 @@
+# master cache - what the siblings of a merged product need from their master product (indicators, geographic levels
+# and "Date" dimension values), read from the database once for the whole merged product instead of once per sibling.
+# Siblings loading at the same time add their geographic levels and reference dates through the cache, one at a time,
+# so two siblings never insert the same row.
+import dfhandler as dfh  # for altering pandas data frames
+import indexes as idx  # lookup indexes for each product
+import lazy_modules as lm  # for importing pandas when first used
+import logging
+import threading
+
+pd = lm.lazy_import("pandas")
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+
+# noinspection SpellCheckingInspection
+class masterCache(object):
+    def __init__(self, db, master_pid_str):
+        # read the master product (master_pid_str) state after the master has loaded
+        self.master_pid_str = master_pid_str
+        self.lock = threading.Lock()
+        log.info("Retrieving Indicator information from master product " + master_pid_str + ".")
+        df_ind = db.get_indicators(master_pid_str).loc[:, ["IndicatorId", "IndicatorCode", "UOM_EN", "UOM_FR"]]
+        self.ind_index = idx.indicatorIndex(df_ind)  # IndicatorCode --> IndicatorId lookup for every sibling
+        self.geo_levels = db.get_geo_levels(master_pid_str)
+        self.date_dimension_id = db.get_date_dimension_id_for_product(master_pid_str)
+        self.ref_dates = db.get_date_dimension_values(master_pid_str)
+
+    def add_geo_levels(self, db, geo_df):
+        # Insert the geographic levels of a sibling (geo_df, distinct IndicatorId/GeographicLevelId from its chunks)
+        # that the master and the siblings before it do not have yet. Returns the number of rows inserted.
+        with self.lock:
+            df_gli = dfh.build_geographic_level_for_indicator_df(geo_df, self.geo_levels, True)
+            if df_gli.shape[0] > 0:
+                db.insert_dataframe_rows(df_gli, "GeographicLevelForIndicator", "gis")
+                self.geo_levels = pd.concat([self.geo_levels, df_gli.rename(
+                    columns={"IndicatorId": "IndicatorIdExist", "GeographicLevelId": "GeographicLevelIdExist"})],
+                    ignore_index=True)
+        return df_gli.shape[0]
+
+    def add_ref_dates(self, db, file_ref_dates_df):
+        # Insert the reference dates of a sibling (file_ref_dates_df, distinct REF_DATE/RefYear from its chunks) that
+        # are not in the master "Date" dimension yet. Returns the number of rows inserted.
+        with self.lock, db.id_lock:
+            next_dim_val_id = db.get_last_table_id("DimensionValueId", "DimensionValues", "gis") + 1  # next ID
+            next_dim_val_display_order = db.get_last_date_dimension_display_order(self.date_dimension_id) + 1  # ord
+            df_dv = dfh.build_date_dimension_values_df(file_ref_dates_df, self.ref_dates, self.date_dimension_id,
+                                                       next_dim_val_id, next_dim_val_display_order)
+            if df_dv.shape[0] > 0:
+                db.insert_dataframe_rows(df_dv, "DimensionValues", "gis")
+                self.ref_dates = pd.concat([self.ref_dates, df_dv], ignore_index=True)
+        return df_dv.shape[0]
@@ -0,0 +1,132 @@
+# Memory governor class - adjusts the csv chunk size between chunks to stay within a memory budget
+import gc  # for garbage collection
+import helpers as h  # helper functions
+import logging
+import threading
+import time
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+DEFAULT_CHUNK_SIZE = 20000  # rows per chunk when there is no memory budget
+MIN_CHUNK_SIZE = 2000
+MAX_CHUNK_SIZE = 500000
+GC_INTERVAL = 25  # collect the youngest generations every n chunks while automatic collection is paused
+
+# garbage collection is paused for the whole process, so governors running at the same time (one per product) share
+# the pause: the first to start pauses it and the last to stop restores it
+gc_pause_lock = threading.Lock()
+gc_pause_count = 0
+gc_was_enabled = True
+
+
+def resume_gc_in_worker():
+    # Worker processes forked while a governor has paused garbage collection (see memoryGovernor.start) inherit the
+    # pause, but no governor in the worker would ever restore it. Call when a worker starts to collect normally again.
+    global gc_pause_count
+    with gc_pause_lock:
+        if gc_pause_count > 0:
+            gc_pause_count = 0
+            gc.unfreeze()
+            if gc_was_enabled:
+                gc.enable()
+
+
+# noinspection SpellCheckingInspection
+class memoryGovernor(object):
+    def __init__(self, memory_budget_mb, chunk_size=DEFAULT_CHUNK_SIZE):
+        # memory_budget_mb is the resident memory (MB) the process should stay under, False/None for no budget.
+        # chunk_size is the number of rows to start with.
+        self.budget = memory_budget_mb * 1048576 if memory_budget_mb else None
+        self.chunk_size = chunk_size
+        self.base_rss = None  # resident memory before the first chunk
+        self.chunk_count = 0
+        self.last_throughput = None  # rows per second before the last increase, checked on the next chunk only
+        self.size_cap = MAX_CHUNK_SIZE  # lowered when a larger size was too slow or too big
+        self.last_time = None
+
+        if self.budget and h.get_process_rss() is None:
+            log.warning("Memory use cannot be measured on this system (install psutil). The chunk size will stay at " +
+                        f"{self.chunk_size:,}" + " rows.")
+            self.budget = None
+
+    def get_chunk_size(self):
+        # return the number of rows to read for the next chunk
+        return self.chunk_size
+
+    def start(self):
+        # Call before the chunk loop. Long lived objects (code sets, indicators, geography ids) are moved out of the
+        # collector's reach and automatic collection is paused so it does not run in the middle of a chunk.
+        global gc_pause_count, gc_was_enabled
+        with gc_pause_lock:
+            if gc_pause_count == 0:
+                gc_was_enabled = gc.isenabled()
+                gc.collect()
+                gc.freeze()
+                gc.disable()
+            gc_pause_count += 1
+        self.base_rss = h.get_process_rss()
+        self.last_time = time.perf_counter()
+
+    def stop(self):
+        # Call after the chunk loop (also on error) to restore normal garbage collection.
+        global gc_pause_count
+        with gc_pause_lock:
+            gc_pause_count -= 1
+            if gc_pause_count == 0:
+                gc.unfreeze()
+                if gc_was_enabled:
+                    gc.enable()
+                gc.collect()
+
+    def update(self, chunk_rows):
+        # Call after each chunk has been processed with the number of rows in the chunk (chunk_rows). Samples memory
+        # and throughput and adjusts the size of the next chunk if there is a budget.
+        now = time.perf_counter()
+        elapsed = max(now - self.last_time, 1e-6)
+        self.last_time = now
+        self.chunk_count += 1
+        throughput = chunk_rows / elapsed
+
+        if self.chunk_count % GC_INTERVAL == 0:
+            gc.collect(1)  # young objects only, the frozen ones are skipped
+
+        if self.budget and chunk_rows > 0:
+            self.adjust_chunk_size(chunk_rows, throughput)
+        return
+
+    def adjust_chunk_size(self, chunk_rows, throughput):
+        # Shrink the chunk size when memory is close to the budget, grow it while there is room and larger chunks are
+        # not slower. Growth is limited by projecting the memory each row added above the starting point onto the
+        # larger chunk. Memory includes the transform worker processes (--workers), which hold chunks too.
+        rss = h.get_process_rss(True)
+        if rss > self.budget * 0.9:
+            gc.collect()  # full collection only when memory is actually tight
+            rss = h.get_process_rss(True)
+        row_bytes = max(rss - self.base_rss, 0) / chunk_rows
+        grow_size = min(self.size_cap, int(self.chunk_size * 1.5))
+        new_size = self.chunk_size
+        reason = ""
+        prev_throughput = self.last_throughput
+        self.last_throughput = None
+
+        if rss > self.budget * 0.9:
+            new_size = max(MIN_CHUNK_SIZE, self.chunk_size // 2)
+            self.size_cap = new_size
+            reason = "memory above 90% of budget"
+        elif prev_throughput and throughput < prev_throughput * 0.9:
+            new_size = max(MIN_CHUNK_SIZE, int(self.chunk_size / 1.5))
+            self.size_cap = new_size
+            reason = "throughput dropped after the last increase"
+        elif grow_size > self.chunk_size and rss + row_bytes * (grow_size - self.chunk_size) < self.budget * 0.7:
+            new_size = grow_size
+            self.last_throughput = throughput  # compare the next chunk against the size that was just left
+            reason = "memory below 70% of budget"
+
+        if new_size != self.chunk_size:
+            log.info("Chunk size " + f"{self.chunk_size:,}" + " -> " + f"{new_size:,}" + " rows: " + reason + " (RSS " +
+                     f"{rss / 1048576:,.0f}" + " MB of " + f"{self.budget / 1048576:,.0f}" + " MB, " +
+                     f"{throughput:,.0f}" + " rows/s)")
+            self.chunk_size = new_size
+        return
@@ -0,0 +1,199 @@
+# metrics - live counters, gauges and latency histograms for long running loads, in the Prometheus text format.
+# Values are always kept in memory (cheap). They can be served on a local http endpoint (start_http_server) and/or
+# written to a node exporter textfile (start_textfile_writer), so throughput and ETA can be watched without the logs.
+import bisect
+import http.server
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900]  # seconds
+TEXTFILE_INTERVAL = 15  # seconds between textfile writes
+
+# name --> (type, help) for every metric, in the order they are written
+METRIC_DEFS = {
+    "etl_rows_parsed_total": ("counter", "Rows read from product data files."),
+    "etl_rows_inserted_total": ("counter", "Rows inserted to the database by table."),
+    "etl_rows_skipped_total": ("counter", "Rows from product data files not inserted to a table, by reason."),
+    "etl_chunk_seconds": ("histogram", "Time to read, transform or write a chunk of product data, by stage."),
+    "etl_db_call_seconds": ("histogram", "Database call latency by operation and table."),
+    "etl_db_errors_total": ("counter", "Failed database calls by operation and table."),
+    "etl_wds_request_seconds": ("histogram", "WDS web service request latency by operation."),
+    "etl_wds_errors_total": ("counter", "WDS requests that failed or did not return SUCCESS, by operation."),
+    "etl_product_in_progress": ("gauge", "1 while a product is loading."),
+    "etl_product_rows_expected": ("gauge", "Rows expected to load for the product (cube metadata estimate)."),
+    "etl_product_start_time_seconds": ("gauge", "Unix time the product load started."),
+    "etl_product_eta_seconds": ("gauge", "Estimated seconds left for the product load, from the rows loaded so far."),
+    "etl_products_total": ("counter", "Products finished by status."),
+    "etl_product_seconds": ("histogram", "Wall time of each product load.")
+}
+
+
+# noinspection SpellCheckingInspection
+class metricsRegistry(object):
+    def __init__(self):
+        # values by metric name, then by label tuple ((name, value), ...). Counters and gauges hold a number,
+        # histograms hold [bucket counts, sum, count].
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRIC_DEFS}
+
+    def inc(self, name, amount=1, **labels):
+        # add amount to a counter (or gauge)
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + amount
+
+    def get(self, name, **labels):
+        # return the value of a counter or gauge, 0 if it was never set
+        with self.lock:
+            return self.values[name].get(tuple(sorted(labels.items())), 0)
+
+    def observe(self, name, seconds, **labels):
+        # add an observation (seconds) to a histogram
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            hist = self.values[name].setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            pos = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            if pos < len(LATENCY_BUCKETS):
+                hist[0][pos] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+    def render(self):
+        # return every metric in the Prometheus text exposition format
+        lines = []
+        with self.lock:
+            for name, (metric_type, help_text) in METRIC_DEFS.items():
+                if not self.values[name]:
+                    continue
+                lines.append("# HELP " + name + " " + help_text)
+                lines.append("# TYPE " + name + " " + metric_type)
+                for key, value in self.values[name].items():
+                    if metric_type == "histogram":
+                        cumulative = 0
+                        for bound, count in zip(LATENCY_BUCKETS, value[0]):
+                            cumulative += count
+                            lines.append(name + "_bucket" + format_labels(key + (("le", str(bound)),)) + " " +
+                                         str(cumulative))
+                        lines.append(name + "_bucket" + format_labels(key + (("le", "+Inf"),)) + " " + str(value[2]))
+                        lines.append(name + "_sum" + format_labels(key) + " " + repr(float(value[1])))
+                        lines.append(name + "_count" + format_labels(key) + " " + str(value[2]))
+                    else:
+                        lines.append(name + format_labels(key) + " " + repr(float(value)))
+        return "\n".join(lines) + "\n"
+
+    def set(self, name, value, **labels):
+        # set a gauge
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+
+# noinspection SpellCheckingInspection
+class metricsHandler(http.server.BaseHTTPRequestHandler):
+    # serves the registry on any path (usually /metrics)
+    def do_GET(self):
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, msg_format, *args):
+        return  # no console line for each scrape
+
+
+registry = metricsRegistry()  # shared by every module in the process
+exporters = {"server": None, "textfile": None, "stop": threading.Event()}
+
+
+def finish_product(pid, status, seconds):
+    # record the end of a product load (status is the scheduler status, ex. "done" or "failed")
+    product = str(pid)
+    registry.set("etl_product_in_progress", 0, product=product)
+    registry.set("etl_product_eta_seconds", 0, product=product)
+    registry.inc("etl_products_total", status=status)
+    registry.observe("etl_product_seconds", seconds)
+
+
+def format_labels(key):
+    # format a label tuple as {name="value",...}, escaping the values
+    if not key:
+        return ""
+    pairs = [label + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\""
+             for label, value in key]
+    return "{" + ",".join(pairs) + "}"
+
+
+def start_http_server(port):
+    # serve the metrics on http://localhost:port/metrics from a background thread
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), metricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    exporters["server"] = server
+    log.info("Serving metrics on http://127.0.0.1:" + str(port) + "/metrics")
+
+
+def start_product(pid, expected_rows):
+    # record the start of a product load with the number of rows expected in its data file
+    product = str(pid)
+    registry.set("etl_product_in_progress", 1, product=product)
+    registry.set("etl_product_rows_expected", expected_rows, product=product)
+    registry.set("etl_product_start_time_seconds", time.time(), product=product)
+
+
+def start_textfile_writer(file_path):
+    # write the metrics to file_path (for the node exporter textfile collector) every TEXTFILE_INTERVAL seconds
+    def write_until_stopped():
+        while not exporters["stop"].wait(TEXTFILE_INTERVAL):
+            write_textfile(file_path)
+
+    exporters["textfile"] = file_path
+    write_textfile(file_path)
+    threading.Thread(target=write_until_stopped, name="metrics-textfile", daemon=True).start()
+    log.info("Writing metrics to " + file_path + " every " + str(TEXTFILE_INTERVAL) + "s")
+
+
+def stop():
+    # write the final values to the textfile and stop the exporters
+    exporters["stop"].set()
+    if exporters["textfile"]:
+        write_textfile(exporters["textfile"])
+    if exporters["server"]:
+        exporters["server"].shutdown()
+
+
+@contextmanager
+def timed(name, **labels):
+    # observe the time spent in a with block in a histogram (also observed if the block raises)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start_time, **labels)
+
+
+def update_product_eta(pid, rows_done):
+    # estimate the seconds left for a product load from the rows loaded so far (rows_done, after the --minrefyear
+    # filter, like the expected rows) and the time since the product started
+    product = str(pid)
+    expected = registry.get("etl_product_rows_expected", product=product)
+    elapsed = time.time() - registry.get("etl_product_start_time_seconds", product=product)
+    if rows_done > 0 and elapsed > 0:
+        registry.set("etl_product_eta_seconds", max(expected - rows_done, 0) / (rows_done / elapsed), product=product)
+
+
+def write_textfile(file_path):
+    # write the metrics to file_path, replacing it in one step so the collector never reads a partial file
+    tmp_path = file_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(registry.render())
+        os.replace(tmp_path, file_path)
+    except OSError as err:
+        log.warning("Could not write metrics to " + file_path + ": " + str(err))
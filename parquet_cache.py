@@ -0,0 +1,91 @@
+# parquet cache - keeps the formatted chunk columns of a product release so a rerun can skip the download and csv parse
+# Layout: <cache_dir>/product=<pid>/release=<release time>/part-000000.parquet ... and _manifest.json when complete.
+import csv_handler  # for regrouping arrow batches into chunks
+import json
+import lazy_modules as lm  # for importing pyarrow when first used
+import logging
+import os
+import shutil
+
+try:
+    pa = lm.lazy_import("pyarrow")
+    pa_ds = lm.lazy_import("pyarrow.dataset")
+    pq = lm.lazy_import("pyarrow.parquet")
+except ImportError:  # pyarrow is only needed when the cache is used
+    pa = None
+    pa_ds = None
+    pq = None
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+# columns from dfh.setup_chunk_columns that are used to build the database tables (other columns are not cached)
+CACHE_COLUMNS = ["REF_DATE", "DGUID", "STATUS", "VALUE", "IndicatorCode", "RefYear", "ReferencePeriod",
+                 "GeographicLevelId"]
+MANIFEST_FILE = "_manifest.json"  # written last, files starting with _ are skipped when the parts are read
+
+
+def finish_cache(cache_path, functional_pid_str, row_count):
+    # Mark the cache for a product release (cache_path) as complete. functional_pid_str is the product id the rows
+    # were formatted for. Older releases of the product are removed.
+    manifest = {"functional_pid": functional_pid_str, "rows": row_count, "columns": CACHE_COLUMNS}
+    with open(os.path.join(cache_path, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    product_path = os.path.dirname(cache_path)
+    for release_dir in os.listdir(product_path):
+        old_path = os.path.join(product_path, release_dir)
+        if old_path != cache_path and os.path.isdir(old_path):
+            shutil.rmtree(old_path, ignore_errors=True)
+    log.info("Cached " + f"{row_count:,}" + " rows to " + cache_path)
+
+
+def get_cache_path(cache_dir, prod_id, release_date):
+    # return the folder for a product (prod_id) and release (release_date, ex. 2021-01-21T08:30) in cache_dir
+    release_str = str(release_date).replace(":", "").replace(" ", "T")  # no colons in windows paths
+    return os.path.join(cache_dir, "product=" + str(prod_id), "release=" + release_str)
+
+
+def is_cache_complete(cache_path, functional_pid_str):
+    # return True if the product release in cache_path was fully cached for the same functional product id
+    manifest = read_manifest(cache_path)
+    return manifest.get("functional_pid") == functional_pid_str and manifest.get("columns") == CACHE_COLUMNS
+
+
+def read_manifest(cache_path):
+    # return the manifest of a complete cache (cache_path) as a dictionary, empty if there is none
+    retval = {}
+    manifest_path = os.path.join(cache_path, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path) as manifest_file:
+                retval = json.load(manifest_file)
+        except (OSError, ValueError) as err:
+            log.warning("Could not read cache manifest " + manifest_path + ": " + str(err))
+    return retval
+
+
+def read_cache_chunks(cache_path, chunk_size, min_ref_year, prod_id_str, mixed_geo_justice_pids):
+    # Yield dataframes of chunk_size rows (a number or a function) from a complete cache (cache_path). The
+    # min_ref_year filter (skipped for mixed geo justice products) is pushed down to the parquet reader, so row
+    # groups with only older years are not read. The rows match dfh.setup_chunk_columns with the filter applied.
+    dataset = pa_ds.dataset(cache_path, format="parquet")
+    row_filter = None
+    if min_ref_year and (int(prod_id_str) not in mixed_geo_justice_pids):
+        row_filter = pa_ds.field("RefYear") >= str(min_ref_year)  # RefYear is always 4 digits
+    batches = dataset.to_batches(columns=CACHE_COLUMNS, filter=row_filter, use_threads=True)
+    yield from csv_handler.rebatch_to_chunks(batches, chunk_size)
+
+
+def start_cache(cache_path):
+    # create an empty folder for a product release (cache_path), removing any incomplete earlier attempt
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.makedirs(cache_path)
+
+
+def write_cache_part(cache_path, part_num, chunk_df):
+    # write the cached columns of a formatted chunk (chunk_df) as part number part_num of the release in cache_path
+    table = pa.Table.from_pandas(chunk_df.loc[:, CACHE_COLUMNS], preserve_index=False)
+    pq.write_table(table, os.path.join(cache_path, "part-" + str(part_num).zfill(6) + ".parquet"),
+                   compression="zstd")
@@ -0,0 +1,362 @@
+# chunk pipeline - reads the product data file, transforms each chunk and writes the results to the database.
+# With workers > 0 the stages run concurrently: a reader thread feeds a pool of transform worker processes, and the
+# main thread writes finished chunks to the database in the order they were read (IndicatorValueIds depend on it).
+# With sharded reads the reader only finds the byte range of each chunk (csv_handler.csvShard) and the workers parse
+# them as well, so parsing is spread across the worker processes too.
+import accumulators as acc  # for distinct values across chunks
+import concurrent.futures as cf
+import csv_handler  # for sharded reads
+import dfhandler as dfh  # for altering pandas data frames
+import helpers as h  # for lazy log messages and worker logging
+import indexes as idx  # for interning repeated strings
+import logging
+import memory_governor as mg  # for garbage collection in the workers
+import metrics  # for live throughput and latency
+import parquet_cache  # for caching formatted chunks
+import queue
+import threading
+import time
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+PROGRESS_INTERVAL = 10  # seconds between progress messages while a product loads
+
+worker_context = {}  # chunk context for the product, set once in each worker process by init_worker
+
+
+def build_chunk_context(functional_pid_str, release_date, min_ref_year, mixed_geo_justice_pids, is_sibling, ind_index,
+                        geo_index, df_ind_null, from_cache=False, cache_path="", load_pid_str="",
+                        new_periods_only=False):
+    # build the dictionary of product information needed to transform a chunk (sent once to each worker process).
+    # from_cache is True when the chunks come from parquet_cache (already formatted), otherwise a non empty cache_path
+    # is where the formatted chunks are cached. load_pid_str is the product being loaded (for the metrics, defaults to
+    # functional_pid_str). With new_periods_only (append mode) ind_index only has the indicators of the new reference
+    # periods and rows for any other indicator are skipped.
+    ctx = {
+        "functional_pid_str": functional_pid_str,  # sibling tables are saved under the master product id
+        "load_pid_str": load_pid_str if load_pid_str else functional_pid_str,
+        "release_date": release_date,
+        "min_ref_year": min_ref_year,
+        "mixed_geo_justice_pids": mixed_geo_justice_pids,
+        "is_sibling": is_sibling,
+        "ind_index": ind_index,  # indexes.indicatorIndex
+        "geo_index": geo_index,  # indexes.geographyIndex
+        "df_ind_null": df_ind_null,  # codes from gis.IndicatorNullReason
+        "from_cache": from_cache,
+        "cache_path": cache_path,
+        "new_periods_only": new_periods_only,
+        "interner": idx.codeInterner()  # formatted strings kept for every chunk a worker transforms
+    }
+    return ctx
+
+
+def build_stage_stats():
+    # rows and busy seconds for each pipeline stage
+    return {stage: {"rows": 0, "seconds": 0.0} for stage in ["read", "transform", "write"]}
+
+
+def format_progress(pid_str, rows_done, seconds):
+    # progress message for a product (pid_str) that has loaded rows_done rows in seconds, with the ETA from the metrics
+    eta = metrics.registry.get("etl_product_eta_seconds", product=pid_str)
+    retval = "Product " + pid_str + ": loaded " + f"{rows_done:,}" + " rows (" + f"{rows_done / seconds:,.0f}" + \
+             " rows/s)"
+    if eta > 0:
+        retval += ", about " + f"{eta / 60:,.1f}" + " min left"
+    return retval
+
+
+def init_worker(ctx, log_queue=None):
+    # runs once when each worker process starts, keeps the product context for every chunk the worker transforms.
+    # log_queue (from helpers.get_worker_log_queue) sends what the worker logs to the log of the main process.
+    if log_queue is not None:
+        h.setup_worker_logger(log_queue, log.name)
+    mg.resume_gc_in_worker()  # forked workers inherit the paused collection of the main process
+    worker_context.clear()
+    worker_context.update(ctx)
+
+
+def log_stage_stats(stage_stats, workers):
+    # log the throughput of each pipeline stage. Transform time (and read time for sharded reads) is summed across
+    # workers.
+    for stage, stat in stage_stats.items():
+        rate = stat["rows"] / stat["seconds"] if stat["seconds"] > 0 else 0
+        worker_note = " (" + str(workers) + " workers)" if stage == "transform" and workers > 0 else ""
+        log.info("Pipeline " + stage + worker_note + ": " + f"{stat['rows']:,}" + " rows in " +
+                 f"{stat['seconds']:,.1f}" + "s busy (" + f"{rate:,.0f}" + " rows/s)")
+
+
+def run_chunk_pipeline(chunks, ctx, db, governor, workers, id_range=None):
+    # Load the product data to gis.IndicatorValues and gis.GeographyReferenceForIndicator. chunks are the dataframes
+    # from csv_handler.read_csv_chunks or parquet_cache.read_cache_chunks, or the shards from
+    # csv_handler.read_csv_shards (sized by governor.get_chunk_size). Results are written in chunk order, so the
+    # IndicatorValueIds and distinct values do not depend on which worker finished first. ctx is
+    # from build_chunk_context and governor is a memoryGovernor. workers is the number of transform processes (0
+    # transforms in this process). id_range is an idRange with the IndicatorValueIds reserved for the product (ids are
+    # reserved for each chunk without one). Returns a dictionary of totals and accumulators of
+    # the distinct reference dates, geographic levels and missing DGUIDs found in every chunk.
+    totals = {"file_rows": 0, "year_dropped_rows": 0, "period_dropped_rows": 0, "rows": 0, "iv_rows": 0, "gri_rows": 0,
+              "ref_dates": acc.uniqueAccumulator(["REF_DATE", "RefYear"]),  # for the "Date" dimension
+              "geo_levels": acc.uniqueAccumulator(["IndicatorId", "GeographicLevelId"]),
+              "missing_dguids": acc.uniqueAccumulator(["DGUID"])}
+    stage_stats = build_stage_stats()
+    progress = progressReporter(ctx["load_pid_str"])
+    id_range = id_range if id_range is not None else idRange(db)
+    try:
+        if workers > 0:
+            run_parallel(chunks, ctx, db, governor, workers, totals, stage_stats, progress, id_range)
+        else:
+            run_serial(chunks, ctx, db, governor, totals, stage_stats, progress, id_range)
+    finally:
+        id_range.release()
+    log_stage_stats(stage_stats, workers)
+    return totals
+
+
+def run_parallel(chunks, ctx, db, governor, workers, totals, stage_stats, progress, id_range):
+    # reader thread --> transform processes --> writer (this thread), through a bounded queue of pending chunks
+    pending = queue.Queue(maxsize=workers * 2)  # futures in read order, blocks the reader when the writer is behind
+    stop_reading = threading.Event()
+
+    log_queue = h.get_worker_log_queue(log.name)
+    with cf.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(ctx, log_queue)) as pool:
+        reader = threading.Thread(target=read_chunks_to_pool, args=(chunks, pool, pending, stop_reading, stage_stats,
+                                                                    ctx["load_pid_str"]), daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = pending.get()
+                if item is None:  # reader finished
+                    break
+                if isinstance(item, BaseException):  # reader failed
+                    raise item
+                result = item.result()
+                record_shard_read(result, stage_stats, ctx["load_pid_str"])
+                stage_stats["transform"]["rows"] += result["rows"]
+                stage_stats["transform"]["seconds"] += result["seconds"]
+                write_chunk_result(result, db, totals, stage_stats, ctx["load_pid_str"], id_range)
+                governor.update(result["rows"])
+                progress.update(totals["rows"])
+        finally:
+            stop_reading.set()
+            while not pending.empty():  # cancel anything still waiting if the writer stopped early
+                item = pending.get_nowait()
+                if isinstance(item, cf.Future):
+                    item.cancel()
+            reader.join()
+
+
+def run_serial(chunks, ctx, db, governor, totals, stage_stats, progress, id_range):
+    # read, transform and write each chunk in turn in this process
+    init_worker(ctx)
+    read_start = time.perf_counter()
+    for part_num, csv_chunk in enumerate(chunks):
+        if not isinstance(csv_chunk, csv_handler.csvShard):
+            record_read(csv_chunk.shape[0], time.perf_counter() - read_start, stage_stats, ctx["load_pid_str"])
+        result = transform_chunk(csv_chunk, part_num)
+        record_shard_read(result, stage_stats, ctx["load_pid_str"])
+        stage_stats["transform"]["rows"] += result["rows"]
+        stage_stats["transform"]["seconds"] += result["seconds"]
+        write_chunk_result(result, db, totals, stage_stats, ctx["load_pid_str"], id_range)
+        governor.update(result["rows"])
+        progress.update(totals["rows"])
+        read_start = time.perf_counter()
+
+
+def read_chunks_to_pool(chunks, pool, pending, stop_reading, stage_stats, pid_str):
+    # reader stage: submit each csv chunk to the worker pool and queue the future in read order
+    try:
+        read_start = time.perf_counter()
+        for part_num, csv_chunk in enumerate(chunks):
+            if not isinstance(csv_chunk, csv_handler.csvShard):  # shards are read by the workers
+                record_read(csv_chunk.shape[0], time.perf_counter() - read_start, stage_stats, pid_str)
+            if stop_reading.is_set():
+                break
+            put_until_stopped(pending, pool.submit(transform_chunk, csv_chunk, part_num), stop_reading)
+            read_start = time.perf_counter()
+    except Exception as err:
+        put_until_stopped(pending, err, stop_reading)
+    else:
+        put_until_stopped(pending, None, stop_reading)
+
+
+def record_chunk_metrics(result, iv_rows, gri_rows, write_seconds, pid_str):
+    # add the transform and write time of a chunk (result from transform_chunk) and the rows that were not inserted
+    # to each table to the metrics for the product (pid_str)
+    metrics.registry.observe("etl_chunk_seconds", result["seconds"], stage="transform")
+    metrics.registry.observe("etl_chunk_seconds", write_seconds, stage="write")
+    for table, table_rows in [("IndicatorValues", iv_rows), ("GeographyReferenceForIndicator", gri_rows)]:
+        if result["year_dropped_rows"] > 0:
+            metrics.registry.inc("etl_rows_skipped_total", result["year_dropped_rows"], product=pid_str, table=table,
+                                 reason="before_min_ref_year")
+        if result["period_dropped_rows"] > 0:
+            metrics.registry.inc("etl_rows_skipped_total", result["period_dropped_rows"], product=pid_str,
+                                 table=table, reason="reference_period_loaded")
+        if result["chunk_rows"] > table_rows:
+            metrics.registry.inc("etl_rows_skipped_total", result["chunk_rows"] - table_rows, product=pid_str,
+                                 table=table, reason="no_geography_reference")
+
+
+def record_read(rows, seconds, stage_stats, pid_str):
+    # add a chunk of rows that took seconds to read to the stage stats and the metrics for the product (pid_str)
+    stage_stats["read"]["rows"] += rows
+    stage_stats["read"]["seconds"] += seconds
+    metrics.registry.inc("etl_rows_parsed_total", rows, product=pid_str)
+    metrics.registry.observe("etl_chunk_seconds", seconds, stage="read")
+
+
+def record_shard_read(result, stage_stats, pid_str):
+    # record the read of a chunk that a worker parsed from a shard (result from transform_chunk)
+    if result["read_seconds"] is not None:
+        record_read(result["rows"], result["read_seconds"], stage_stats, pid_str)
+
+
+def put_until_stopped(pending, item, stop_reading):
+    # put item on the bounded queue, giving up if the writer has stopped
+    while not stop_reading.is_set():
+        try:
+            pending.put(item, timeout=0.5)
+            break
+        except queue.Full:
+            continue
+
+
+def transform_chunk(csv_chunk, part_num):
+    # Transform stage (runs in a worker process): build the IndicatorValues and GeographyReferenceForIndicator rows
+    # for chunk number part_num using the product context from init_worker. IndicatorValueIds start at 0 and are
+    # offset by the writer, which knows the next id in the database. A csv_handler.csvShard is parsed here first.
+    read_seconds = None  # read by the reader stage
+    if isinstance(csv_chunk, csv_handler.csvShard):
+        read_start = time.perf_counter()
+        csv_chunk = csv_chunk.read()
+        read_seconds = time.perf_counter() - read_start
+    start_time = time.perf_counter()
+    ctx = worker_context
+    raw_rows = csv_chunk.shape[0]  # before any rows are filtered out
+    pid_str = ctx["functional_pid_str"]
+
+    # build formatted cols - sibling tables will be saved under the master product id
+    if ctx["from_cache"]:
+        chunk_data = csv_chunk  # formatted (and filtered) when it was cached
+        year_dropped_rows = 0  # filtered by the parquet reader
+    elif ctx["cache_path"]:
+        # cache every year so a later run with a different --minrefyear can use it, then filter
+        chunk_data = dfh.setup_chunk_columns(csv_chunk, pid_str, ctx["release_date"], False,
+                                             ctx["mixed_geo_justice_pids"], ctx["interner"])
+        parquet_cache.write_cache_part(ctx["cache_path"], part_num, chunk_data)
+        dfh.filter_min_ref_year(chunk_data, ctx["min_ref_year"], pid_str, ctx["mixed_geo_justice_pids"])
+        year_dropped_rows = raw_rows - chunk_data.shape[0]
+    else:
+        chunk_data = dfh.setup_chunk_columns(csv_chunk, pid_str, ctx["release_date"], ctx["min_ref_year"],
+                                             ctx["mixed_geo_justice_pids"], ctx["interner"])
+        year_dropped_rows = raw_rows - chunk_data.shape[0]  # dropped before the other columns were built
+    chunk_data["IndicatorId"] = ctx["ind_index"].get_indicator_ids(chunk_data["IndicatorCode"])
+    period_dropped_rows = 0
+    if ctx["new_periods_only"]:
+        # append mode: rows for the reference periods already in the database stay as they are
+        loaded_rows = chunk_data[chunk_data["IndicatorId"].isna()].index
+        period_dropped_rows = len(loaded_rows)
+        chunk_data.drop(loaded_rows, inplace=True)
+
+    # keep unique reference dates for gis.DimensionValues
+    ref_date_chunk = chunk_data.loc[:, ["REF_DATE", "RefYear", "GeographicLevelId"]]
+    ref_dates = dfh.build_ref_date_dimensions(ref_date_chunk, ctx["min_ref_year"], pid_str,
+                                              ctx["mixed_geo_justice_pids"])
+
+    # keep track of the geographic level for each indicator
+    geo_levels = dfh.build_geographic_level_chunk_df(chunk_data, pid_str, ctx["mixed_geo_justice_pids"])
+
+    # drop rows that are not loaded for mixed geo justice products, then find the rows with a DGUID in
+    # gis.GeographyReference (used for both tables below) and keep any missing DGUIDs
+    dfh.drop_mixed_geo_justice_rows(chunk_data, pid_str, ctx["mixed_geo_justice_pids"], ctx["is_sibling"])
+    geo_found, missing_dguids = ctx["geo_index"].lookup(chunk_data["DGUID"])
+    chunk_data["HasGeographyReference"] = geo_found
+
+    df_ind_val = dfh.build_indicator_values_df(chunk_data, ctx["df_ind_null"], 0)
+    df_gri = dfh.build_geography_reference_for_indicator_df(chunk_data)
+
+    result = {"rows": raw_rows, "year_dropped_rows": year_dropped_rows, "period_dropped_rows": period_dropped_rows,
+              "chunk_rows": chunk_data.shape[0],
+              "ref_dates": ref_dates, "geo_levels": geo_levels, "missing_dguids": missing_dguids,
+              "df_ind_val": df_ind_val, "df_gri": df_gri, "seconds": time.perf_counter() - start_time,
+              "read_seconds": read_seconds}
+    return result
+
+
+def write_chunk_result(result, db, totals, stage_stats, pid_str, id_range):
+    # Writer stage: give the chunk its IndicatorValueIds from the product's id_range, insert it and add it to the
+    # totals and the metrics for the product (pid_str).
+    write_start = time.perf_counter()
+    df_ind_val = result["df_ind_val"]
+    df_gri = result["df_gri"]
+
+    # gis.IndicatorValues
+    next_ind_val_id = id_range.take(df_ind_val.shape[0])  # IDs
+    df_ind_val["IndicatorValueId"] += next_ind_val_id
+    iv_result = db.insert_dataframe_rows(df_ind_val, "IndicatorValues", "gis")
+
+    # gis.GeographyReferenceForIndicator
+    df_gri["IndicatorValueId"] += next_ind_val_id
+    gri_result = db.insert_dataframe_rows(df_gri, "GeographyReferenceForIndicator", "gis")
+
+    # update totals
+    totals["file_rows"] += result["rows"]
+    totals["year_dropped_rows"] += result["year_dropped_rows"]
+    totals["period_dropped_rows"] += result["period_dropped_rows"]
+    totals["rows"] += result["chunk_rows"]
+    totals["iv_rows"] = (totals["iv_rows"] + df_ind_val.shape[0]) if iv_result else totals["iv_rows"]
+    totals["gri_rows"] = (totals["gri_rows"] + df_gri.shape[0]) if gri_result else totals["gri_rows"]
+    totals["ref_dates"].add(result["ref_dates"])
+    totals["geo_levels"].add(result["geo_levels"])
+    totals["missing_dguids"].add_values(result["missing_dguids"])
+    stage_stats["write"]["rows"] += result["rows"]
+    stage_stats["write"]["seconds"] += time.perf_counter() - write_start
+    record_chunk_metrics(result, df_ind_val.shape[0], df_gri.shape[0], time.perf_counter() - write_start, pid_str)
+    metrics.update_product_eta(pid_str, totals["rows"])
+
+
+# noinspection SpellCheckingInspection
+class idRange(object):
+    def __init__(self, db, count=0):
+        # IndicatorValueIds for a product, reserved up front (count, ex. the estimated rows of the product) so
+        # products and siblings loading at the same time write their chunks without waiting on each other for ids.
+        # A chunk that does not fit in what is left reserves its own ids.
+        self.db = db
+        self.next_id = db.reserve_ids("IndicatorValueId", "IndicatorValues", "gis", count) if count > 0 else 0
+        self.end_id = self.next_id + count
+
+    def release(self):
+        # give back the ids that were not used once the product is loaded
+        if self.end_id > self.next_id:
+            self.db.release_ids("IndicatorValueId", "IndicatorValues", "gis", self.next_id, self.end_id)
+            self.end_id = self.next_id
+
+    def take(self, count):
+        # return the first of count ids for a chunk, in the order chunks are written
+        if self.next_id + count > self.end_id:
+            self.release()
+            self.next_id = self.db.reserve_ids("IndicatorValueId", "IndicatorValues", "gis", count)
+            self.end_id = self.next_id + count
+        retval = self.next_id
+        self.next_id += count
+        return retval
+
+
+# noinspection SpellCheckingInspection
+class progressReporter(object):
+    def __init__(self, pid_str, interval=PROGRESS_INTERVAL):
+        # Logs the rows loaded for a product (pid_str) at most once every interval seconds. Between messages update
+        # only compares times, and the message is built by the log listener (helpers.lazyMessage), so the chunk loop
+        # does no formatting or log I/O.
+        self.pid_str = pid_str
+        self.interval = interval
+        self.start_time = time.perf_counter()
+        self.next_time = self.start_time + interval
+
+    def update(self, rows_done):
+        # called after each chunk is written with the rows loaded so far
+        now = time.perf_counter()
+        if now >= self.next_time:
+            self.next_time = now + self.interval
+            log.info(h.lazyMessage(format_progress, self.pid_str, rows_done, now - self.start_time))
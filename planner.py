@@ -0,0 +1,94 @@
+# change-set planner - builds the products to update for a date range run (--start/--end). A product released on
+# several days in the range is updated once, and a changed master or sibling brings in its whole merged product
+# (products_to_merge.json), master first. In append mode (--append-periods) it also decides whether a product only
+# gained new reference periods, so only those periods need to be loaded.
+import helpers as h  # for date ranges
+import json_handler as jh  # for merged products
+import lazy_modules as lm  # for importing pandas when first used
+import logging
+
+pd = lm.lazy_import("pandas")
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+
+def build_change_set(changed_by_date, merged_prod_dict):
+    # Build the change set from the products changed on each day (changed_by_date from find_changed_products).
+    # Returns a list of dictionaries in run order, one for each product: pid, release_dates (the days it changed, empty
+    # if it is only in the set because its merged product changed) and master_pid (merged products only).
+    change_set = {}  # pid --> entry, in the order products were first found
+    for date_str, prod_list in changed_by_date:
+        for pid in prod_list:
+            master_pid = int(jh.get_master_prod_id(pid, merged_prod_dict) or pid)
+            group = [master_pid]
+            if jh.is_master_in_merged_product(master_pid, merged_prod_dict):
+                group += jh.get_sibling_prod_ids(master_pid, merged_prod_dict)
+            for group_pid in group:
+                change_set.setdefault(group_pid, {"pid": group_pid, "release_dates": [],
+                                                  "master_pid": master_pid if len(group) > 1 else None})
+            if date_str not in change_set[int(pid)]["release_dates"]:
+                change_set[int(pid)]["release_dates"].append(date_str)
+    return list(change_set.values())
+
+
+def check_period_append(new_ref_dates, existing_periods_df, indicators_per_period):
+    # Check whether only the new reference periods of a product (new_ref_dates from find_new_reference_dates) can be
+    # loaded: the product was loaded before, the new periods all come after the periods in gis.Indicator
+    # (existing_periods_df from sqlDb.get_indicator_reference_periods) and the latest loaded period has as many
+    # indicators as the member combinations of the cube (indicators_per_period), so the dimensions did not change.
+    # Returns status message if the whole product must be reloaded, otherwise "".
+    ret_msg = ""
+    if existing_periods_df.shape[0] == 0:
+        ret_msg = "no reference periods are loaded yet."
+    elif len(new_ref_dates) == 0:
+        ret_msg = "no new reference periods (the release may revise periods already loaded)."
+    else:
+        loaded_periods = pd.to_datetime(existing_periods_df["ReferencePeriod"]).dt.normalize()
+        latest_period = loaded_periods.max()
+        latest_indicators = int(existing_periods_df.loc[loaded_periods == latest_period, "Indicators"].sum())
+        if new_ref_dates.min() <= latest_period:
+            ret_msg = "new reference period " + new_ref_dates.min().strftime("%Y-%m-%d") + " is not after the " \
+                      "latest loaded period " + latest_period.strftime("%Y-%m-%d") + "."
+        elif latest_indicators != indicators_per_period:
+            ret_msg = "the dimension members changed (" + f"{indicators_per_period:,}" + " indicators per period, " + \
+                      f"{latest_indicators:,}" + " loaded for " + latest_period.strftime("%Y-%m-%d") + ")."
+    return ret_msg
+
+
+def describe_change(entry):
+    # return a short description of why a product (entry from build_change_set) is in the change set
+    if entry["release_dates"]:
+        retval = "released " + ", ".join(entry["release_dates"])
+    else:
+        retval = "merged product " + str(entry["master_pid"]) + " changed"
+    if entry["master_pid"] is not None and entry["release_dates"]:
+        retval += " (merged product " + str(entry["master_pid"]) + ")"
+    return retval
+
+
+def find_new_reference_dates(ref_dates, existing_periods_df, min_ref_year, prod_id, mixed_geo_justice_pids):
+    # Return the reference dates of a product (ref_dates from dfhandler.build_reference_dates, up to the cube end
+    # date) that are not in gis.Indicator yet (existing_periods_df from sqlDb.get_indicator_reference_periods). Dates
+    # before min_ref_year are left out like they are for gis.Indicator (except for mixed geo justice products).
+    if min_ref_year and int(prod_id) not in mixed_geo_justice_pids:
+        ref_dates = ref_dates[ref_dates.year >= min_ref_year]
+    loaded_periods = pd.to_datetime(existing_periods_df["ReferencePeriod"]).dt.normalize()
+    return ref_dates[~ref_dates.isin(loaded_periods)]
+
+
+def find_changed_products(wds, db, start_date, end_date, merged_prod_dict):
+    # Return the products changed on each day from start_date to end_date (WDS getChangedCubeList) that are in the
+    # database, as a list of (date string, product ids). Siblings of merged products are matched by their master
+    # product id, which is the id saved in the database.
+    changed_by_date = []
+    for dt in h.daterange(start_date, end_date):
+        dt_str = dt.strftime("%Y-%m-%d")
+        changed_cubes = wds.get_changed_cube_list(dt_str) or []  # False if the list could not be retrieved
+        lookup_pids = [int(jh.get_master_prod_id(pid, merged_prod_dict) or pid) for pid in changed_cubes]
+        existing_pids = set(db.get_matching_product_list(list(dict.fromkeys(lookup_pids))))
+        prod_list = [pid for pid, lookup_pid in zip(changed_cubes, lookup_pids) if lookup_pid in existing_pids]
+        log.info(str(len(prod_list)) + " table(s) found for " + dt_str + ": " + str(prod_list))
+        changed_by_date.append((dt_str, prod_list))
+    return changed_by_date
@@ -1,10 +1,13 @@
 # Database class
+import dbdialects  # for the connection and schema of each database backend
+import lazy_modules as lm  # for importing pandas and sqlalchemy when first used
 import logging
-import pandas as pd
-import pyodbc
-import urllib.parse
-from sqlalchemy import create_engine
-from sqlalchemy import exc
+import metrics  # for database call latency
+import schema_validator as sv  # for checking data frames before inserts
+import threading
+
+exc = lm.lazy_import("sqlalchemy.exc")
+pd = lm.lazy_import("pandas")
 
 # set up logger if available
 log = logging.getLogger("etl_log")
@@ -13,31 +16,71 @@ log.addHandler(logging.NullHandler())
 
 # noinspection SpellCheckingInspection
 class sqlDb(object):
-    def __init__(self, driver, server, database):
-        # set up db configuration and open a connection
+    # Held while reading the next id of a table (get_last_table_id) and inserting the rows that use it, so products
+    # loading at the same time on different connections do not assign the same ids. Shared by every connection.
+    id_lock = threading.RLock()
+    # next id handed out by reserve_ids for each (database, schema, table), so ids reserved for rows that are not
+    # inserted yet are not handed out twice (guarded by id_lock)
+    id_counters = {}
+    # schema_validator.schemaValidator for each schema, read from the column metadata once and shared by every
+    # connection
+    validators = {}
+    validators_lock = threading.Lock()
+    # (database, view name) of the chart query views created or found by create_query_views, shared by every connection
+    query_views = set()
+    query_views_lock = threading.Lock()
+
+    def __init__(self, driver, server, database, backend="mssql"):
+        # set up db configuration. backend is one of dbdialects.DB_BACKENDS (for sqlite, database is a file path or
+        # ":memory:" and the gis tables are created if they do not exist). The connection is opened the first time it
+        # is used, and the sql alchemy engine the first time rows are inserted (see __getattr__).
         self.driver = driver
         self.server = server
         self.database = database
-        conn_string = "Driver={" + self.driver + "};Server=" + self.server + ";Trusted_Connection=yes;Database=" + \
-                      self.database + ";"
-        log.info("Connecting to DB: " + conn_string)
-        self.connection = pyodbc.connect(conn_string, autocommit=False)
-        self.cursor = self.connection.cursor()
+        self.dialect = dbdialects.get_dialect(backend, driver, server, database)
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set yet: open the connection (connection, cursor) or set up the
+        # engine (engine) on first use
+        if name in ("connection", "cursor"):
+            self.connection = self.dialect.connect()
+            self.cursor = self.connection.cursor()
+            self.dialect.setup_schema(self.connection)
+        elif name == "engine":
+            # sql alchemy engine for bulk inserts, set up after the connection (which sets up the schema)
+            getattr(self, "connection")
+            log.info("Setting up SQL Alchemy engine.\n")
+            self.engine = self.dialect.create_engine()
+        else:
+            raise AttributeError("'sqlDb' object has no attribute '" + name + "'")
+        return self.__dict__[name]
 
-        # sql alchemy engine for bulk inserts
-        sa_params = urllib.parse.quote(conn_string)
-        log.info("Setting up SQL Alchemy engine.\n")
-        self.engine = create_engine("mssql+pyodbc:///?odbc_connect=%s" % sa_params, fast_executemany=True)
+    def create_query_views(self, views):
+        # Create the gis chart query views (views, view name --> select query from dfhandler.build_query_views) that do
+        # not exist yet. Views already handled by this process are skipped. Returns the number of views checked.
+        with sqlDb.query_views_lock:
+            new_views = {name: query for name, query in views.items() if (self.database, name) not in sqlDb.query_views}
+            try:
+                for name, query in new_views.items():
+                    self.execute_query(self.dialect.create_view_query("gis", name, query), (), "create", name)
+            except self.dialect.errors:
+                self.connection.rollback()
+                raise
+            else:
+                self.connection.commit()
+                sqlDb.query_views.update((self.database, name) for name in new_views)
+        return len(new_views)
 
     def delete_product(self, product_id, is_sibling_product):
         # Delete queries are in order as described in confluence document for deleting a product (product_id).
-        # Sibling tables (is_sibling_product = True) are not deleted b/c this is done with the master product.
+        # Sibling tables (is_sibling_product = True) are not deleted b/c this is done with the master product (the
+        # gis.IndicatorResult rows of siblings are saved under the master product id too).
         # Note: We are not deleting the data from Dimensions, DimensionValues, or IndicatorTheme.
         retval = False
         if is_sibling_product:
             retval = True
         else:
-            pid = str(product_id)
+            pid = (str(product_id),)
             pid_subqry = "SELECT IndicatorId FROM gis.Indicator WHERE IndicatorThemeId = ? "
             qry1 = "DELETE FROM gis.RelatedCharts WHERE RelatedChartId IN (" + pid_subqry + ") "
             qry2 = "DELETE FROM gis.IndicatorMetaData WHERE IndicatorId IN (" + pid_subqry + ") "
@@ -47,34 +90,51 @@ class sqlDb(object):
             qry4 = "DELETE FROM gis.GeographyReferenceForIndicator WHERE IndicatorId in (" + pid_subqry + ") "
             qry5 = "DELETE FROM gis.GeographicLevelForIndicator WHERE IndicatorId in (" + pid_subqry + ") "
             qry6 = "DELETE FROM gis.Indicator WHERE IndicatorThemeId = ?"
+            qry7 = self.dialect.optional_table_query("gis", "IndicatorResult", "DELETE FROM gis.IndicatorResult WHERE "
+                                                                               "IndicatorThemeId = ?")
 
             try:
                 log.info("Deleting from gis.RelatedCharts.")
-                self.cursor.execute(qry1, pid)
+                self.execute_query(qry1, pid, "delete", "RelatedCharts")
                 log.info("Deleting from gis.IndicatorMetaData.")
-                self.cursor.execute(qry2, pid)
+                self.execute_query(qry2, pid, "delete", "IndicatorMetaData")
                 log.info("Deleting from gis.IndicatorValues.")
-                self.cursor.execute(qry3, pid)
+                self.execute_query(qry3, pid, "delete", "IndicatorValues")
                 log.info("Deleting from gis.GeographyReferenceForIndicator.")
-                self.cursor.execute(qry4, pid)
+                self.execute_query(qry4, pid, "delete", "GeographyReferenceForIndicator")
                 log.info("Deleting from gis.GeographyLevelForIndicator.")
-                self.cursor.execute(qry5, pid)
+                self.execute_query(qry5, pid, "delete", "GeographicLevelForIndicator")
                 log.info("Deleting from gis.Indicator.")
-                self.cursor.execute(qry6, pid)
-            except pyodbc.Error as err:
-                self.cursor.rollback()
+                self.execute_query(qry6, pid, "delete", "Indicator")
+                log.info("Deleting from gis.IndicatorResult.")
+                self.execute_query(qry7, pid, "delete", "IndicatorResult")
+            except self.dialect.errors as err:
+                self.connection.rollback()
                 log.error("Could not delete product from database. See detailed message below:")
                 log.error(str(err))
             else:
-                self.cursor.commit()
+                self.connection.commit()
                 retval = True
                 log.info("Successfully deleted product.\n")
         return retval
 
-    def execute_simple_select_query(self, query):
+    def execute_query(self, query, params, operation, table_name):
+        # execute a query with params (tuple, empty for none) on the cursor, timed for the metrics by operation
+        # (ex. "delete") and the main table it uses (table_name)
+        try:
+            with metrics.timed("etl_db_call_seconds", operation=operation, table=table_name):
+                if params:
+                    self.cursor.execute(query, params)
+                else:
+                    self.cursor.execute(query)
+        except self.dialect.errors:
+            metrics.registry.inc("etl_db_errors_total", operation=operation, table=table_name)
+            raise
+
+    def execute_simple_select_query(self, query, table_name=""):
         # execute a simple select query and return a single result, or false if no values
         retval = False
-        self.cursor.execute(query)
+        self.execute_query(query, (), "select", table_name)
         results = self.cursor.fetchall()
         if len(results) == 1:
             retval = results[0][0]
@@ -85,13 +145,13 @@ class sqlDb(object):
         query = "SELECT DimensionValueId, DimensionId, Display_EN, Display_FR, ValueDisplayOrder FROM " \
                 "gis.DimensionValues WHERE DimensionId IN (SELECT DimensionId FROM gis.Dimensions WHERE " \
                 "IndicatorThemeId = ? AND Dimension_EN='Date')"
-        retval = pd.read_sql(query, self.connection, params=[pid])
+        retval = self.read_query_df(query, "DimensionValues", (pid,))
         return retval
 
     def get_date_dimension_id_for_product(self, pid):
         # return the DimensionId for the false "Date" dimension for specified product (pid)
         query = "SELECT DimensionId FROM gis.Dimensions WHERE IndicatorThemeId = " + pid + " AND Dimension_EN='Date'"
-        retval = self.execute_simple_select_query(query)
+        retval = self.execute_simple_select_query(query, "Dimensions")
         return retval
 
     def get_dimensions_and_members_by_product(self, pid):
@@ -102,7 +162,7 @@ class sqlDb(object):
                 "ON dv.DimensionId = d.DimensionId " \
                 "WHERE d.IndicatorThemeId = ? " \
                 "ORDER BY DisplayOrder, ValueDisplayOrder"
-        retval = pd.read_sql(query, self.connection, params=[pid])
+        retval = self.read_query_df(query, "DimensionValues", (pid,))
         return retval
 
     def get_geo_levels(self, pid):
@@ -110,19 +170,19 @@ class sqlDb(object):
         query = "SELECT GeographicLevelId AS GeographicLevelIdExist, IndicatorId AS IndicatorIdExist FROM " \
                 "gis.GeographicLevelForIndicator WHERE IndicatorId IN (SELECT IndicatorId FROM gis.Indicator WHERE " \
                 "IndicatorThemeId = ?)"
-        retval = pd.read_sql(query, self.connection, params=[pid])
+        retval = self.read_query_df(query, "GeographicLevelForIndicator", (pid,))
         return retval
 
     def get_geo_reference_ids(self):
         # return all ids from gis.GeographyReference as a pandas dataframe
         query = "SELECT GeographyReferenceId FROM gis.GeographyReference"
-        retval = pd.read_sql(query, self.connection)
+        retval = self.read_query_df(query, "GeographyReference")
         return retval
 
     def get_indicators(self, pid):
         pid = int(pid)
         query = "SELECT * from gis.Indicator WHERE IndicatorThemeId = ? "
-        retval = pd.read_sql(query, self.connection, params=[pid])
+        retval = self.read_query_df(query, "Indicator", (pid,))
         return retval
 
     def get_indicator_chart_info(self, pid):
@@ -133,19 +193,34 @@ class sqlDb(object):
                 "r.FieldAlias_EN, r.FieldAlias_FR FROM gis.Indicator AS i LEFT JOIN gis.IndicatorMetaData " \
                 "AS im ON i.IndicatorId=im.IndicatorId LEFT JOIN gis.RelatedCharts AS r ON im.IndicatorId = " \
                 "r.RelatedChartId WHERE IndicatorThemeId = ? "
-        retval = pd.read_sql(query, self.connection, params=[pid])
+        retval = self.read_query_df(query, "IndicatorMetaData", (pid,))
+        return retval
+
+    def get_indicator_reference_periods(self, pid):
+        # return each ReferencePeriod in gis.Indicator for the specified product (pid) with its number of indicators
+        query = "SELECT ReferencePeriod, COUNT(*) AS Indicators FROM gis.Indicator WHERE IndicatorThemeId = ? " \
+                "GROUP BY ReferencePeriod"
+        retval = self.read_query_df(query, "Indicator", (int(pid),))
         return retval
 
     def get_indicator_null_reason(self):
         # return all rows from gis.IndicatorNullReason as a pandas dataframe
         query = "SELECT NullReasonId, Symbol FROM gis.IndicatorNullReason WHERE Symbol IS NOT NULL"
-        retval = pd.read_sql(query, self.connection)
+        retval = self.read_query_df(query, "IndicatorNullReason")
+        return retval
+
+    def get_indicator_value_formats(self, pid):
+        # return the distinct DataFormatId/PrimaryChartTypeId of the gis.IndicatorMetaData rows for the specified
+        # product (pid), used to format the values in gis.IndicatorResult
+        query = "SELECT DISTINCT md.DataFormatId, md.PrimaryChartTypeId FROM gis.IndicatorMetaData AS md " \
+                "INNER JOIN gis.Indicator AS i ON md.IndicatorId = i.IndicatorId WHERE i.IndicatorThemeId = ?"
+        retval = self.read_query_df(query, "IndicatorMetaData", (int(pid),))
         return retval
 
     def get_last_date_dimension_display_order(self, dim_id):
         # return last ValueDisplayOrder value for the specified dimension id (dim_id), 0 if none found
         query = "SELECT MAX(ValueDisplayOrder) FROM gis.DimensionValues WHERE DimensionId = ?"
-        self.cursor.execute(query, dim_id)
+        self.execute_query(query, (int(dim_id),), "select", "DimensionValues")
         results = self.cursor.fetchall()
         retval = results[0][0] if len(results) == 1 else None  # store result
         retval = 0 if retval is None else retval  # reset to 0 if no value
@@ -154,10 +229,24 @@ class sqlDb(object):
     def get_last_table_id(self, id_field_name, table_name, schema_name):
         # return highest id for specified field in table (schema_name, table_name, id_field_name), or false if none
         query = "SELECT MAX(" + id_field_name + ") FROM " + schema_name + "." + table_name
-        retval = self.execute_simple_select_query(query)
+        retval = self.execute_simple_select_query(query, table_name)
         retval = 0 if retval is None else retval
         return retval
 
+    def get_validator(self, schema_name):
+        # return the schema validator for schema_name, reading the column metadata the first time
+        with sqlDb.validators_lock:
+            if schema_name not in sqlDb.validators:
+                try:
+                    with metrics.timed("etl_db_call_seconds", operation="select", table="COLUMNS"):
+                        column_rows = self.dialect.read_columns(self.cursor, schema_name)
+                except self.dialect.errors as err:
+                    log.warning("Could not read the " + schema_name + " column metadata. Data frames will not be "
+                                "checked before they are inserted: " + str(err))
+                    column_rows = []
+                sqlDb.validators[schema_name] = sv.schemaValidator(column_rows)
+        return sqlDb.validators[schema_name]
+
     def get_matching_product_list(self, product_list):
         # returns list of product ids that match product_list
         retval = []
@@ -165,23 +254,87 @@ class sqlDb(object):
             in_clause = ', '.join(map(str, product_list))  # flatten list
             query = "SELECT DISTINCT IndicatorThemeID FROM gis.IndicatorTheme WHERE IndicatorThemeID IN (" + \
                     in_clause + ")"
-            self.cursor.execute(query)
+            self.execute_query(query, (), "select", "IndicatorTheme")
             results = self.cursor.fetchall()
             for prod in results:
                 retval.append(prod[0])
         return retval
 
     def insert_dataframe_rows(self, df, table_name, schema_name):
-        # insert dataframe (df) to the database for schema (schema_name) and table (table_name)
+        # insert dataframe (df) to the database for schema (schema_name) and table (table_name), after checking it
+        # against the column metadata (see validate_dataframe)
+        self.validate_dataframe(df, table_name, schema_name)
         try:
-            df.to_sql(name=table_name, con=self.engine, schema=schema_name, if_exists="append", index=False,
-                      chunksize=10000)  # make sure to use default method=None
-        except (pyodbc.Error, exc.SQLAlchemyError) as err:
+            with metrics.timed("etl_db_call_seconds", operation="insert", table=table_name):
+                df.to_sql(name=table_name, con=self.engine, schema=schema_name, if_exists="append", index=False,
+                          chunksize=10000)  # make sure to use default method=None
+        except self.dialect.errors + (exc.SQLAlchemyError,) as err:
+            metrics.registry.inc("etl_db_errors_total", operation="insert", table=table_name)
             log.error("Could not insert to database for table: " + schema_name + "." + table_name +
                                                              ". See detailed message below:")
             log.error(str(err) + "\n")
             raise Exception(str(err))
         else:
+            metrics.registry.inc("etl_rows_inserted_total", df.shape[0], table=table_name)
             ret_val = True
 
         return ret_val
+
+    def read_query_df(self, query, table_name, params=None):
+        # return the results of a select query with params (tuple) as a pandas dataframe, timed for the metrics by the
+        # main table it uses (table_name)
+        try:
+            with metrics.timed("etl_db_call_seconds", operation="select", table=table_name):
+                retval = pd.read_sql(query, self.connection, params=params)
+        except self.dialect.errors:
+            metrics.registry.inc("etl_db_errors_total", operation="select", table=table_name)
+            raise
+        return retval
+
+    def refresh_indicator_results(self, pid, insert_query, new_rows_only):
+        # Refresh the gis.IndicatorResult rows of a product (pid) with insert_query (see
+        # dfhandler.build_indicator_result_query) in one transaction, so the rows being read are never partly replaced.
+        # The old rows are deleted first unless only new rows are added (new_rows_only). Returns the rows inserted.
+        pid = (str(pid),)
+        try:
+            if not new_rows_only:
+                self.execute_query("DELETE FROM gis.IndicatorResult WHERE IndicatorThemeId = ?", pid, "delete",
+                                   "IndicatorResult")
+            self.execute_query(insert_query, pid, "insert", "IndicatorResult")
+        except self.dialect.errors:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+        retval = self.cursor.rowcount
+        metrics.registry.inc("etl_rows_inserted_total", max(retval, 0), table="IndicatorResult")
+        return retval
+
+    def release_ids(self, id_field_name, table_name, schema_name, first_unused_id, end_id):
+        # give back the unused end of a range from reserve_ids (first_unused_id up to end_id), if nothing was reserved
+        # after it, so the next range starts where the inserted ids stopped
+        key = (self.database, schema_name, table_name, id_field_name)
+        with sqlDb.id_lock:
+            if sqlDb.id_counters.get(key) == end_id:
+                sqlDb.id_counters[key] = first_unused_id
+
+    def reserve_ids(self, id_field_name, table_name, schema_name, count):
+        # Reserve count ids for rows of schema_name.table_name that will be inserted later, without holding id_lock
+        # during the insert. Returns the first id of the range: after the highest id in the table and after every range
+        # already reserved in this process.
+        key = (self.database, schema_name, table_name, id_field_name)
+        with sqlDb.id_lock:
+            next_id = max(sqlDb.id_counters.get(key, 0),
+                          self.get_last_table_id(id_field_name, table_name, schema_name) + 1)
+            sqlDb.id_counters[key] = next_id + count
+        return next_id
+
+    def validate_dataframe(self, df, table_name, schema_name):
+        # Check a dataframe (df) against the column types, lengths and nullability of schema_name.table_name before it
+        # is inserted. Raises ValueError listing every offending column with sample rows.
+        try:
+            self.get_validator(schema_name).check(df, table_name, schema_name)
+        except ValueError as err:
+            metrics.registry.inc("etl_db_errors_total", operation="validate", table=table_name)
+            log.error(str(err))
+            raise
@@ -0,0 +1,164 @@
+# product scheduler - runs independent products at the same time. A merged product (master and its siblings from
+# products_to_merge.json) is one unit of work: the master runs first, then the siblings (in turn, or at the same time
+# on their own threads with sibling_workers > 1).
+import concurrent.futures as cf
+import json_handler as jh
+import logging
+import metrics  # for products in progress and finished
+import threading
+import time
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+
+def build_product_units(products_to_update, merged_prod_dict):
+    # Group the products to update into units that must run in order. Siblings are added to the unit of their master
+    # product when the master is also being updated, otherwise each product is its own unit. Units keep the order of
+    # products_to_update (masters always run before their siblings) and duplicate products are dropped.
+    pids_to_update = set(str(pid) for pid in products_to_update)
+    units = []
+    master_units = {}  # master pid (str) --> unit
+    added = set()
+    for pid in products_to_update:
+        pid_str = str(pid)
+        master_pid_str = jh.get_master_prod_id(pid, merged_prod_dict)
+        if pid_str in added or (master_pid_str in pids_to_update and master_pid_str not in master_units):
+            continue  # duplicate, or a sibling listed before its master (added with the master below)
+        if master_pid_str in master_units:
+            master_units[master_pid_str].append(pid)
+        else:
+            unit = [pid]
+            units.append(unit)
+            if jh.is_master_in_merged_product(pid, merged_prod_dict):
+                master_units[pid_str] = unit
+                for sib_pid in products_to_update[:products_to_update.index(pid)]:  # siblings listed before master
+                    if jh.get_master_prod_id(sib_pid, merged_prod_dict) == pid_str and str(sib_pid) not in added:
+                        unit.append(sib_pid)
+                        added.add(str(sib_pid))
+        added.add(pid_str)
+    return units
+
+
+def log_product_stats(product_stats):
+    # log the wall time and queue wait of each product
+    log.info("\nProduct timings (wall time / waited in queue):")
+    for stat in product_stats:
+        status = "" if stat["status"] == "done" else " - " + stat["status"]
+        log.info("  " + str(stat["pid"]) + ": " + f"{stat['wall_seconds']:,.1f}" + "s / " +
+                 f"{stat['wait_seconds']:,.1f}" + "s" + status)
+
+
+def order_units_by_cost(units, product_costs):
+    # Sort units largest first by their estimated rows (product_costs from cost_estimator, by pid). Handing the
+    # largest units to the pool first keeps one big product from starting last and running on its own at the end.
+    return sorted(units, key=lambda unit: sum(product_costs[pid]["rows"] for pid in unit), reverse=True)
+
+
+def run_product_units(units, run_product, workers, product_costs=None, memory_budget=False, sibling_workers=1):
+    # Run each unit of products (from build_product_units) with run_product(pid), using up to workers units at once
+    # and up to sibling_workers siblings of a unit at once. A unit stops at the first product that fails (siblings are
+    # not loaded without their master) but other units carry on. With product_costs (from cost_estimator, by pid) the
+    # largest units start first, products the estimator refused are skipped, and a unit waits to start until its
+    # estimated memory fits in what is left of memory_budget (MB). Returns a list of timings for each product.
+    product_costs = product_costs if product_costs else {}
+    reservation = memoryReservation(memory_budget) if memory_budget and product_costs else None
+    if product_costs:
+        units = order_units_by_cost(units, product_costs)
+
+    queued_time = time.perf_counter()
+    if workers > 1 and len(units) > 1:
+        with cf.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="product") as pool:
+            futures = [pool.submit(run_product_unit, unit, run_product, queued_time, product_costs, reservation,
+                                   sibling_workers) for unit in units]
+            unit_stats = [future.result() for future in futures]
+    else:
+        unit_stats = [run_product_unit(unit, run_product, queued_time, product_costs, reservation, sibling_workers)
+                      for unit in units]
+
+    product_stats = [stat for stats in unit_stats for stat in stats]
+    log_product_stats(product_stats)
+    return product_stats
+
+
+def run_product_unit(unit, run_product, queued_time, product_costs, reservation, sibling_workers=1):
+    # Run the products in a unit in order, or the master and then up to sibling_workers siblings at once (a failed
+    # sibling does not stop the others). Queue wait is measured from when the unit was queued (queued_time), so
+    # siblings include the time spent waiting for their master.
+    unit_mb = unit_memory_mb(unit, product_costs, sibling_workers)
+    if reservation:
+        reservation.reserve(unit_mb)
+    try:
+        if sibling_workers > 1 and len(unit) > 2:
+            unit_stats = [run_unit_product(unit[0], run_product, queued_time, product_costs, False)]
+            master_failed = unit_stats[0]["status"] != "done"
+            with cf.ThreadPoolExecutor(max_workers=sibling_workers, thread_name_prefix="sibling") as pool:
+                unit_stats += list(pool.map(lambda pid: run_unit_product(pid, run_product, queued_time, product_costs,
+                                                                         master_failed), unit[1:]))
+        else:
+            unit_stats = []
+            failed = False
+            for pid in unit:
+                stat = run_unit_product(pid, run_product, queued_time, product_costs, failed)
+                failed = stat["status"] != "done"
+                unit_stats.append(stat)
+    finally:
+        if reservation:
+            reservation.release(unit_mb)
+    return unit_stats
+
+
+def run_unit_product(pid, run_product, queued_time, product_costs, skip):
+    # run one product of a unit (skip is True when the master or an earlier sibling failed) and return its timings
+    start_time = time.perf_counter()
+    stat = {"pid": pid, "wait_seconds": start_time - queued_time, "wall_seconds": 0.0, "status": "done"}
+    if skip:
+        stat["status"] = "skipped (master or earlier sibling failed)"
+        metrics.registry.inc("etl_products_total", status="skipped")
+    elif pid in product_costs and product_costs[pid]["status"] == "refuse":
+        stat["status"] = "refused (over memory budget)"
+        metrics.registry.inc("etl_products_total", status="refused")
+    else:
+        metrics.start_product(pid, product_costs[pid]["rows"] if pid in product_costs else 0)
+        try:
+            run_product(pid)
+        except Exception as err:
+            log.exception("Product " + str(pid) + " failed: " + str(err))
+            stat["status"] = "failed"
+        stat["wall_seconds"] = time.perf_counter() - start_time
+        metrics.finish_product(pid, stat["status"], stat["wall_seconds"])
+    return stat
+
+
+def unit_memory_mb(unit, product_costs, sibling_workers):
+    # estimated memory (MB) of a unit: its largest product, or its largest siblings added up when they load at once
+    unit_mbs = [product_costs[pid]["memory_mb"] for pid in unit if pid in product_costs]
+    retval = max(unit_mbs, default=0)
+    if sibling_workers > 1 and len(unit) > 2:
+        sibling_mbs = sorted((product_costs[pid]["memory_mb"] for pid in unit[1:] if pid in product_costs),
+                             reverse=True)
+        retval = max(retval, sum(sibling_mbs[:sibling_workers]))
+    return retval
+
+
+# noinspection SpellCheckingInspection
+class memoryReservation(object):
+    def __init__(self, memory_budget_mb):
+        # shares the memory budget (MB) between products running at the same time
+        self.budget = memory_budget_mb
+        self.reserved = 0
+        self.condition = threading.Condition()
+
+    def release(self, mb):
+        # give back memory reserved for a unit that has finished
+        with self.condition:
+            self.reserved -= mb
+            self.condition.notify_all()
+
+    def reserve(self, mb):
+        # wait until mb fits in the budget next to the units already running (a unit always runs if it is alone)
+        with self.condition:
+            while self.reserved > 0 and self.reserved + mb > self.budget:
+                self.condition.wait()
+            self.reserved += mb
@@ -0,0 +1,114 @@
+# schema validator - checks data frames against the column metadata of the database tables (types, lengths and
+# nullability) before they are inserted, so a bad column fails the insert right away with every problem listed,
+# instead of partway through a bulk insert.
+import lazy_modules as lm  # for importing numpy and pandas when first used
+import logging
+
+np = lm.lazy_import("numpy")
+pd = lm.lazy_import("pandas")
+
+# set up logger if available
+log = logging.getLogger("etl_log")
+log.addHandler(logging.NullHandler())
+
+# integer types --> (min, max) value
+INTEGER_RANGES = {
+    "bit": (0, 1),
+    "tinyint": (0, 255),
+    "smallint": (-32768, 32767),
+    "int": (-2147483648, 2147483647),
+    "integer": (-9223372036854775808, 9223372036854775807),  # sqlite
+    "bigint": (-9223372036854775808, 9223372036854775807)
+}
+DECIMAL_TYPES = ["decimal", "numeric", "float", "real", "money", "smallmoney"]
+DATE_TYPES = ["date", "datetime", "datetime2", "smalldatetime", "datetimeoffset"]
+STRING_TYPES = ["char", "varchar", "nchar", "nvarchar", "text", "ntext"]
+SAMPLE_ROWS = 3  # offending rows shown for each problem
+
+
+def format_sample(series, mask):
+    # return the index and value of the first SAMPLE_ROWS rows of series where mask is True
+    sample = series[mask].head(SAMPLE_ROWS)
+    return ", ".join("row " + str(idx) + ": " + repr(value if not isinstance(value, str) or len(value) <= 60
+                                                        else value[:60] + "...")
+                     for idx, value in sample.items())
+
+
+def is_text_series(series):
+    # True if the values of a series are strings (object, string or category dtype)
+    return pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype) or \
+        isinstance(series.dtype, pd.CategoricalDtype)
+
+
+# noinspection SpellCheckingInspection
+class schemaValidator(object):
+    def __init__(self, column_rows):
+        # Column rules for each table from the database column metadata (column_rows, list of (table, column, data
+        # type, max length, nullable) from the dialect read_columns). Table and column names are not case sensitive.
+        self.tables = {}
+        for table_name, column_name, data_type, max_length, nullable in column_rows:
+            self.tables.setdefault(table_name.lower(), {})[column_name.lower()] = {
+                "type": data_type.split("(")[0].strip(),  # sqlite declared types may include a length
+                "max_length": max_length if max_length and max_length > 0 else None,  # -1 is (n)varchar(max)
+                "nullable": nullable
+            }
+
+    def check(self, df, table_name, schema_name):
+        # Check every column of a data frame (df) that will be inserted to schema_name.table_name. Raises ValueError
+        # listing all of the problems found (with sample rows), does nothing for tables without column metadata.
+        columns = self.tables.get(table_name.lower())
+        if columns is None or df.shape[0] == 0:
+            return
+        problems = []
+        for column_name in df.columns:
+            rule = columns.get(str(column_name).lower())
+            if rule is None:
+                problems.append(str(column_name) + ": column does not exist in the table")
+            else:
+                problems += [str(column_name) + ": " + problem for problem in self.check_column(df[column_name], rule)]
+        if problems:
+            raise ValueError(str(len(problems)) + " problem(s) found before inserting to " + schema_name + "." +
+                             table_name + ":\n  " + "\n  ".join(problems))
+
+    @staticmethod
+    def check_column(series, rule):
+        # return a list of problems for the values of a column (series) with a column rule (see __init__)
+        problems = []
+        nulls = series.isna().to_numpy()
+        if not rule["nullable"] and nulls.any():
+            problems.append(f"{nulls.sum():,}" + " null value(s) in a NOT NULL column, ex. " +
+                            format_sample(series, nulls))
+        if nulls.all():
+            return problems
+
+        data_type = rule["type"]
+        if data_type in STRING_TYPES and rule["max_length"] and is_text_series(series):
+            too_long = (series.astype("string").str.len() > rule["max_length"]).fillna(False).to_numpy(dtype=bool)
+            if too_long.any():
+                problems.append(f"{too_long.sum():,}" + " value(s) longer than " + str(rule["max_length"]) +
+                                " characters, ex. " + format_sample(series, too_long))
+        elif data_type in INTEGER_RANGES or data_type in DECIMAL_TYPES:
+            values = series
+            if not pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+                values = pd.to_numeric(series.astype("object"), errors="coerce")
+                not_numeric = values.isna().to_numpy() & ~nulls
+                if not_numeric.any():
+                    problems.append(f"{not_numeric.sum():,}" + " value(s) that are not numbers (" + data_type +
+                                    " column), ex. " + format_sample(series, not_numeric))
+            if data_type in INTEGER_RANGES:
+                min_value, max_value = INTEGER_RANGES[data_type]
+                float_values = values.astype("float64").to_numpy()
+                out_of_range = (float_values < min_value) | (float_values > max_value)
+                fractions = ~np.isnan(float_values) & (np.floor(float_values) != float_values)
+                if out_of_range.any():
+                    problems.append(f"{out_of_range.sum():,}" + " value(s) outside the " + data_type + " range, ex. " +
+                                    format_sample(series, out_of_range))
+                if fractions.any():
+                    problems.append(f"{fractions.sum():,}" + " value(s) with decimals in a " + data_type +
+                                    " column, ex. " + format_sample(series, fractions))
+        elif data_type in DATE_TYPES and is_text_series(series):
+            not_dates = pd.to_datetime(series.astype("object"), errors="coerce").isna().to_numpy() & ~nulls
+            if not_dates.any():
+                problems.append(f"{not_dates.sum():,}" + " value(s) that are not dates, ex. " +
+                                format_sample(series, not_dates))
+        return problems
@@ -1,12 +1,31 @@
 # WDS class
 from datetime import datetime
+import lazy_modules as lm  # for importing requests when first used
 import logging
-import requests
+import metrics  # for request latency
+import threading
+
+requests = lm.lazy_import("requests")
 
 # set up logger if available
 log = logging.getLogger("etl_log")
 log.addHandler(logging.NullHandler())
 
+# WDS code set --> serviceWds attribute
+CODE_SET_ATTRIBUTES = {
+    "scalar": "scalar_codes",
+    "frequency": "frequency_codes",
+    "symbol": "symbol_codes",
+    "status": "status_codes",
+    "uom": "uom_codes",
+    "survey": "survey_codes",
+    "subject": "subject_codes",
+    "classificationType": "classification_type_codes",
+    "securityLevel": "security_level_codes",
+    "terminated": "terminated_codes",
+    "wdsResponseStatus": "wds_response_status_codes"
+}
+
 
 def build_metadata_dict(prod_metadata, prod_id):
     # build dictionary of metadata from get_cube_metadata results (prod_metadata), add default values where needed
@@ -85,20 +104,21 @@ class serviceWds(object):
         self.delta_url = delta_url
         self.last_http_req_status = False
 
-        # code sets
+        # code sets, retrieved from WDS the first time one is used (once only, see __getattr__)
         self.code_sets = {}
-        self.scalar_codes = {}
-        self.frequency_codes = {}
-        self.symbol_codes = {}
-        self.status_codes = {}
-        self.uom_codes = {}
-        self.survey_codes = {}
-        self.subject_codes = {}
-        self.classification_type_codes = {}
-        self.security_level_codes = {}
-        self.terminated_codes = {}
-        self.wds_response_status_codes = {}
-        self.get_code_sets()  # retrieved once only
+        self.code_sets_lock = threading.Lock()
+        self.code_sets_retrieved = False
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set yet, ex. uom_codes before the code sets are retrieved. Readers
+        # wait on the lock while the code sets are requested. If the request fails the code set is empty for this read
+        # and is requested again on the next one.
+        if name not in CODE_SET_ATTRIBUTES.values():
+            raise AttributeError("'serviceWds' object has no attribute '" + name + "'")
+        with self.code_sets_lock:
+            if not self.code_sets_retrieved:
+                self.get_code_sets()
+        return self.__dict__.get(name, {})
 
     def check_http_request_status(self, r):
         # Verify http request status.
@@ -127,13 +147,14 @@ class serviceWds(object):
         # str_date - YYYY-MM-DD
         url = self.wds_url + "getChangedCubeList" + "/" + str_date
         log.info("Accessing " + url)
-        r = requests.get(url)
+        r = self.send_request("get", url, "getChangedCubeList")
         self.check_http_request_status(r)
 
         retval = False
         if self.last_http_req_status:
             resp = r.json()
             if resp["status"] != "SUCCESS":
+                metrics.registry.inc("etl_wds_errors_total", operation="getChangedCubeList")
                 log.warning("Changed cube list could not be retrieved. WDS returned: " + str(resp["status"]) +
                             " for Date " + str_date)
             else:
@@ -145,41 +166,28 @@ class serviceWds(object):
         return retval
 
     def get_code_sets(self):
-        # submits WDS request, returns list of code sets
+        # submits WDS request and sets the code set attributes (CODE_SET_ATTRIBUTES) if it succeeds, returns True if
+        # the code sets were retrieved
         url = self.wds_url + "getCodeSets"
         log.info("Retrieving code sets from " + url)
-        r = requests.get(url)
+        r = self.send_request("get", url, "getCodeSets")
         self.check_http_request_status(r)
 
         retval = False
         if self.last_http_req_status:
             resp = r.json()
             if resp["status"] != "SUCCESS":
+                metrics.registry.inc("etl_wds_errors_total", operation="getCodeSets")
                 log.warning("Code set list could not be retrieved. WDS returned: " + str(resp["status"]))
             else:
+                # built first and set together, so other threads never read a code set before it is complete
+                code_sets = {attribute: {} for attribute in CODE_SET_ATTRIBUTES.values()}
                 for set_type in resp["object"]:
-                    if set_type == "scalar":
-                        self.scalar_codes = resp["object"][set_type]
-                    elif set_type == "frequency":
-                        self.frequency_codes = resp["object"][set_type]
-                    elif set_type == "symbol":
-                        self.symbol_codes = resp["object"][set_type]
-                    elif set_type == "status":
-                        self.status_codes = resp["object"][set_type]
-                    elif set_type == "uom":
-                        self.uom_codes = resp["object"][set_type]
-                    elif set_type == "survey":
-                        self.survey_codes = resp["object"][set_type]
-                    elif set_type == "subject":
-                        self.subject_codes = resp["object"][set_type]
-                    elif set_type == "classificationType":
-                        self.classification_type_codes = resp["object"][set_type]
-                    elif set_type == "securityLevel":
-                        self.security_level_codes = resp["object"][set_type]
-                    elif set_type == "terminated":
-                        self.terminated_codes = resp["object"][set_type]
-                    elif set_type == "wdsResponseStatus":
-                        self.wds_response_status_codes = resp["object"][set_type]
+                    if set_type in CODE_SET_ATTRIBUTES:
+                        code_sets[CODE_SET_ATTRIBUTES[set_type]] = resp["object"][set_type]
+                for attribute, code_set in code_sets.items():
+                    setattr(self, attribute, code_set)
+                self.code_sets_retrieved = True
                 retval = True
         return retval
 
@@ -188,13 +196,14 @@ class serviceWds(object):
         url = self.wds_url + "getCubeMetadata"
         post_vars = [{"productId": int(product_id)}]
         log.info("Retrieving " + str(product_id) + " metadata from " + url)
-        r = requests.post(url, json=post_vars)
+        r = self.send_request("post", url, "getCubeMetadata", json=post_vars)
         self.check_http_request_status(r)
 
         retval = False
         if self.last_http_req_status:
             resp = r.json()
             if resp[0]["status"] != "SUCCESS":
+                metrics.registry.inc("etl_wds_errors_total", operation="getCubeMetadata")
                 log.error("Cube metadata could not be retrieved. WDS returned: " + str(resp[0]["status"]) +
                             " for product " + str(product_id))
             else:
@@ -205,7 +214,7 @@ class serviceWds(object):
         # download delta file for relase date(rel_date) and save to file_path
         delta_link = self.delta_url + str(rel_date) + ".zip"
         log.info("Downloading Delta File: " + delta_link)
-        dl_d = requests.get(delta_link)
+        dl_d = self.send_request("get", delta_link, "deltaFile")
         self.check_http_request_status(dl_d)
 
         retval = False
@@ -223,7 +232,7 @@ class serviceWds(object):
         # file_path - location to save the file
         url = self.wds_url + "getFullTableDownloadCSV/" + str(product_id) + "/" + lang_code
         log.info("Retrieving download link from " + url)
-        r = requests.get(url)
+        r = self.send_request("get", url, "getFullTableDownloadCSV")
         self.check_http_request_status(r)
 
         retval = False
@@ -231,11 +240,12 @@ class serviceWds(object):
             resp = r.json()
 
             if resp["status"] != "SUCCESS":
+                metrics.registry.inc("etl_wds_errors_total", operation="getFullTableDownloadCSV")
                 log.warning("Download link could not be retrieved. WDS returned: " + str(resp["status"]) +
                             " for product " + str(product_id) + " " + lang_code)
             else:
                 log.info("Downloading file from " + str(resp["object"]))
-                dl_r = requests.get(resp["object"])  # wds returns a link to the zip file, download it
+                dl_r = self.send_request("get", resp["object"], "fullTableFile")  # wds returns a link to the zip
                 self.check_http_request_status(dl_r)
                 if self.last_http_req_status:
                     if write_file(file_path, dl_r.content, "wb"):
@@ -243,3 +253,16 @@ class serviceWds(object):
                 else:
                     log.warning("The file could not be downloaded.")
         return retval
+
+    def send_request(self, method, url, operation, **kwargs):
+        # send an http request (method "get" or "post") to url, timed for the metrics by WDS operation. Requests that
+        # fail or return an http error are counted as errors.
+        try:
+            with metrics.timed("etl_wds_request_seconds", operation=operation):
+                r = requests.request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.registry.inc("etl_wds_errors_total", operation=operation)
+            raise
+        if r.status_code != requests.codes.ok:
+            metrics.registry.inc("etl_wds_errors_total", operation=operation)
+        return r
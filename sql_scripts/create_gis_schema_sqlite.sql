@@ -0,0 +1,171 @@
+-- gis schema for the SQLite database backend (dbdialects.sqliteDialect). Run on a connection with the gis database
+-- attached. Only the tables and columns used by the ETL and the generated chart queries are created. Existing tables
+-- are left as they are.
+
+CREATE TABLE IF NOT EXISTS gis.IndicatorTheme (
+    IndicatorThemeId INTEGER PRIMARY KEY,
+    IndicatorTheme_EN TEXT,
+    IndicatorTheme_FR TEXT,
+    StatisticsProgramId INTEGER,
+    IndicatorThemeDescription_EN TEXT,
+    IndicatorThemeDescription_FR TEXT,
+    ParentThemeId INTEGER,
+    IndicatorThemeStatus TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.Dimensions (
+    DimensionId INTEGER PRIMARY KEY,
+    IndicatorThemeId INTEGER,
+    Dimension_EN TEXT,
+    Dimension_FR TEXT,
+    DisplayOrder INTEGER,
+    DimensionType TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.DimensionValues (
+    DimensionValueId INTEGER PRIMARY KEY,
+    DimensionId INTEGER,
+    Display_EN TEXT,
+    Display_FR TEXT,
+    ValueDisplayOrder INTEGER,
+    ValueDisplayParent INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS gis.Indicator (
+    IndicatorId INTEGER PRIMARY KEY,
+    IndicatorName_EN TEXT,
+    IndicatorName_FR TEXT,
+    IndicatorThemeID INTEGER,
+    ReleaseIndicatorDate TEXT,
+    ReferencePeriod TEXT,
+    IndicatorCode TEXT,
+    IndicatorDisplay_EN TEXT,
+    IndicatorDisplay_FR TEXT,
+    UOM_EN TEXT,
+    UOM_FR TEXT,
+    Vector TEXT,
+    IndicatorNameLong_EN TEXT,
+    IndicatorNameLong_FR TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.IndicatorValues (
+    IndicatorValueId INTEGER PRIMARY KEY,
+    Value REAL,
+    NullReasonId INTEGER,
+    IndicatorValueCode TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.GeographyReferenceForIndicator (
+    GeographyReferenceId TEXT,
+    IndicatorId INTEGER,
+    IndicatorValueId INTEGER,
+    ReferencePeriod TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.GeographicLevelForIndicator (
+    IndicatorId INTEGER,
+    GeographicLevelId TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.IndicatorMetaData (
+    MetaDataId INTEGER PRIMARY KEY,
+    IndicatorId INTEGER,
+    FieldAlias_EN TEXT,
+    FieldAlias_FR TEXT,
+    DataFormatId INTEGER,
+    DefaultBreaksAlgorithmId INTEGER,
+    DefaultBreaks INTEGER,
+    PrimaryChartTypeId INTEGER,
+    PrimaryQuery TEXT,
+    ColorTo TEXT,
+    ColorFrom TEXT,
+    DimensionUniqueKey TEXT,
+    DefaultRelatedChartId INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS gis.RelatedCharts (
+    RelatedChartId INTEGER PRIMARY KEY,
+    ChartTitle_EN TEXT,
+    ChartTitle_FR TEXT,
+    Query TEXT,
+    ChartTypeId INTEGER,
+    IndicatorMetaDataId INTEGER,
+    DataFormatId INTEGER,
+    FieldAlias_EN TEXT,
+    FieldAlias_FR TEXT
+);
+
+-- reference tables, loaded separately (the ETL only reads them)
+CREATE TABLE IF NOT EXISTS gis.GeographyReference (
+    GeographyReferenceId TEXT PRIMARY KEY,
+    GeographicLevelId TEXT,
+    DisplayNameShort_EN TEXT,
+    DisplayNameShort_FR TEXT,
+    DisplayNameLong_EN TEXT,
+    DisplayNameLong_FR TEXT,
+    ProvTerrName_EN TEXT,
+    ProvTerrName_FR TEXT,
+    Shape BLOB,
+    EntityName_EN TEXT,
+    EntityName_FR TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.GeographicLevel (
+    GeographicLevelId TEXT PRIMARY KEY,
+    LevelName_EN TEXT,
+    LevelName_FR TEXT,
+    LevelDescription_EN TEXT,
+    LevelDescription_FR TEXT
+);
+
+CREATE TABLE IF NOT EXISTS gis.IndicatorNullReason (
+    NullReasonId INTEGER PRIMARY KEY,
+    Symbol TEXT,
+    Description_EN TEXT,
+    Description_FR TEXT
+);
+
+-- formatted rows of the PrimaryQuery join for each product, filled with --result-tables
+CREATE TABLE IF NOT EXISTS gis.IndicatorResult (
+    IndicatorThemeId INTEGER,
+    IndicatorId INTEGER,
+    IndicatorValueId INTEGER,
+    GeographyReferenceId TEXT,
+    Value REAL,
+    FormattedValue_EN TEXT,
+    FormattedValue_FR TEXT,
+    IndicatorName_EN TEXT,
+    IndicatorName_FR TEXT,
+    IndicatorDisplay_EN TEXT,
+    IndicatorDisplay_FR TEXT,
+    UOM_EN TEXT,
+    UOM_FR TEXT,
+    GeographicLevelId TEXT,
+    LevelName_EN TEXT,
+    LevelName_FR TEXT,
+    LevelDescription_EN TEXT,
+    LevelDescription_FR TEXT,
+    Symbol TEXT,
+    NullDescription_EN TEXT,
+    NullDescription_FR TEXT
+);
+
+-- lookups used by the product delete and the chart queries
+CREATE INDEX IF NOT EXISTS gis.IX_Indicator_IndicatorThemeID ON Indicator (IndicatorThemeID);
+CREATE INDEX IF NOT EXISTS gis.IX_Dimensions_IndicatorThemeId ON Dimensions (IndicatorThemeId);
+CREATE INDEX IF NOT EXISTS gis.IX_DimensionValues_DimensionId ON DimensionValues (DimensionId);
+CREATE INDEX IF NOT EXISTS gis.IX_GeographyReferenceForIndicator_IndicatorId ON
+    GeographyReferenceForIndicator (IndicatorId);
+CREATE INDEX IF NOT EXISTS gis.IX_GeographicLevelForIndicator_IndicatorId ON GeographicLevelForIndicator (IndicatorId);
+CREATE INDEX IF NOT EXISTS gis.IX_IndicatorMetaData_IndicatorId ON IndicatorMetaData (IndicatorId);
+CREATE INDEX IF NOT EXISTS gis.IX_IndicatorResult_IndicatorId ON IndicatorResult (IndicatorId);
+CREATE INDEX IF NOT EXISTS gis.IX_IndicatorResult_IndicatorThemeId ON IndicatorResult (IndicatorThemeId);
+CREATE INDEX IF NOT EXISTS gis.IX_IndicatorResult_IndicatorValueId ON IndicatorResult (IndicatorValueId);
+
+-- status symbols from the WDS csv files
+INSERT OR IGNORE INTO gis.IndicatorNullReason (NullReasonId, Symbol, Description_EN, Description_FR) VALUES
+    (1, '..', 'Not available for a specific reference period', 'Indisponible pour une période de référence précise'),
+    (2, '...', 'Not applicable', 'N''ayant pas lieu de figurer'),
+    (3, 'x', 'Suppressed to meet the confidentiality requirements of the Statistics Act',
+     'Confidentiel en vertu des dispositions de la Loi sur la statistique'),
+    (4, 'F', 'Too unreliable to be published', 'Trop peu fiable pour être publié');
@@ -0,0 +1,189 @@
+# synthetic cube - builds WDS shaped cube metadata and a matching full table download (zipped csv) of any size, so
+# the ETL can be benchmarked and run offline without downloading products from WDS.
+# Usage: python synthetic_cube.py --members 10 20 --geos 100 --periods 10 --out-dir C:\temp
+import argparse
+import dfhandler as dfh  # for building the dimension tables
+import itertools as it  # for member combinations
+import json
+import os
+import pandas as pd
+import scwds  # for the product metadata dictionary
+import zipfile
+
+SYNTHETIC_PID = 99999999  # not a real product, "99" is used as the subject code
+PROVINCE_CODES = ["10", "11", "12", "13", "24", "35", "46", "47", "48", "59", "60", "61", "62"]
+STATUS_CYCLE = {50: "..", 97: "x"}  # every nth value has this status symbol and no value
+UOM_CODES = [
+    {"memberUomCode": 223, "memberUomEn": "Number", "memberUomFr": "Nombre"},
+    {"memberUomCode": 239, "memberUomEn": "Percent", "memberUomFr": "Pourcentage"},
+    {"memberUomCode": 81, "memberUomEn": "Dollars", "memberUomFr": "Dollars"},
+    {"memberUomCode": 285, "memberUomEn": "Rate per 100,000 population", "memberUomFr": "Taux pour 100 000 habitants"}
+]
+
+
+def build_cube_metadata(prod_id, members_per_dim, geo_count, periods, start_year=2000):
+    # Return cube metadata shaped like scwds.get_cube_metadata for a product (prod_id) with a Geography dimension of
+    # geo_count members, one dimension for each member count in members_per_dim (ex. [10, 20]) and annual reference
+    # periods from start_year. The last dimension has the unit of measure of each member.
+    geo_members = []
+    for num, geo in enumerate(build_geographies(geo_count), start=1):
+        geo_members.append({"memberId": num, "parentMemberId": None if num == 1 else 1, "memberNameEn": geo["name_en"],
+                            "memberNameFr": geo["name_fr"], "classificationCode": geo["dguid"][9:],
+                            "geoLevel": geo["level"], "vintage": 2016, "terminated": 0, "memberUomCode": None})
+    dims = [{"dimensionPositionId": 1, "dimensionNameEn": "Geography", "dimensionNameFr": "Géographie",
+             "hasUom": False, "member": geo_members}]
+
+    for dim_pos, mem_count in enumerate(members_per_dim, start=2):
+        has_uom = dim_pos == len(members_per_dim) + 1
+        members = []
+        for mem_id in range(1, mem_count + 1):
+            uom_code = UOM_CODES[(mem_id - 1) % len(UOM_CODES)]["memberUomCode"] if has_uom else None
+            members.append({"memberId": mem_id, "parentMemberId": None,
+                            "memberNameEn": "Member " + str(dim_pos) + "-" + str(mem_id),
+                            "memberNameFr": "Membre " + str(dim_pos) + "-" + str(mem_id), "classificationCode": None,
+                            "geoLevel": None, "vintage": None, "terminated": 0, "memberUomCode": uom_code})
+        dims.append({"dimensionPositionId": dim_pos, "dimensionNameEn": "Dimension " + str(dim_pos),
+                     "dimensionNameFr": "Dimension " + str(dim_pos), "hasUom": has_uom, "member": members})
+
+    series = geo_count
+    for mem_count in members_per_dim:
+        series *= mem_count
+    cube_meta = {
+        "responseStatusCode": 0,
+        "productId": str(prod_id),
+        "cubeTitleEn": "Synthetic product " + str(prod_id),
+        "cubeTitleFr": "Produit synthétique " + str(prod_id),
+        "cubeStartDate": str(start_year) + "-01-01",
+        "cubeEndDate": str(start_year + periods - 1) + "-01-01",
+        "frequencyCode": 12,  # annual
+        "nbSeriesCube": series,
+        "nbDatapointsCube": series * periods,
+        "releaseTime": "2021-01-21T08:30",
+        "archiveStatusCode": "2",
+        "subjectCode": [str(prod_id)[:4]],
+        "surveyCode": ["9999"],
+        "dimension": dims,
+        "footnote": []
+    }
+    return cube_meta
+
+
+def build_dimension_member_df(pid_meta, prod_id):
+    # Return the dimensions and members of a product (pid_meta from scwds.build_metadata_dict) shaped like
+    # scdb.get_dimensions_and_members_by_product after a load, including the "Date" dimension.
+    df_dims = dfh.build_dimension_df(pid_meta, prod_id, 1)
+    df_dim_vals = dfh.build_dimension_values_df(pid_meta, df_dims, 1)
+    years = [str(ref_date.year) for ref_date in dfh.build_reference_dates(pid_meta["start_date"],
+                                                                          pid_meta["end_date"], pid_meta["freq"])]
+    df_dates = pd.DataFrame({"Display_EN": years})
+    df_dates["DimensionValueId"] = range(df_dim_vals.shape[0] + 1, df_dim_vals.shape[0] + len(years) + 1)
+    df_dates["DimensionId"] = df_dims.loc[df_dims["Dimension_EN"] == "Date", "DimensionId"].iloc[0]
+    df_dates["ValueDisplayOrder"] = range(1, len(years) + 1)
+
+    df_dm = pd.concat([df_dates, df_dim_vals.drop(columns=["Display_FR"])], ignore_index=True)
+    df_dm["ValueDisplayParent"] = None
+    df_dm = pd.merge(df_dm, df_dims.loc[:, ["DimensionId", "IndicatorThemeId", "Dimension_EN", "DisplayOrder"]],
+                     on="DimensionId", how="inner")
+    df_dm["Display_EN"] = df_dm["Display_EN"].astype(str)
+    df_dm.sort_values(by=["DisplayOrder", "ValueDisplayOrder"], inplace=True, ignore_index=True)
+    return df_dm.loc[:, ["DimensionValueId", "DimensionId", "Display_EN", "ValueDisplayOrder", "ValueDisplayParent",
+                         "IndicatorThemeId", "Dimension_EN", "DisplayOrder"]]
+
+
+def build_geographies(geo_count):
+    # return a list of geo_count geographies (names, DGUID and level): Canada, the provinces and territories, then
+    # census subdivisions spread across the provinces
+    geos = [{"name_en": "Canada", "name_fr": "Canada", "dguid": "2016A000011124", "level": 0}]
+    for code in PROVINCE_CODES[:max(geo_count - 1, 0)]:
+        geos.append({"name_en": "Province " + code, "name_fr": "Province " + code, "dguid": "2016A0002" + code,
+                     "level": 1})
+    for num in range(1, geo_count - len(geos) + 1):
+        code = PROVINCE_CODES[num % len(PROVINCE_CODES)] + str(num).zfill(5)
+        geos.append({"name_en": "Subdivision " + code + ", Province", "name_fr": "Subdivision " + code + ", Province",
+                     "dguid": "2016A0005" + code, "level": 2})
+    return geos
+
+
+def build_geography_reference_df(cube_meta):
+    # return gis.GeographyReference rows for every geography in the cube metadata (cube_meta), to load into a
+    # database (ex. the sqlite backend) or build an indexes.geographyIndex
+    geo_count = len(cube_meta["dimension"][0]["member"])
+    geo_df = pd.DataFrame(build_geographies(geo_count))
+    gr_df = pd.DataFrame({"GeographyReferenceId": geo_df["dguid"], "GeographicLevelId": geo_df["dguid"].str[4:9],
+                          "DisplayNameShort_EN": geo_df["name_en"], "DisplayNameShort_FR": geo_df["name_fr"],
+                          "DisplayNameLong_EN": geo_df["name_en"], "DisplayNameLong_FR": geo_df["name_fr"]})
+    return gr_df
+
+
+def build_product_metadata(cube_meta):
+    # return the product metadata dictionary used by the ETL (see scwds.build_metadata_dict) for cube_meta
+    return scwds.build_metadata_dict(cube_meta, int(cube_meta["productId"]))
+
+
+def write_cube_csv_zip(cube_meta, zip_path):
+    # Write a zipped csv shaped like a WDS full table download of the cube (cube_meta from build_cube_metadata): one
+    # row for each reference year, geography and member combination. Returns the number of data rows written.
+    prod_id = cube_meta["productId"]
+    geo_dim = cube_meta["dimension"][0]
+    other_dims = cube_meta["dimension"][1:]
+    geos = build_geographies(len(geo_dim["member"]))
+    uom_names = {uom["memberUomCode"]: uom["memberUomEn"] for uom in UOM_CODES}
+    header = ["REF_DATE", "GEO", "DGUID"] + [dim["dimensionNameEn"] for dim in other_dims] + \
+             ["UOM", "UOM_ID", "SCALAR_FACTOR", "SCALAR_ID", "VECTOR", "COORDINATE", "VALUE", "STATUS", "SYMBOL",
+              "TERMINATED", "DECIMALS"]
+
+    # the member part of each line only depends on the member combination, build it once
+    combo_parts = []
+    for combo in it.product(*(dim["member"] for dim in other_dims)):
+        uom_code = combo[-1]["memberUomCode"] if other_dims and other_dims[-1]["hasUom"] else 223
+        names = ",".join("\"" + mem["memberNameEn"] + "\"" for mem in combo)
+        uom = "\"" + uom_names.get(uom_code, "Number") + "\"," + str(uom_code) + ",units,0"
+        coordinate = ".".join(str(mem["memberId"]) for mem in combo)
+        combo_parts.append((names, uom, coordinate))
+
+    years = range(int(cube_meta["cubeStartDate"][:4]), int(cube_meta["cubeEndDate"][:4]) + 1)
+    row_count = 0
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(str(prod_id) + ".csv", "w") as csv_file:
+            csv_file.write(("\ufeff" + ",".join(header) + "\n").encode("utf-8"))
+            lines = []
+            for year in years:
+                for geo_num, (geo, geo_mem) in enumerate(zip(geos, geo_dim["member"]), start=1):
+                    geo_part = str(year) + ",\"" + geo["name_en"] + "\"," + geo["dguid"] + ","
+                    for vector_num, (names, uom, coordinate) in enumerate(combo_parts, start=1):
+                        row_count += 1
+                        status = next((sym for nth, sym in STATUS_CYCLE.items() if row_count % nth == 0), "")
+                        value = "" if status else str(round((geo_num * vector_num + year) / 7, 1))
+                        lines.append(geo_part + names + "," + uom + ",v" + str(vector_num * 10000 + geo_num) + "," +
+                                     str(geo_mem["memberId"]) + "." + coordinate + "," + value + "," + status +
+                                     ",,,1")
+                    if len(lines) > 50000:
+                        csv_file.write(("\n".join(lines) + "\n").encode("utf-8"))
+                        lines = []
+            if lines:
+                csv_file.write(("\n".join(lines) + "\n").encode("utf-8"))
+    return row_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic cube metadata (json) and a full table download "
+                                                 "(zipped csv) for offline runs and benchmarks.")
+    parser.add_argument("--pid", type=int, default=SYNTHETIC_PID, help="8 digit product id.")
+    parser.add_argument("--members", type=int, nargs="+", default=[10, 20], help="Number of members in each "
+                                                                                 "dimension other than geography.")
+    parser.add_argument("--geos", type=int, default=100, help="Number of geographies.")
+    parser.add_argument("--periods", type=int, default=10, help="Number of annual reference periods.")
+    parser.add_argument("--start-year", dest="start_year", type=int, default=2000, help="First reference year.")
+    parser.add_argument("--out-dir", dest="out_dir", default=".", help="Folder for the output files.")
+    cube_args = parser.parse_args()
+
+    metadata = build_cube_metadata(cube_args.pid, cube_args.members, cube_args.geos, cube_args.periods,
+                                   cube_args.start_year)
+    with open(os.path.join(cube_args.out_dir, str(cube_args.pid) + "-metadata.json"), "w", encoding="utf-8") as f:
+        json.dump([{"status": "SUCCESS", "object": metadata}], f, ensure_ascii=False, indent=1)
+    with open(os.path.join(cube_args.out_dir, "uom_codes.json"), "w", encoding="utf-8") as f:
+        json.dump(UOM_CODES, f, ensure_ascii=False, indent=1)
+    csv_rows = write_cube_csv_zip(metadata, os.path.join(cube_args.out_dir, str(cube_args.pid) + "-en.zip"))
+    build_geography_reference_df(metadata).to_csv(os.path.join(cube_args.out_dir, "geography_reference.csv"),
+                                                  index=False)
+    print("Wrote " + f"{csv_rows:,}" + " rows for product " + str(cube_args.pid) + " to " + cube_args.out_dir)
@@ -0,0 +1,32 @@
+# tests for accumulators - run from the repository folder with: python -m unittest discover tests
+import accumulators as acc
+import numpy as np
+import pandas as pd
+import unittest
+
+
+# noinspection SpellCheckingInspection
+class uniqueAccumulatorTest(unittest.TestCase):
+    def test_rows_match_concatenated_chunks_without_duplicates(self):
+        chunks = [pd.DataFrame({"IndicatorId": [1, 1, 2, np.nan], "GeographicLevelId": ["A1", "A1", "A2", "A3"],
+                                "Other": [1, 2, 3, 4]}),
+                  pd.DataFrame({"IndicatorId": [3, 2, 1], "GeographicLevelId": ["A1", "A2", "A2"], "Other": [5, 6, 7]})]
+        accumulator = acc.uniqueAccumulator(["IndicatorId", "GeographicLevelId"])
+        for chunk in chunks:
+            accumulator.add(chunk)
+        expected = pd.concat(chunks).loc[:, ["IndicatorId", "GeographicLevelId"]].dropna().drop_duplicates()
+        pd.testing.assert_frame_equal(accumulator.to_df(), expected.reset_index(drop=True))
+
+    def test_values_skip_missing(self):
+        accumulator = acc.uniqueAccumulator(["DGUID"])
+        accumulator.add_values(["b", None, "a"])
+        accumulator.add_values([np.nan, "b", "c"])
+        self.assertEqual(accumulator.to_df()["DGUID"].tolist(), ["b", "a", "c"])
+
+    def test_empty(self):
+        df = acc.uniqueAccumulator(["REF_DATE", "RefYear"]).to_df()
+        self.assertEqual((df.shape, list(df.columns)), ((0, 2), ["REF_DATE", "RefYear"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+# tests for indexes - run from the repository folder with: python -m unittest discover tests
+import indexes as idx
+import unittest
+
+
+# noinspection SpellCheckingInspection
+class codeInternerTest(unittest.TestCase):
+    def test_each_key_is_built_once(self):
+        interner = idx.codeInterner()
+        built = []
+
+        def build(keys):
+            built.append(list(keys))
+            return [key.upper() for key in keys]
+
+        first = interner.get("IndicatorCode", ["a", "b"], build)
+        second = interner.get("IndicatorCode", ["c", "a"], build)
+        self.assertEqual(built, [["a", "b"], ["c"]])
+        self.assertEqual((first.tolist(), second.tolist()), (["A", "B"], ["C", "A"]))
+        self.assertIs(first[0], second[1])  # chunks share the same string objects
+
+    def test_kinds_are_kept_apart(self):
+        interner = idx.codeInterner()
+        interner.get("DGUID", ["a"], lambda keys: ["dguid"] * len(keys))
+        self.assertEqual(interner.get("IndicatorCode", ["a"], lambda keys: ["code"] * len(keys)).tolist(), ["code"])
+
+
+if __name__ == "__main__":
+    unittest.main()
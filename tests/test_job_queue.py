@@ -0,0 +1,91 @@
+# tests for job_queue - run from the repository folder with: python -m unittest discover tests
+import job_queue
+import json
+import os
+import tempfile
+import unittest
+
+
+# noinspection SpellCheckingInspection
+class checkJobTest(unittest.TestCase):
+    def test_valid_jobs(self):
+        for job in [{"prodid": [35100003]}, {"prodid": [35100003, 35100004], "insert": True},
+                    {"start": "2024-01-02", "end": "2024-01-02", "plan_only": True}]:
+            self.assertEqual(job_queue.check_job(job), "", job)
+
+    def test_invalid_jobs(self):
+        for job, ret_msg in [({"prodid": [1], "start": "2024-01-02", "end": "2024-01-05"}, "cannot be combined"),
+                             ({"insert": True}, "required for new products"),
+                             ({"prodid": [1, 2]}, "only be used when inserting"),
+                             ({"start": "2024-01-02"}, "must both be present"),
+                             ({}, "needs prodid OR start and end"),
+                             ({"start": "2024-01-05", "end": "2024-01-02"}, "must be before end date")]:
+            self.assertIn(ret_msg, job_queue.check_job(job), job)
+
+
+# noinspection SpellCheckingInspection
+class queueFolderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_jobs_are_claimed_in_submit_order(self):
+        paths = [job_queue.submit_job(self.queue_dir, {"prodid": [pid]}) for pid in [3, 1, 2]]
+        self.assertEqual(sorted(os.listdir(os.path.join(self.queue_dir, "pending"))),
+                         [os.path.basename(path) for path in paths])
+        self.assertEqual([f for f in os.listdir(self.queue_dir) if f.endswith(".tmp")], [])
+        claimed = []
+        running_path, job = job_queue.claim_next_job(self.queue_dir)
+        while running_path is not None:
+            self.assertEqual(os.path.dirname(running_path), os.path.join(self.queue_dir, "running"))
+            claimed.append(job["prodid"][0])
+            job_queue.finish_job(self.queue_dir, running_path, job, "done" if job["prodid"][0] != 1 else "failed",
+                                 "", [{"pid": job["prodid"][0], "status": "done"}])
+            running_path, job = job_queue.claim_next_job(self.queue_dir)
+        self.assertEqual(claimed, [3, 1, 2])
+        self.assertEqual(len(os.listdir(os.path.join(self.queue_dir, "done"))), 2)
+        failed = os.listdir(os.path.join(self.queue_dir, "failed"))
+        with open(os.path.join(self.queue_dir, "failed", failed[0]), encoding="utf-8") as job_file:
+            result = json.load(job_file)["result"]
+        self.assertEqual((result["status"], result["products"]), ("failed", [{"pid": 1, "status": "done"}]))
+
+    def test_invalid_job_file_fails_and_the_next_job_is_claimed(self):
+        job_queue.setup_queue(self.queue_dir)
+        with open(os.path.join(self.queue_dir, "pending", "0-bad.json"), "w", encoding="utf-8") as job_file:
+            job_file.write("{not json")
+        job_queue.submit_job(self.queue_dir, {"prodid": [1]})
+        running_path, job = job_queue.claim_next_job(self.queue_dir)
+        self.assertEqual(job, {"prodid": [1]})
+        self.assertEqual(os.listdir(os.path.join(self.queue_dir, "failed")), ["0-bad.json"])
+
+    def test_empty_queue(self):
+        job_queue.setup_queue(self.queue_dir)
+        self.assertEqual(job_queue.claim_next_job(self.queue_dir), (None, None))
+
+    def test_only_one_daemon_holds_the_queue_lock(self):
+        job_queue.setup_queue(self.queue_dir)
+        lock_file = job_queue.lock_queue(self.queue_dir)
+        self.assertIsNotNone(lock_file)
+        try:
+            self.assertIsNone(job_queue.lock_queue(self.queue_dir))
+        finally:
+            lock_file.close()
+        lock_file = job_queue.lock_queue(self.queue_dir)  # released when the daemon closes it
+        self.assertIsNotNone(lock_file)
+        lock_file.close()
+
+    def test_serve_returns_if_the_queue_is_locked(self):
+        job_queue.setup_queue(self.queue_dir)
+        lock_file = job_queue.lock_queue(self.queue_dir)
+        try:
+            with self.assertLogs("etl_log", "ERROR"):
+                job_queue.serve(None, self.queue_dir, 0)  # returns before the service is used
+        finally:
+            lock_file.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+# tests for master_cache - run from the repository folder with: python -m unittest discover tests
+import concurrent.futures as cf
+import master_cache
+import os
+import pandas as pd
+import scdb
+import tempfile
+import unittest
+
+MASTER_PID = 100
+
+
+# noinspection SpellCheckingInspection
+class masterCacheTest(unittest.TestCase):
+    def setUp(self):
+        # master product with 2 indicators at level A0001, and a "Date" dimension with 2020
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = scdb.sqlDb("", "", os.path.join(self.tmp_dir.name, "gis.db"), "sqlite")
+        self.db.insert_dataframe_rows(pd.DataFrame({"IndicatorId": [1, 2], "IndicatorThemeID": [MASTER_PID] * 2,
+                                                    "IndicatorCode": ["c1", "c2"], "UOM_EN": ["n"] * 2,
+                                                    "UOM_FR": ["n"] * 2}), "Indicator", "gis")
+        self.db.insert_dataframe_rows(pd.DataFrame({"IndicatorId": [1, 2], "GeographicLevelId": ["A0001"] * 2}),
+                                      "GeographicLevelForIndicator", "gis")
+        self.db.insert_dataframe_rows(pd.DataFrame({"DimensionId": [7], "IndicatorThemeId": [MASTER_PID],
+                                                    "Dimension_EN": ["Date"]}), "Dimensions", "gis")
+        self.db.insert_dataframe_rows(pd.DataFrame({"DimensionValueId": [30], "DimensionId": [7],
+                                                    "Display_EN": ["2020"], "ValueDisplayOrder": [1]}),
+                                      "DimensionValues", "gis")
+        self.cache = master_cache.masterCache(self.db, str(MASTER_PID))
+
+    def tearDown(self):
+        self.db.connection.close()
+        self.db.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def query(self, sql):
+        return self.db.cursor.execute(sql).fetchall()
+
+    def test_master_state_is_read_once(self):
+        self.assertEqual(self.cache.ind_index.get_indicator_ids(pd.Series(["c2", "c9"])).tolist()[0], 2)
+        self.assertEqual(self.cache.date_dimension_id, 7)
+        self.assertEqual(self.cache.geo_levels.shape[0], 2)
+
+    def test_siblings_only_add_levels_that_are_not_loaded(self):
+        sibling_levels = [pd.DataFrame({"IndicatorId": [1, 1], "GeographicLevelId": ["A0001", "A0002"]}),
+                          pd.DataFrame({"IndicatorId": [1, 2], "GeographicLevelId": ["A0002", "A0002"]})]
+        with cf.ThreadPoolExecutor(max_workers=2) as pool:
+            inserted = list(pool.map(lambda geo_df: self.cache.add_geo_levels(self.db, geo_df), sibling_levels))
+        self.assertEqual(sum(inserted), 2)
+        self.assertEqual(self.query("SELECT IndicatorId, GeographicLevelId FROM gis.GeographicLevelForIndicator "
+                                    "ORDER BY 2, 1"), [(1, "A0001"), (2, "A0001"), (1, "A0002"), (2, "A0002")])
+
+    def test_siblings_only_add_new_reference_dates(self):
+        sibling_dates = [pd.DataFrame({"REF_DATE": ["2020", "2021"], "RefYear": [2020, 2021]}),
+                         pd.DataFrame({"REF_DATE": ["2021", "2022"], "RefYear": [2021, 2022]})]
+        inserted = [self.cache.add_ref_dates(self.db, ref_dates) for ref_dates in sibling_dates]
+        self.assertEqual(inserted, [1, 1])
+        self.assertEqual(self.query("SELECT DimensionValueId, Display_EN, ValueDisplayOrder FROM gis.DimensionValues "
+                                    "ORDER BY 1"), [(30, "2020", 1), (31, "2021", 2), (32, "2022", 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
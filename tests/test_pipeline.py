@@ -0,0 +1,118 @@
+# tests for pipeline - run from the repository folder with: python -m unittest discover tests
+import concurrent.futures as cf
+import csv_handler
+import dfhandler as dfh
+import helpers as h
+import indexes as idx
+import memory_governor as mg
+import os
+import pandas as pd
+import pipeline
+import scdb
+import synthetic_cube as sc
+import tempfile
+import unittest
+
+
+# noinspection SpellCheckingInspection
+class initWorkerTest(unittest.TestCase):
+    def test_worker_warning_reaches_log(self):
+        # a warning logged in a transform worker process is written to the log file of the main process
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            h.setup_logger(tmp_dir, "etl_log")
+            try:
+                with cf.ProcessPoolExecutor(max_workers=1, initializer=pipeline.init_worker,
+                                            initargs=({}, h.get_worker_log_queue("etl_log"))) as pool:
+                    ref_year = pool.submit(h.fix_ref_year, "17-18").result()
+            finally:
+                h.stop_logger("etl_log")
+            with open(os.path.join(tmp_dir, "etl_log.log")) as log_file:
+                log_text = log_file.read()
+
+        self.assertEqual(ref_year, 1900)
+        self.assertIn("WARNING:Invalid Reference Year: 17-18", log_text)
+
+
+# noinspection SpellCheckingInspection
+class runChunkPipelineTest(unittest.TestCase):
+    def test_unmatched_dguids_get_unique_ids(self):
+        # chunks with DGUIDs that are not in gis.GeographyReference must not reuse the ids of the chunks before them
+        pid = sc.SYNTHETIC_PID
+        cube_meta = sc.build_cube_metadata(pid, [3, 4], 20, 3)
+        pid_meta = sc.build_product_metadata(cube_meta)
+        ref_dates = dfh.build_reference_dates(pid_meta["start_date"], pid_meta["end_date"], pid_meta["freq"])
+        df_ind = dfh.build_indicator_df(pid, pid_meta["release_date"], pid_meta["dimensions_and_members"],
+                                        sc.UOM_CODES, ref_dates, 1, False, [])
+        geo_ref_df = sc.build_geography_reference_df(cube_meta).iloc[3:]  # 3 DGUIDs without a GeographyReference
+        df_null = pd.DataFrame({"NullReasonId": [1, 2, 3, 4], "Symbol": ["..", "...", "x", "F"]})
+        ctx = pipeline.build_chunk_context(str(pid), pid_meta["release_date"], False, [], False,
+                                           idx.indicatorIndex(df_ind), idx.geographyIndex(geo_ref_df), df_null)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, str(pid) + "-en.zip")
+            file_rows = sc.write_cube_csv_zip(cube_meta, zip_path)
+            col_dict = dfh.build_column_and_type_dict(pid_meta["dimension_names"]["en"])
+            db = scdb.sqlDb("", "", os.path.join(tmp_dir, "gis.db"), "sqlite")
+            chunks = csv_handler.read_csv_chunks(zip_path, str(pid) + ".csv", col_dict, 500)
+            governor = mg.memoryGovernor(False, 500)
+            governor.start()
+            try:
+                totals = pipeline.run_chunk_pipeline(chunks, ctx, db, governor, 0, pipeline.idRange(db, file_rows))
+            finally:
+                governor.stop()
+            iv_ids = db.cursor.execute("SELECT COUNT(*), COUNT(DISTINCT IndicatorValueId) FROM "
+                                       "gis.IndicatorValues").fetchone()
+            gri_ids = db.cursor.execute("SELECT COUNT(*), COUNT(DISTINCT IndicatorValueId) FROM "
+                                        "gis.GeographyReferenceForIndicator").fetchone()
+            db.connection.close()
+            db.engine.dispose()
+
+        self.assertEqual(totals["iv_rows"], file_rows - file_rows * 3 // 20)
+        self.assertEqual(iv_ids, (totals["iv_rows"], totals["iv_rows"]))
+        self.assertEqual(gri_ids, (totals["iv_rows"], totals["iv_rows"]))
+
+
+# noinspection SpellCheckingInspection
+class idRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = scdb.sqlDb("", "", os.path.join(self.tmp_dir.name, "gis.db"), "sqlite")
+        self.db.insert_dataframe_rows(pd.DataFrame({"IndicatorValueId": [50]}), "IndicatorValues", "gis")
+
+    def tearDown(self):
+        self.db.connection.close()
+        self.db.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_chunks_take_ids_in_order_after_the_table(self):
+        id_range = pipeline.idRange(self.db, 10)  # 51 to 60
+        self.assertEqual([id_range.take(4), id_range.take(6)], [51, 55])
+        self.assertEqual(id_range.take(3), 61)  # did not fit, reserves its own ids
+        id_range.release()
+        self.assertEqual(pipeline.idRange(self.db, 5).next_id, 64)
+
+    def test_unused_ids_are_given_back(self):
+        id_range = pipeline.idRange(self.db, 100)
+        id_range.take(30)
+        id_range.release()
+        id_range.release()  # nothing left to give back
+        self.assertEqual(pipeline.idRange(self.db, 5).next_id, 81)
+
+    def test_ranges_loading_at_the_same_time_do_not_overlap(self):
+        # each product keeps its own range, ids reserved after a range are never given back (a gap is left instead)
+        master_range = pipeline.idRange(self.db, 10)  # 51 to 60
+        sibling_range = pipeline.idRange(self.db, 10)  # 61 to 70
+        master_ids = [master_range.take(8), master_range.take(5)]  # the second chunk does not fit
+        sibling_ids = [sibling_range.take(10)]
+        master_range.release()
+        sibling_range.release()
+        self.assertEqual((master_ids, sibling_ids), ([51, 71], [61]))
+        self.assertEqual(pipeline.idRange(self.db).take(1), 76)
+
+    def test_product_without_reserved_ids(self):
+        id_range = pipeline.idRange(self.db)
+        self.assertEqual([id_range.take(2), id_range.take(2)], [51, 53])
+
+
+if __name__ == "__main__":
+    unittest.main()
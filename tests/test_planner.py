@@ -0,0 +1,78 @@
+# tests for planner - run from the repository folder with: python -m unittest discover tests
+import pandas as pd
+import planner
+import unittest
+
+MERGED_PRODUCTS = {"100": {"linked_tables": ["101", "102"]}}  # products_to_merge.json: master 100, siblings 101/102
+
+
+# noinspection SpellCheckingInspection
+class buildChangeSetTest(unittest.TestCase):
+    def test_product_released_on_several_days_is_updated_once(self):
+        change_set = planner.build_change_set([("2024-01-02", [5, 6]), ("2024-01-03", [6]), ("2024-01-04", [5, 6])],
+                                              MERGED_PRODUCTS)
+        self.assertEqual(change_set, [
+            {"pid": 5, "release_dates": ["2024-01-02", "2024-01-04"], "master_pid": None},
+            {"pid": 6, "release_dates": ["2024-01-02", "2024-01-03", "2024-01-04"], "master_pid": None}])
+
+    def test_changed_sibling_brings_in_merged_product_master_first(self):
+        change_set = planner.build_change_set([("2024-01-02", [7, 102]), ("2024-01-03", [100])], MERGED_PRODUCTS)
+        self.assertEqual([entry["pid"] for entry in change_set], [7, 100, 101, 102])
+        self.assertEqual([entry["release_dates"] for entry in change_set],
+                         [["2024-01-02"], ["2024-01-03"], [], ["2024-01-02"]])
+        self.assertEqual([entry["master_pid"] for entry in change_set], [None, 100, 100, 100])
+        self.assertEqual(planner.describe_change(change_set[2]), "merged product 100 changed")
+        self.assertEqual(planner.describe_change(change_set[3]), "released 2024-01-02 (merged product 100)")
+
+    def test_same_day_listed_twice_is_kept_once(self):
+        change_set = planner.build_change_set([("2024-01-02", [101, 101])], MERGED_PRODUCTS)
+        self.assertEqual([(entry["pid"], entry["release_dates"]) for entry in change_set],
+                         [(100, []), (101, ["2024-01-02"]), (102, [])])
+
+    def test_no_changes(self):
+        self.assertEqual(planner.build_change_set([("2024-01-02", []), ("2024-01-03", [])], MERGED_PRODUCTS), [])
+
+
+# noinspection SpellCheckingInspection
+class checkPeriodAppendTest(unittest.TestCase):
+    def setUp(self):
+        # 2 periods loaded with 6 indicators each
+        self.existing_periods_df = pd.DataFrame({"ReferencePeriod": ["2021-01-01", "2022-01-01"], "Indicators": [6, 6]})
+
+    def test_new_periods_after_the_loaded_ones_can_be_appended(self):
+        new_ref_dates = pd.DatetimeIndex(["2023-01-01", "2024-01-01"])
+        self.assertEqual(planner.check_period_append(new_ref_dates, self.existing_periods_df, 6), "")
+
+    def test_product_not_loaded_yet(self):
+        ret_msg = planner.check_period_append(pd.DatetimeIndex(["2023-01-01"]),
+                                              self.existing_periods_df.iloc[0:0], 6)
+        self.assertIn("no reference periods are loaded", ret_msg)
+
+    def test_no_new_periods(self):
+        ret_msg = planner.check_period_append(pd.DatetimeIndex([]), self.existing_periods_df, 6)
+        self.assertIn("no new reference periods", ret_msg)
+
+    def test_new_period_before_the_latest_loaded_period(self):
+        new_ref_dates = pd.DatetimeIndex(["2021-06-01", "2023-01-01"])  # fills a gap
+        ret_msg = planner.check_period_append(new_ref_dates, self.existing_periods_df, 6)
+        self.assertIn("2021-06-01 is not after the latest loaded period 2022-01-01", ret_msg)
+
+    def test_changed_dimension_members(self):
+        ret_msg = planner.check_period_append(pd.DatetimeIndex(["2023-01-01"]), self.existing_periods_df, 8)
+        self.assertIn("dimension members changed (8 indicators per period, 6 loaded", ret_msg)
+
+
+# noinspection SpellCheckingInspection
+class findNewReferenceDatesTest(unittest.TestCase):
+    def test_only_dates_not_loaded_from_the_minimum_year(self):
+        ref_dates = pd.date_range("2019-01-01", "2024-01-01", freq="AS")
+        existing_periods_df = pd.DataFrame({"ReferencePeriod": ["2021-01-01 00:00:00", "2022-01-01"],
+                                            "Indicators": [6, 6]})
+        new_dates = planner.find_new_reference_dates(ref_dates, existing_periods_df, 2020, "100", [])
+        self.assertEqual([dt.strftime("%Y-%m-%d") for dt in new_dates], ["2020-01-01", "2023-01-01", "2024-01-01"])
+        justice_dates = planner.find_new_reference_dates(ref_dates, existing_periods_df, 2020, "100", [100])
+        self.assertEqual(len(justice_dates), 4)  # mixed geo justice products keep every year
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# tests for scdb and dbdialects - run from the repository folder with: python -m unittest discover tests
+import dbdialects
+import os
+import pandas as pd
+import scdb
+import tempfile
+import unittest
+
+
+# noinspection SpellCheckingInspection
+class mssqlDialectTest(unittest.TestCase):
+    @unittest.skipIf(dbdialects.pyodbc is None, "pyodbc is not installed")
+    def test_pyodbc_is_not_imported_before_it_is_used(self):
+        imported = dbdialects.pyodbc.module is not None  # by an earlier test
+        scdb.sqlDb("ODBC Driver 17 for SQL Server", "server", "database", "mssql")
+        self.assertEqual(dbdialects.pyodbc.module is not None, imported)
+
+
+# noinspection SpellCheckingInspection
+class sqliteDialectTest(unittest.TestCase):
+    def format_values(self, values, format_code, loc_code):
+        # format each of values with the sqlite format_number sql
+        dialect = dbdialects.sqliteDialect(":memory:")
+        connection = dialect.connect()
+        query = "SELECT " + dialect.format_number(":value", format_code, loc_code)
+        retval = [connection.execute(query, {"value": value}).fetchone()[0] for value in values]
+        connection.close()
+        return retval
+
+    def test_format_number_matches_mssql_format(self):
+        # same text as Format(value, 'N', loc_code) on SQL Server: grouped digits, 2 decimals, rounded
+        values = [1234567.891, -1234.5, 0.5, 999.995, -0.001, 12]
+        self.assertEqual(self.format_values(values, "N", "en-US"),
+                         ["1,234,567.89", "-1,234.50", "0.50", "1,000.00", "0.00", "12.00"])
+        self.assertEqual(self.format_values(values, "N", "fr-CA"),
+                         ["1 234 567,89", "-1 234,50", "0,50", "1 000,00", "0,00", "12,00"])
+        self.assertEqual(self.format_values([1234.5, 3], "N0", "en-US"), ["1,235", "3"])
+
+    def test_format_number_rejects_other_formats(self):
+        with self.assertRaises(ValueError):
+            self.format_values([1], "C0", "en-US")
+
+
+# noinspection SpellCheckingInspection
+class sqlDbTest(unittest.TestCase):
+    def test_delete_product_deletes_indicator_results(self):
+        # the materialized rows of a product are deleted with its indicators, other products keep theirs
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = scdb.sqlDb("", "", os.path.join(tmp_dir, "gis.db"), "sqlite")
+            db.insert_dataframe_rows(pd.DataFrame({"IndicatorThemeId": [10, 10, 20], "IndicatorId": [1, 2, 3],
+                                                   "IndicatorValueId": [1, 2, 3], "GeographyReferenceId": ["A"] * 3}),
+                                     "IndicatorResult", "gis")
+            deleted = db.delete_product(10, False)
+            sibling_deleted = db.delete_product(20, True)  # deleted with its master product
+            theme_ids = db.cursor.execute("SELECT IndicatorThemeId FROM gis.IndicatorResult").fetchall()
+            db.connection.close()
+            db.engine.dispose()
+
+        self.assertTrue(deleted)
+        self.assertTrue(sibling_deleted)
+        self.assertEqual(theme_ids, [(20,)])
+
+    def test_reserved_ids_are_shared_by_connections_and_only_the_last_range_is_released(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "gis.db")
+            db = scdb.sqlDb("", "", db_path, "sqlite")
+            other_db = scdb.sqlDb("", "", db_path, "sqlite")  # ex. the connection of another sibling thread
+            db.insert_dataframe_rows(pd.DataFrame({"DimensionValueId": [9]}), "DimensionValues", "gis")
+            first_ids = [db.reserve_ids("DimensionValueId", "DimensionValues", "gis", 10),
+                         other_db.reserve_ids("DimensionValueId", "DimensionValues", "gis", 10)]
+            other_db.release_ids("DimensionValueId", "DimensionValues", "gis", 25, 30)
+            db.release_ids("DimensionValueId", "DimensionValues", "gis", 12, 20)  # ids after it are reserved
+            next_id = db.reserve_ids("DimensionValueId", "DimensionValues", "gis", 1)
+            other_table_id = db.reserve_ids("IndicatorValueId", "IndicatorValues", "gis", 1)
+            for sql_db in [db, other_db]:
+                sql_db.connection.close()
+                sql_db.engine.dispose()
+
+        self.assertEqual(first_ids, [10, 20])
+        self.assertEqual(next_id, 25)
+        self.assertEqual(other_table_id, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
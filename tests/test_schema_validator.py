@@ -0,0 +1,78 @@
+# tests for schema_validator - run from the repository folder with: python -m unittest discover tests
+import numpy as np
+import pandas as pd
+import schema_validator as sv
+import unittest
+
+# (table, column, data type, max length, nullable) like the mssql read_columns
+COLUMN_ROWS = [("Indicator", "IndicatorId", "bigint", None, False),
+               ("Indicator", "IndicatorCode", "nvarchar", 10, True),
+               ("Indicator", "IndicatorName_EN", "nvarchar", -1, True),  # nvarchar(max)
+               ("Indicator", "GeographicLevelId", "smallint", None, True),
+               ("Indicator", "ReferencePeriod", "datetime", None, True),
+               ("Indicator", "Value", "float", None, True)]
+
+
+# noinspection SpellCheckingInspection
+class schemaValidatorTest(unittest.TestCase):
+    def setUp(self):
+        self.validator = sv.schemaValidator(COLUMN_ROWS)
+
+    def check_problems(self, df):
+        # return the problem lines of the ValueError raised by check, or [] if there are none
+        try:
+            self.validator.check(df, "indicator", "gis")  # table names are not case sensitive
+        except ValueError as err:
+            return str(err).split("\n  ")[1:]
+        return []
+
+    def test_valid_rows_pass(self):
+        df = pd.DataFrame({"IndicatorId": [1, 2], "INDICATORCODE": ["a.b", None], "IndicatorName_EN": ["x" * 5000, ""],
+                           "GeographicLevelId": [32767, None], "ReferencePeriod": ["2024-01-01", None],
+                           "Value": [1.5, np.nan]})
+        self.assertEqual(self.check_problems(df), [])
+
+    def test_null_in_not_null_column(self):
+        problems = self.check_problems(pd.DataFrame({"IndicatorId": [1, None, None]}))
+        self.assertEqual(problems, ["IndicatorId: 2 null value(s) in a NOT NULL column, ex. row 1: nan, row 2: nan"])
+
+    def test_value_longer_than_the_column(self):
+        df = pd.DataFrame({"IndicatorCode": ["1.2.3", "1.2.3.4.5.6", None]}, dtype="category")
+        problems = self.check_problems(df)
+        self.assertEqual(problems, ["IndicatorCode: 1 value(s) longer than 10 characters, ex. row 1: '1.2.3.4.5.6'"])
+
+    def test_integer_range_and_decimals(self):
+        problems = self.check_problems(pd.DataFrame({"GeographicLevelId": [1, 40000, -40000, 2.5]}))
+        self.assertEqual(problems, ["GeographicLevelId: 2 value(s) outside the smallint range, ex. row 1: 40000.0, "
+                                    "row 2: -40000.0",
+                                    "GeographicLevelId: 1 value(s) with decimals in a smallint column, ex. row 3: 2.5"])
+
+    def test_text_in_number_and_date_columns(self):
+        df = pd.DataFrame({"Value": ["1.5", "abc"], "ReferencePeriod": ["2024-01-01", "not a date"]})
+        self.assertEqual(self.check_problems(df), [
+            "Value: 1 value(s) that are not numbers (float column), ex. row 1: 'abc'",
+            "ReferencePeriod: 1 value(s) that are not dates, ex. row 1: 'not a date'"])
+
+    def test_every_problem_is_listed(self):
+        df = pd.DataFrame({"IndicatorId": [None], "Unknown": [1], "GeographicLevelId": [99999]})
+        with self.assertRaises(ValueError) as raised:
+            self.validator.check(df, "Indicator", "gis")
+        self.assertTrue(str(raised.exception).startswith("3 problem(s) found before inserting to gis.Indicator:"))
+        self.assertIn("Unknown: column does not exist in the table", str(raised.exception))
+
+    def test_tables_without_metadata_and_empty_frames_are_not_checked(self):
+        self.validator.check(pd.DataFrame({"Anything": [None]}), "OtherTable", "gis")
+        self.validator.check(pd.DataFrame({"IndicatorId": pd.Series([], dtype="float64")}), "Indicator", "gis")
+        sv.schemaValidator([]).check(pd.DataFrame({"IndicatorId": [None]}), "Indicator", "gis")
+
+    def test_sqlite_declared_types(self):
+        # sqlite types may include a length and have no max length
+        validator = sv.schemaValidator([("Indicator", "IndicatorCode", "varchar(10)", None, True),
+                                        ("Indicator", "IndicatorId", "integer", None, False)])
+        validator.check(pd.DataFrame({"IndicatorCode": ["x" * 20], "IndicatorId": [2 ** 40]}), "Indicator", "gis")
+        with self.assertRaises(ValueError):
+            validator.check(pd.DataFrame({"IndicatorId": [1.5]}), "Indicator", "gis")
+
+
+if __name__ == "__main__":
+    unittest.main()